@@ -0,0 +1,67 @@
+"""
+Backfills a wallet's transaction history over a date range into local storage.
+Requires a running Tor client.
+"""
+import os
+import sys
+
+from datetime import (
+    datetime,
+    timedelta,
+    timezone,
+)
+
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.debank import iter_txn_pages
+from src.cryptowallets.state import StateStore
+from src.cryptowallets.common.variables import state_file
+
+
+def backfill_history(address: str, from_date: datetime, to_date: datetime, path: str = state_file) -> int:
+    """
+    Saves all txns of a wallet between two dates into the state store's history table.
+
+    :param address: Wallet address, eg. 0xsa76d57519dbfe34a25eef1923b259ab05986b26
+    :param from_date: First day to backfill, UTC
+    :param to_date: Last day to backfill, UTC
+    :param path: SQLite file to save txns to
+    :returns: Number of txns saved
+    """
+    from_time = from_date.replace(tzinfo=timezone.utc).timestamp()
+    to_time = (to_date + timedelta(days=1)).replace(tzinfo=timezone.utc).timestamp()
+
+    store = StateStore(path)
+    wallet = Wallet(address, address)
+
+    # DeBank pages are sequential - each page's start_time is the oldest txn of the page before
+    total = 0
+    for page in iter_txn_pages(wallet, until_time=from_time, start_time=to_time, max_pages=10000):
+        if not page.history_list:
+            break
+
+        txns = [txn for txn in page.history_list if from_time <= txn.time_at < to_time]
+
+        store.save_history(address, txns)
+        store.save_metadata(page)
+
+        total += len(txns)
+        print(f"Saved {total} txns, reached {datetime.fromtimestamp(page.history_list[-1].time_at)}")
+
+    store.close()
+
+    return total
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 4:
+        sys.exit(f"Usage: python3 {os.path.basename(__file__)} <address> <from_date> <to_date>\n"
+                 f"Dates are in YYYY-MM-DD format, eg. 2022-10-31\n")
+
+    wallet_address = sys.argv[1]
+    start_date = datetime.strptime(sys.argv[2], "%Y-%m-%d")
+    end_date = datetime.strptime(sys.argv[3], "%Y-%m-%d")
+
+    count = backfill_history(wallet_address, start_date, end_date)
+
+    print(f"Backfilled {count} txns of {wallet_address} into {state_file}")
@@ -0,0 +1,91 @@
+"""
+Shared pytest setup. Being at the project root, it also puts the root on sys.path so that 'src' is importable.
+"""
+import os
+import json
+import tempfile
+import timeit
+
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from threading import Thread
+
+import pytest
+
+
+# Keep test runs from writing into ./logs
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="wallets-logs-"))
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Answers every GET with a small JSON body, over keep-alive connections."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """Local HTTP server, yields its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def bench():
+    """Returns a function timing a callable, best secs per call of several repeats."""
+    def best_time(func, number: int = 1000, repeat: int = 5) -> float:
+        return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+    return best_time
+
+
+@pytest.fixture
+def history_data() -> dict:
+    """'data' of a made-up 20 txn history list response."""
+    from src.cryptowallets.replay import synthetic_fixture
+
+    return synthetic_fixture(t0=1_700_000_000.0)
+
+
+@pytest.fixture
+def history_body(history_data) -> bytes:
+    """Raw body of a made-up 20 txn history list response."""
+    return json.dumps({"_cache_seconds": 0, "data": history_data, "error_code": 0}).encode()
+
+
+@pytest.fixture
+def fake_debank(request, monkeypatch):
+    """FakeDebank without new txns, requested directly instead of through Tor. Parametrize to pass FakeDebank kwargs."""
+    from src.cryptowallets import debank
+    from src.cryptowallets.replay import (
+        FakeDebank,
+        synthetic_fixture,
+    )
+    from src.cryptowallets.tor import SessionPool
+    from src.cryptowallets.common import variables
+
+    server = FakeDebank([synthetic_fixture()], txn_interval=0, **getattr(request, "param", {})).start()
+    monkeypatch.setattr(variables, "DEBANK_API", server.url, raising=False)
+    monkeypatch.setattr(variables, "TOR_PROXY", "", raising=False)
+    monkeypatch.setattr(debank, "session_pool", SessionPool())
+
+    yield server
+
+    server.stop()
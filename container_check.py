@@ -1,10 +1,12 @@
 """
 Program that constantly checks if a docker container is running.
-It checks the Loop timestamps and notifies vie Telegram if the last timestamp was older than 15 mins.
+It reads the heartbeat files the container's workers rewrite at every stage of their loop and notifies
+via Telegram as soon as a worker is late for its next heartbeat.
 """
 import os
-import re
 import sys
+import json
+import glob
 import time
 import datetime
 import requests
@@ -33,93 +35,117 @@ def telegram_send_message(message_text: str, teleg_chat_id: str,
     # send the POST request
     try:
         # If too many requests, wait for Telegram's rate limit
-        while True:
+        for _ in range(10):
             post_request = requests.post(url=url, data=payload, timeout=15)
+            data = post_request.json()
 
-            if post_request.json()['ok']:
+            if data['ok']:
                 return post_request
 
-            time.sleep(3)
+            time.sleep(data.get('parameters', {}).get('retry_after', 3))
 
-    except ConnectionError:
+    except (requests.RequestException, ValueError):
         return None
 
 
-if len(sys.argv) != 2:
-    sys.exit(f"Usage: python3 {os.path.basename(__file__)} <container_name>\n")
+def read_env(path: str = ".env") -> dict:
+    """Reads KEY=value lines of an .env file."""
+    env_vals = {}
+    with open(path) as file:
+        for line in file:
+            key, sep, value = line.strip().partition("=")
+            if sep and not key.startswith("#"):
+                env_vals[key.strip()] = value.strip().strip("'\"")
 
+    return env_vals
 
-env_text = os.popen("cat .env").read()
-values = [val for val in env_text.split("\n") if val != ""]
-env_vals = {}
-for val in values:
-    buff = val.split("=")
-    if len(buff) == 2:
-        env_vals[f"{buff[0]}"] = buff[1]
+
+def read_heartbeats(directory: str) -> dict:
+    """Returns the last heartbeat of every worker in a directory, by shard."""
+    heartbeats = {}
+    for path in glob.glob(os.path.join(directory, "heartbeat-*.json")):
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue  # Being replaced right now, read again next check
+
+        heartbeats[data.get('shard', path)] = data
+
+    return heartbeats
+
+
+if len(sys.argv) not in (2, 3):
+    sys.exit(f"Usage: python3 {os.path.basename(__file__)} <container_name> [heartbeat_dir]\n")
+
+
+env_vals = read_env()
 
 chat_id_alerts = env_vals['CHAT_ID_ALERTS']
 chat_id_alerts_all = env_vals['CHAT_ID_ALERTS_ALL']
 chat_id_debug = env_vals['CHAT_ID_DEBUG']
 token = env_vals['TOKEN']
 
-current_dir = os.getcwd()
 time_format = "%Y-%m-%d %H:%M:%S, %Z"
-time_format_regex = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}, [A-Za-z]*")
 program_name = os.path.abspath(os.path.basename(__file__))
-program_start_time = datetime.datetime.now()
+program_start_time = time.time()
 
-container_name = sys.argv[-1]
+container_name = sys.argv[1]
+heartbeat_dir = sys.argv[2] if len(sys.argv) == 3 else "./state"
 register(telegram_send_message, f"⚠️ <b>{container_name.upper()}: container_check.py</b> stopped!",
          chat_id_debug, token)
 
-wait_time = 5 * 60  # 5 mins (5 * 60 secs) sleep time in each loop
-max_time_diff = 10 * 60  # 5 mins max difference(in secs) between current and script's last timestamp
+wait_time = 5  # 5 secs sleep time in each loop
+grace_time = 10  # 10 secs a worker may be late for its next heartbeat before it is reported
+start_time = 5 * 60  # 5 mins for the container to write its first heartbeats
 update_time = 12  # 12 hour check 'OK' message to Telegram to notify container_check is still running
 
-# Sleep before starting the script - 15 mins
-time.sleep(15 * 60)
-
-
+stalled = set()
 while True:
-    # Get timestamp of last execution loop
-    command = f"docker logs {container_name} | tail -n 50"
-    output = os.popen(command).read()
-
-    # Find last Loop timestamp
-    time_str = time_format_regex.findall(output)[-1]
-
-    # Construct date_time object from string
-    script_time = datetime.datetime.strptime(time_str, time_format)
-
-    now_time = datetime.datetime.now()
-
-    # Calculate time difference in seconds
-    time_diff = (now_time - script_time).seconds
-
-    # Calculate last loop execution time
-    temp = re.split(r"[ ]?sec[s]?", output)[0]
-    loop_time = float(re.split(r" ", temp)[-1])
-
-    # Alert if container has stopped or is lagging behind
-    if time_diff > max_time_diff:
-
-        timestamp = datetime.datetime.now().astimezone().strftime(time_format)
-        message = f"<b>⚠️ {container_name.upper()}</b> - {timestamp}\n" \
-                  f"<b>{program_name}</b> stopped!\n Last loop time: {loop_time:,.2f} secs.\n"
-
-        # Send Telegram message in Alerts and Debug Chat and Break
-        telegram_send_message(message, teleg_chat_id=chat_id_alerts, teleg_token=token)
-        telegram_send_message(message, teleg_chat_id=chat_id_alerts_all, teleg_token=token)
-        telegram_send_message(message, teleg_chat_id=chat_id_debug, teleg_token=token)
+    time.sleep(wait_time)
 
-        break
+    now = time.time()
+    timestamp = datetime.datetime.now().astimezone().strftime(time_format)
+    heartbeats = read_heartbeats(heartbeat_dir)
+
+    if not heartbeats:
+        if now - program_start_time > start_time and None not in stalled:
+            message = f"<b>⚠️ {container_name.upper()}</b> - {timestamp}\n" \
+                      f"No heartbeats found in {os.path.abspath(heartbeat_dir)}!"
+            telegram_send_message(message, teleg_chat_id=chat_id_debug, teleg_token=token)
+            stalled.add(None)
+        continue
+
+    stalled.discard(None)
+
+    for shard, heartbeat in sorted(heartbeats.items(), key=lambda item: str(item[0])):
+        # Difference in secs between epoch timestamps, no wrap-around
+        late = now - heartbeat['next_by']
+        loop_time = heartbeat.get('loop_time', 0.0)
+
+        # Alert once if a worker has stopped or is lagging behind
+        if late > grace_time and shard not in stalled:
+            stalled.add(shard)
+            message = f"<b>⚠️ {container_name.upper()}</b> - {timestamp}\n" \
+                      f"<b>{program_name}</b> shard {shard} stalled in '{heartbeat['stage']}' for {late:,.0f} secs!\n" \
+                      f"Last loop time: {loop_time:,.2f} secs.\n"
+
+            # Send Telegram message in Alerts and Debug Chat
+            telegram_send_message(message, teleg_chat_id=chat_id_alerts, teleg_token=token)
+            telegram_send_message(message, teleg_chat_id=chat_id_alerts_all, teleg_token=token)
+            telegram_send_message(message, teleg_chat_id=chat_id_debug, teleg_token=token)
+
+        elif late <= grace_time and shard in stalled:
+            stalled.discard(shard)
+            message = f"✅ {container_name.upper()} - {timestamp}\nShard {shard} running again."
+            telegram_send_message(message, teleg_chat_id=chat_id_debug, teleg_token=token)
 
     # Alert every 12hours if the script is still running
-    if now_time - program_start_time > datetime.timedelta(hours=update_time):
-        message = f"✅ {container_name.upper()}. Last loop time: {loop_time:,.2f} secs."
+    if now - program_start_time > update_time * 60 * 60:
+        loop_times = ", ".join(f"shard {shard} {heartbeat.get('loop_time', 0.0):,.2f}"
+                               for shard, heartbeat in sorted(heartbeats.items(), key=lambda item: str(item[0])))
+        message = f"✅ {container_name.upper()}. Last loop times: {loop_times} secs."
 
         # Send Telegram message in Debug Chat
         telegram_send_message(message, teleg_chat_id=chat_id_debug, teleg_token=token)
-        program_start_time = datetime.datetime.now()
-
-    time.sleep(wait_time)
+        program_start_time = time.time()
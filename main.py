@@ -1,27 +1,29 @@
 import os
 import sys
 import json
-import time
+import signal
 
 from atexit import register
 from datetime import datetime
-from multiprocessing import Process
 
 from src.cryptowallets.datatypes import Wallet
-from src.cryptowallets.debank import scrape_wallets
+from src.cryptowallets.supervisor import Supervisor
+from src.cryptowallets.tor import (
+    build_circuits,
+    launch_tor,
+)
+from src.cryptowallets.routing import build_routes
 from src.cryptowallets.common.exceptions import exit_handler
-from src.cryptowallets.common.variables import time_format
+from src.cryptowallets.common.variables import (
+    time_format,
+    state_file,
+)
 from src.cryptowallets.common.helpers import (
     print_start_message,
     send_pin_message,
 )
 
 
-def start_tor(out_file_name: str):
-    """Starts a Tor client"""
-    os.system(f"nohup tor > {out_file_name}")
-
-
 if __name__ == "__main__":
 
     if len(sys.argv) != 2:
@@ -34,21 +36,42 @@ if __name__ == "__main__":
 
     # Fetch variables
     info: dict = json.loads(sys.argv[-1])
-    loop_sleep, whale_txn_limit = info["settings"].values()
+    settings: dict = info["settings"]
+    workers = settings.get("workers", 1)
+    circuits = build_circuits(settings.get("tor_socks_ports", [9050]),
+                              settings.get("tor_circuits", 1),
+                              settings.get("tor_control_ports"))
+    worker_kwargs = dict(
+        sleep_time=settings["loop_sleep"],
+        whale_txn_limit=settings["whale_txn_limit"],
+        max_in_flight=settings.get("max_in_flight", 10),
+        wallet_deadline=settings.get("wallet_deadline", 30),
+        seen_capacity=settings.get("seen_capacity", 40),
+        state_path=settings.get("state_file", state_file),
+        routes=build_routes(info),
+        filters=info.get("filters"),
+        max_interval=settings.get("max_interval", 300),
+        requests_per_min=settings.get("requests_per_min", 0),
+        max_backfill_pages=settings.get("max_backfill_pages", 10),
+        pin_user_agent=settings.get("pin_user_agent", True),
+    )
 
     wallets_info = [Wallet(address, info['wallets'][address]['name']) for address in info['wallets']]
     out_file = "tor_output.txt"
 
-    tor = Process(target=start_tor, args=(out_file, ))
-    wallets = Process(target=scrape_wallets, args=(wallets_info, loop_sleep, whale_txn_limit, ))
+    supervisor = Supervisor(wallets_info, workers, circuits, metrics_port=settings.get("metrics_port", 9100),
+                            latency_report_every=settings.get("latency_report_every", 3600), **worker_kwargs)
 
-    # Start Process 1 - Tor
-    tor.start()
+    # Start Tor and wait until its circuits are ready
     print(f"{timestamp} - Starting Tor onion router...\nAppending Tor output to {out_file}")
+    tor, startup = launch_tor(out_file, settings.get("tor_control_ports"), settings.get("tor_timeout", 120))
+    print(f"Tor control port ready in {startup.control_port:,.2f}s, circuits ready in {startup.bootstrap:,.2f}s")
 
-    time.sleep(30)  # Wait for Tor to initialise
-
-    # Start Process 2 - Main wallet screener
-    wallets.start()
+    # Start wallet screener worker processes, one per shard
+    supervisor.start()
     print_start_message(info)
     send_pin_message(info)
+
+    # Stop the workers, which flush their queued alerts, when terminated as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    supervisor.run()
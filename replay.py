@@ -0,0 +1,77 @@
+"""
+Captures DeBank responses into fixtures and replays them to benchmark the screening pipeline offline.
+"""
+import os
+import sys
+import json
+
+from argparse import ArgumentParser
+
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.replay import (
+    capture_fixtures,
+    format_results,
+    load_fixtures,
+    run_replay,
+    synthetic_fixture,
+)
+
+
+parser = ArgumentParser(
+    usage=f"python3 {os.path.basename(__file__)} capture <fixtures_dir> <input_file>\n"
+          f"       python3 {os.path.basename(__file__)} run [fixtures_dir] [options]\n",
+    description="Replays recorded DeBank responses through the screening pipeline, against a local DeBank "
+                "stand-in and a mock Telegram Bot API, and reports loop time, alert latency, CPU and RSS.",
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+capture = subparsers.add_parser("capture", help="Save each wallet's latest DeBank response. Requires Tor.")
+capture.add_argument("fixtures_dir", help="Directory fixtures are saved to.")
+capture.add_argument("input_file", help="Contents of the wallets.json input file.")
+
+run = subparsers.add_parser("run", help="Replay fixtures at several wallet counts.")
+run.add_argument("fixtures_dir", nargs="?", default="", help="Captured fixtures, made-up txns if omitted.")
+run.add_argument("--wallets", type=int, nargs="+", default=[10, 100, 1000], help="Wallet counts to replay.")
+run.add_argument("--duration", type=float, default=60.0, help="Secs to screen for at each wallet count.")
+run.add_argument("--loop-sleep", type=float, default=1.0, help="Min secs between two polls of a wallet.")
+run.add_argument("--drain-time", type=float, default=60.0,
+                 help="Max secs to wait for the txns published during a replay to be alerted.")
+run.add_argument("--max-in-flight", type=int, default=10, help="Max number of wallets fetched at the same time.")
+run.add_argument("--txn-interval", type=float, default=30.0, help="Secs between two new txns of a wallet.")
+run.add_argument("--rate-limit", type=float, default=0.0, help="Share of DeBank requests answered with a 429.")
+run.add_argument("--latency", type=float, default=0.0, help="Max secs DeBank responses are delayed by.")
+run.add_argument("--timeout", type=float, default=0.0, help="Share of DeBank requests that time out.")
+run.add_argument("--drop-tokens", type=float, default=0.0,
+                 help="Share of tokens left out of DeBank responses, to be priced by the stub price source.")
+run.add_argument("--etags", action="store_true",
+                 help="Send ETags from DeBank and answer unchanged conditional requests with a 304.")
+run.add_argument("--telegram-rate-limit", type=float, default=0.0,
+                 help="Share of Telegram messages answered with a 429.")
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        info: dict = json.loads(args.input_file)
+        wallets_info = [Wallet(address, info['wallets'][address]['name']) for address in info['wallets']]
+
+        count = capture_fixtures(wallets_info, args.fixtures_dir)
+        print(f"Captured {count} of {len(wallets_info)} wallets into {args.fixtures_dir}")
+        sys.exit(0)
+
+    fixtures = load_fixtures(args.fixtures_dir) if args.fixtures_dir else [synthetic_fixture()]
+    if not fixtures:
+        sys.exit(f"No fixtures found in {args.fixtures_dir}\n")
+
+    debank_kwargs = dict(txn_interval=args.txn_interval, rate_limit=args.rate_limit,
+                         latency=args.latency, timeout=args.timeout, drop_tokens=args.drop_tokens,
+                         etags=args.etags)
+
+    results = []
+    for wallet_count in args.wallets:
+        results.append(run_replay(fixtures, wallet_count, args.duration, args.loop_sleep, args.drain_time,
+                                  debank_kwargs, dict(rate_limit=args.telegram_rate_limit),
+                                  max_in_flight=args.max_in_flight))
+        print(format_results(results))
@@ -0,0 +1,165 @@
+"""
+Process wide token and project metadata caches, fed by every DeBank response.
+"""
+from time import monotonic
+from threading import Lock
+from typing import (
+    Dict,
+    Hashable,
+    Iterable,
+    Tuple,
+)
+
+from src.cryptowallets.decode import HistoryPage
+from src.cryptowallets.prices import price_cache
+from src.cryptowallets.common.metrics import (
+    cache_entries,
+    cache_evictions,
+    cache_lookups,
+)
+from src.cryptowallets.datatypes import (
+    Model,
+    ProjectInfo,
+    SeenTxns,
+    TokenInfo,
+)
+
+
+class MetadataCache:
+    """
+    Cache of token or project info, stored once per key however many wallets share them.
+    Entries remember when they were last updated so that volatile fields like prices can expire.
+    Once max_size entries are cached, the least recently updated ones are evicted.
+    Lookups, evictions and size are exported as metrics labelled with the cache's name.
+    """
+
+    def __init__(self, name: str, ttl: float = 300.0, max_size: int = 50000):
+        """
+        :param name: Name of the cache, used in metrics
+        :param ttl: Secs after which an entry is considered stale
+        :param max_size: Max number of entries
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._items: Dict[Hashable, Tuple[float, Model]] = {}  # Least recently updated first
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def update(self, items: Iterable[Tuple[Hashable, Model]], updated_at: float | None = None) -> None:
+        """
+        Adds or replaces entries.
+
+        :param items: Iterable of (key, info) pairs
+        :param updated_at: Monotonic time the info was fetched at, defaults to now
+        """
+        if updated_at is None:
+            updated_at = monotonic()
+
+        evicted = 0
+        with self._lock:
+            for key, info in items:
+                self._items.pop(key, None)
+                self._items[key] = (updated_at, info)
+
+            while len(self._items) > self.max_size:
+                del self._items[next(iter(self._items))]
+                evicted += 1
+
+            size = len(self._items)
+
+        if evicted:
+            cache_evictions.inc(evicted, cache=self.name)
+        cache_entries.set(size, cache=self.name)
+
+    def get(self, key: Hashable) -> Model | None:
+        """
+        Returns the info of a key.
+
+        :param key: Cache key
+        :returns: TokenInfo, ProjectInfo or None if not cached
+        """
+        try:
+            _, info = self._items[key]
+            cache_lookups.inc(cache=self.name, result="hit")
+            return info
+
+        except KeyError:
+            cache_lookups.inc(cache=self.name, result="miss")
+            return None
+
+    def is_fresh(self, key: Hashable) -> bool:
+        """Returns True if a key is cached and was updated less than ttl secs ago."""
+        item = self._items.get(key)
+
+        return item is not None and monotonic() - item[0] < self.ttl
+
+    def items(self) -> Iterable[Tuple[Hashable, Model]]:
+        """Returns a snapshot of all (key, info) pairs."""
+        with self._lock:
+            return [(key, info) for key, (_, info) in self._items.items()]
+
+
+token_cache = MetadataCache("tokens")  # Keyed by (chain, token_id)
+project_cache = MetadataCache("projects", max_size=10000)  # Keyed by project_id
+
+
+def cache_response(data: HistoryPage) -> None:
+    """
+    Feeds the token and project dicts and the token prices of a DeBank history list response into the caches.
+
+    :param data: Decoded history list response
+    """
+    now = monotonic()
+    token_cache.update((((token.chain, token_id), token) for token_id, token in data.token_dict.items()), now)
+    project_cache.update(data.project_dict.items(), now)
+    price_cache.update((((token.chain, token_id), token.price) for token_id, token in data.token_dict.items()), now)
+
+
+def want_prices(data: HistoryPage, seen: SeenTxns, since: float | None = None) -> None:
+    """
+    Marks the tokens of a response's new txns that have no fresh price, to be resolved by price_cache.resolve().
+    Call after cache_response for every response of a loop, so that prices other responses came with are used.
+
+    :param data: Decoded history list response
+    :param seen: Seen transactions of the wallet, new txns are found by the same diff they are alerted by
+    :param since: Skip txns older than this instead of the wallet's lookback window, as passed to compare_seen
+    """
+    for txn in seen.diff(data.history_list, since):
+        for transfer in txn.sends + txn.receives:
+            price_cache.want(txn.chain, transfer.token_id)
+
+
+def get_token(chain: str, token_id: str) -> TokenInfo | None:
+    """
+    Returns cached token info.
+
+    :param chain: Chain name, eg. eth, ftm, avax
+    :param token_id: Token ID, eg. token contract address
+    :returns: Token info or None if unknown
+    """
+    return token_cache.get((chain, token_id))
+
+
+def get_token_price(chain: str, token_id: str) -> float | None:
+    """
+    Returns a token's cached price if it has not expired.
+
+    :param chain: Chain name, eg. eth, ftm, avax
+    :param token_id: Token ID, eg. token contract address
+    :returns: Token price in USD or None if unknown or stale
+    """
+    return price_cache.get(chain, token_id)
+
+
+def get_project(project_id: str) -> ProjectInfo | None:
+    """
+    Returns cached project info.
+
+    :param project_id: DeBank project ID, eg. uniswap3
+    :returns: Project info or None if unknown
+    """
+    return project_cache.get(project_id)
@@ -0,0 +1,349 @@
+"""
+Background Telegram dispatcher, so that sending alerts never blocks the polling loop.
+"""
+import os
+import re
+import html
+import requests
+
+from time import (
+    monotonic,
+    perf_counter,
+    time,
+)
+from collections import deque
+from functools import partial
+from multiprocessing.queues import Queue
+from threading import (
+    Condition,
+    Thread,
+)
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+)
+
+from src.cryptowallets.common.logger import log_error
+from src.cryptowallets.common.metrics import (
+    alerts_queued,
+    alerts_sent,
+    telegram_seconds,
+)
+from src.cryptowallets.common import variables
+
+
+_tag_pattern = re.compile(r"<[^>]*>")
+_entity_pattern = re.compile(r"<[a-zA-Z]")
+
+
+class QueuedMessage(NamedTuple):
+    """Message waiting to be sent, with its size as Telegram counts it."""
+    text: str
+    attempts: int
+    on_sent: Callable[[float], None] | None
+    length: int  # Characters left after HTML tags are parsed
+    entities: int  # Formatting entities, eg. links
+
+
+def message_size(message_text: str) -> Tuple[int, int]:
+    """
+    Returns the length of an HTML message after Telegram parses its tags, and its number of entities.
+
+    :param message_text: Message in Telegram's HTML parse mode
+    :returns: (characters, entities)
+    """
+    return len(html.unescape(_tag_pattern.sub("", message_text))), len(_entity_pattern.findall(message_text))
+
+
+class TelegramDispatcher:
+    """
+    Queue of outgoing Telegram messages served by worker threads.
+    Workers respect per-chat and global rate limits as well as Telegram's 'retry_after',
+    and coalesce messages queued for the same chat into a single message,
+    so that a growing backlog is sent in fewer, fuller messages.
+
+    Worker processes forward their messages to the supervisor's dispatcher, see forward and relay,
+    so that the limits and coalescing apply across all of them.
+    """
+    max_message_len = 4096  # Telegram's max message length, counted after HTML tags are parsed
+    max_entities = 100  # Telegram's max number of formatting entities per message
+
+    def __init__(self, telegram_token: str = "", workers: int = 2, chat_interval: float = 1.0,
+                 group_interval: float = 3.0, global_rate: float = 30.0, max_attempts: int = 5, timeout: float = 10):
+        """
+        :param telegram_token: Telegram TOKEN API, default is 'TOKEN' from .env file
+        :param workers: Number of worker threads
+        :param chat_interval: Min secs between two messages to the same private chat. Telegram allows 1 msg/sec
+        :param group_interval: Min secs between two messages to the same group or channel, ie. a chat ID
+            starting with '-'. Telegram allows 20 msgs/min in groups
+        :param global_rate: Max messages per sec across all chats
+        :param max_attempts: Max attempts to send a message before it is dropped, 429s excluded
+        :param timeout: Max secs to wait for POST request
+        """
+        self.telegram_token = telegram_token
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.global_interval = 1 / global_rate
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+        self._pending: Dict[str, Deque[QueuedMessage]] = {}
+        self._next_send: Dict[str, float] = {}
+        self._next_global = 0.0
+        self._busy: Set[str] = set()
+        self._cond = Condition()
+        self._threads: List[Thread] = []
+        self._stopping = False
+        self._queued = 0
+
+        # Forwarding to another process' dispatcher: (alert queue, ack queue, sender) and callbacks by message key
+        self._forward: Tuple[Queue, Queue, int] | None = None
+        self._forwarded: Dict[Tuple[int, int], Callable[[float], None] | None] = {}
+        self._forward_count = 0
+
+    def forward(self, alert_queue: Queue, ack_queue: Queue, sender: int = 0) -> None:
+        """
+        Forwards messages to another process' dispatcher instead of sending them, see relay.
+
+        :param alert_queue: Queue the relaying dispatcher reads messages from
+        :param ack_queue: Queue the relaying dispatcher acknowledges this process' messages on
+        :param sender: Number the relaying dispatcher knows ack_queue by, eg. the worker's shard
+        """
+        with self._cond:
+            self._forward = (alert_queue, ack_queue, sender)
+
+        Thread(target=self._receive_acks, args=(ack_queue, ), name="telegram-acks", daemon=True).start()
+
+    def relay(self, alert_queue: Queue, ack_queues: Dict[int, Queue]) -> None:
+        """
+        Sends the messages other processes forward, until None is put on alert_queue.
+        Runs in a thread of the process that owns the dispatcher.
+
+        :param alert_queue: Queue of (sender, key, text, chat_id) put by the forwarding dispatchers
+        :param ack_queues: Ack queue of each sender, (key, acked) is put on it once Telegram acknowledges a message
+        """
+        while (item := alert_queue.get()) is not None:
+            sender, key, message_text, telegram_chat_id = item
+            self.send(message_text, telegram_chat_id, on_sent=partial(self._relay_ack, ack_queues[sender], key))
+
+    @staticmethod
+    def _relay_ack(ack_queue: Queue, key: Tuple[int, int], acked: float) -> None:
+        """Acknowledges a relayed message to the process that forwarded it."""
+        ack_queue.put((key, acked))
+
+    def _receive_acks(self, ack_queue: Queue) -> None:
+        """Calls back forwarded messages as they are acknowledged, for as long as the process runs."""
+        while True:
+            key, acked = ack_queue.get()
+            with self._cond:
+                # Acks of messages forwarded by a previous process of the same sender are ignored
+                if key not in self._forwarded:
+                    continue
+
+                on_sent = self._forwarded.pop(key)
+                self._queued -= 1
+                alerts_queued.set(self._queued)
+                self._cond.notify_all()
+
+            if on_sent is not None:
+                on_sent(acked)
+
+    def start(self) -> None:
+        """Starts the worker threads."""
+        with self._cond:
+            if self._threads:
+                return
+
+            self._stopping = False
+            self._threads = [Thread(target=self._work, name=f"telegram-{i}", daemon=True)
+                             for i in range(self.workers)]
+
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float | None = 30) -> None:
+        """
+        Sends all queued messages and stops the worker threads.
+        When forwarding, waits for the forwarded messages to be acknowledged instead.
+
+        :param timeout: Max secs to wait for each worker to finish
+        """
+        with self._cond:
+            if self._forward is not None:
+                self._cond.wait_for(lambda: not self._forwarded, timeout)
+                return
+
+            self._stopping = True
+            self._cond.notify_all()
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+        self._threads = []
+
+    def send(self, message_text: str, telegram_chat_id: str,
+             on_sent: Callable[[float], None] | None = None) -> None:
+        """
+        Queues a message to be sent to a chat.
+
+        :param message_text: Text message to send
+        :param telegram_chat_id: Telegram chat ID
+        :param on_sent: Called with the epoch time Telegram acknowledged the message, from a worker thread
+        """
+        message_text = str(message_text)
+        with self._cond:
+            if self._forward is not None:
+                alert_queue, _, sender = self._forward
+                # Keys are unique across restarts of a sender, so that late acks can't call back a new message
+                self._forward_count += 1
+                key = (os.getpid(), self._forward_count)
+                self._forwarded[key] = on_sent
+                self._queued += 1
+                alert_queue.put((sender, key, message_text, str(telegram_chat_id)))
+                return
+
+        if not self._threads:
+            self.start()
+
+        message = QueuedMessage(message_text, 0, on_sent, *message_size(message_text))
+
+        with self._cond:
+            self._pending.setdefault(str(telegram_chat_id), deque()).append(message)
+            self._queued += 1
+            alerts_queued.set(self._queued)
+            self._cond.notify()
+
+    def queued(self) -> int:
+        """Returns the number of messages waiting to be sent."""
+        with self._cond:
+            return self._queued
+
+    def interval(self, chat_id: str) -> float:
+        """Returns the min secs between two messages to a chat."""
+        return self.group_interval if chat_id.startswith("-") else self.chat_interval
+
+    def _next_ready(self, now: float) -> Tuple[str | None, float]:
+        """Returns a chat that can be sent to now or None and the secs to wait for one."""
+        wait = 60.0
+        if now < self._next_global:
+            return None, self._next_global - now
+
+        for chat_id, messages in self._pending.items():
+            if not messages or chat_id in self._busy:
+                continue
+
+            next_send = self._next_send.get(chat_id, 0.0)
+            if next_send <= now:
+                return chat_id, 0.0
+
+            wait = min(wait, next_send - now)
+
+        return None, wait
+
+    def _take_batch(self, chat_id: str) -> List[QueuedMessage]:
+        """Pops as many queued messages for a chat as fit into a single Telegram message."""
+        messages = self._pending[chat_id]
+        batch = [messages.popleft()]
+        length, entities = batch[0].length, batch[0].entities
+
+        while (messages and length + messages[0].length + 1 <= self.max_message_len
+               and entities + messages[0].entities <= self.max_entities):
+            batch.append(messages.popleft())
+            length += batch[-1].length + 1
+            entities += batch[-1].entities
+
+        return batch
+
+    def _work(self) -> None:
+        """Worker thread loop."""
+        while True:
+            with self._cond:
+                while True:
+                    now = monotonic()
+                    chat_id, wait = self._next_ready(now)
+                    if chat_id is not None:
+                        break
+
+                    if self._stopping and not any(self._pending.values()) and not self._busy:
+                        return
+
+                    self._cond.wait(wait)
+
+                batch = self._take_batch(chat_id)
+                self._busy.add(chat_id)
+                self._next_global = max(now, self._next_global) + self.global_interval
+
+            sent, retry_after = self._post("\n".join(message.text for message in batch), chat_id)
+            if sent:
+                acked = time()
+                for message in batch:
+                    if message.on_sent is not None:
+                        message.on_sent(acked)
+
+            with self._cond:
+                self._busy.discard(chat_id)
+                now = monotonic()
+
+                if sent:
+                    self._queued -= len(batch)
+                    alerts_sent.inc()
+                    self._next_send[chat_id] = now + self.interval(chat_id)
+
+                elif retry_after is not None:
+                    # Rate limited by Telegram - put messages back and wait as long as asked
+                    self._pending[chat_id].extendleft(reversed(batch))
+                    self._next_send[chat_id] = now + retry_after
+
+                else:
+                    retry = [message._replace(attempts=message.attempts + 1) for message in batch
+                             if message.attempts + 1 < self.max_attempts]
+                    if len(retry) < len(batch):
+                        self._queued -= len(batch) - len(retry)
+                        log_error.warning(f"'TelegramDispatcher' - {len(batch) - len(retry)} message(s) "
+                                          f"to {chat_id} dropped after {self.max_attempts} attempts.")
+
+                    self._pending[chat_id].extendleft(reversed(retry))
+                    self._next_send[chat_id] = now + self.interval(chat_id)
+
+                alerts_queued.set(self._queued)
+                self._cond.notify_all()
+
+    def _post(self, message_text: str, telegram_chat_id: str) -> Tuple[bool, float | None]:
+        """
+        Posts a message to Telegram.
+
+        :returns: Whether message was sent and Telegram's retry_after secs if rate limited
+        """
+        url = f"{variables.TELEGRAM_API}/bot{self.telegram_token or variables.TOKEN}/sendMessage"
+        payload = {"chat_id": telegram_chat_id, "text": message_text,
+                   "disable_web_page_preview": True, "parse_mode": "HTML"}
+
+        start = perf_counter()
+        try:
+            resp = requests.post(url=url, data=payload, timeout=self.timeout)
+            data = resp.json()
+
+        except Exception as e:
+            telegram_seconds.observe(perf_counter() - start)
+            log_error.warning(f"'TelegramDispatcher' - Telegram message not sent to {telegram_chat_id} - {e}")
+            return False, None
+
+        telegram_seconds.observe(perf_counter() - start)
+        if data.get('ok'):
+            return True, None
+
+        retry_after = data.get('parameters', {}).get('retry_after')
+        if retry_after is None:
+            log_error.warning(f"'TelegramDispatcher' - Telegram message not sent to {telegram_chat_id} - "
+                              f"{data.get('description')}")
+
+        return False, retry_after
+
+
+dispatcher = TelegramDispatcher()
@@ -0,0 +1,44 @@
+"""
+Heartbeat file a worker rewrites as it moves through its polling loop, read by container_check.py.
+"""
+import os
+import json
+
+from time import time
+
+
+class Heartbeat:
+    """
+    Small JSON file stating what a worker is doing and by when it should report back.
+    A watchdog that finds the file past its 'next_by' timestamp knows the worker is stalled.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the heartbeat file, its directory is created if missing
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.pid = os.getpid()
+
+    def beat(self, stage: str, expect_within: float, **fields) -> None:
+        """
+        Atomically rewrites the heartbeat file.
+
+        :param stage: What the worker is about to do, eg. 'sleep' or 'fetch'
+        :param expect_within: Max secs until the next beat
+        :param fields: Extra fields saved in the file, eg. loop number and loop time
+        """
+        now = time()
+        data = {"pid": self.pid, "stage": stage, "time": now, "next_by": now + expect_within, **fields}
+
+        try:
+            with open(f"{self.path}.tmp", "w") as file:
+                json.dump(data, file)
+            os.replace(f"{self.path}.tmp", self.path)
+
+        except OSError:
+            pass  # A missing heartbeat is reported by the watchdog, never stop screening over it
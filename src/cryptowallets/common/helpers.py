@@ -2,13 +2,10 @@ import requests
 from datetime import datetime
 from tabulate import tabulate
 
+from src.cryptowallets.routing import parse_chat_ids
 from src.cryptowallets.common.message import telegram_send_message
-from src.cryptowallets.common.variables import (
-    CHAT_ID_ALERTS,
-    CHAT_ID_ALERTS_ALL,
-    TOKEN,
-    time_format,
-)
+from src.cryptowallets.common import variables
+from src.cryptowallets.common.variables import time_format
 
 
 def print_start_message(info: dict) -> None:
@@ -25,14 +22,12 @@ def print_start_message(info: dict) -> None:
     for address, details in info['wallets'].items():
 
         wallet_name = details['name']
-        chat_id = details['chat_id']
+        chat_ids = parse_chat_ids(details.get('chat_id'), variables.CHAT_ID_ALERTS)
+        chat_ids_all = parse_chat_ids(details.get('chat_id_all'), variables.CHAT_ID_ALERTS_ALL)
 
-        if not chat_id:
-            chat_id = CHAT_ID_ALERTS
+        message.append([wallet_name, address, ", ".join(sorted(chat_ids)), ", ".join(sorted(chat_ids_all))])
 
-        message.append([wallet_name, address, chat_id])
-
-    columns = ["Wallet Name", "Wallet Address", "Chat ID", ]
+    columns = ["Wallet Name", "Wallet Address", "Chat ID", "Chat ID All", ]
 
     row_ids = [i for i in range(1, len(message) + 1)]
 
@@ -46,7 +41,7 @@ def send_pin_message(info: dict) -> None:
     :param info: Info dictionary with input data.
     """
     timestamp = datetime.now().astimezone().strftime(time_format)
-    url = f"https://api.telegram.org/bot{TOKEN}/pinChatMessage"
+    url = f"{variables.TELEGRAM_API}/bot{variables.TOKEN}/pinChatMessage"
 
     address_list = [f"-->{timestamp}\nStarted screening the following wallet addresses:"]
     counter = 1
@@ -60,12 +55,12 @@ def send_pin_message(info: dict) -> None:
 
     message = "\n".join(address_list)
 
-    resp = telegram_send_message(message, telegram_chat_id=CHAT_ID_ALERTS)
+    resp = telegram_send_message(message, telegram_chat_id=variables.CHAT_ID_ALERTS)
     message_id = resp.json()['result']['message_id']
-    payload = {'chat_id': CHAT_ID_ALERTS, 'message_id': message_id}
+    payload = {'chat_id': variables.CHAT_ID_ALERTS, 'message_id': message_id}
     requests.post(url=url, data=payload, timeout=10)
 
-    resp = telegram_send_message(message, telegram_chat_id=CHAT_ID_ALERTS_ALL)
+    resp = telegram_send_message(message, telegram_chat_id=variables.CHAT_ID_ALERTS_ALL)
     message_id = resp.json()['result']['message_id']
-    payload = {'chat_id': CHAT_ID_ALERTS_ALL, 'message_id': message_id}
+    payload = {'chat_id': variables.CHAT_ID_ALERTS_ALL, 'message_id': message_id}
     requests.post(url=url, data=payload, timeout=10)
@@ -1,37 +1,159 @@
+import os
+import gzip
+import json
+import shutil
 import logging
+import multiprocessing
 
+from atexit import register
+from threading import Lock
+from multiprocessing.queues import Queue
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+
+from src.cryptowallets.common import variables
 from src.cryptowallets.common.variables import log_format
 
 
+class JsonFormatter(logging.Formatter):
+    """Formats log records as JSON lines, eg. to load logs into pandas or jq."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": self.formatTime(record), "created": record.created, "level": record.levelname,
+                "logger": record.name, "message": record.getMessage()}
+
+        return json.dumps(data, ensure_ascii=False)
+
+
+def gzip_rotator(source: str, dest: str) -> None:
+    """Compresses a rotated log file."""
+    with open(source, "rb") as file_in, gzip.open(dest, "wb") as file_out:
+        shutil.copyfileobj(file_in, file_out)
+
+    os.remove(source)
+
+
+def file_handler(filename: str) -> logging.Handler:
+    """
+    Returns a size based, or if LOG_ROTATE_WHEN is set a time based, rotating file handler.
+    Rotated files are gzip compressed.
+
+    :param filename: Name of filename
+    :returns: An instance of the Handler class
+    """
+    if variables.LOG_ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(filename, when=variables.LOG_ROTATE_WHEN,
+                                           backupCount=variables.LOG_BACKUPS, delay=True)
+    else:
+        handler = RotatingFileHandler(filename, maxBytes=variables.LOG_MAX_BYTES,
+                                      backupCount=variables.LOG_BACKUPS, delay=True)
+
+    handler.namer = lambda name: f"{name}.gz"
+    handler.rotator = gzip_rotator
+    handler.setFormatter(JsonFormatter() if variables.LOG_JSON else logging.Formatter(log_format))
+
+    return handler
+
+
+def logger_file_handler(log_name: str, filename: str) -> logging.Handler:
+    """Returns the file handler of a logger, creating the log directory if missing."""
+    path = os.path.join(variables.LOG_DIR, filename)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    handler = file_handler(path)
+    handler.addFilter(logging.Filter(log_name))
+
+    return handler
+
+
+# Log file of each logger, opened by start_logging
+log_files = {}
+
+# Records of every logger, including those of worker processes, are written by a single listener thread
+log_queue: Queue | None = None
+log_listener: QueueListener | None = None
+_start_lock = Lock()
+
+
+def start_logging() -> Queue:
+    """
+    Creates the log directory and file handlers and starts the listener thread, once.
+    Called on the first logged record. Call it before starting worker processes, so that they share the listener.
+
+    :returns: Queue loggers put their records on
+    """
+    global log_queue, log_listener
+
+    if log_queue is not None:
+        return log_queue
+
+    with _start_lock:
+        if log_queue is None:
+            handlers = [logger_file_handler(log_name, filename) for log_name, filename in log_files.items()]
+            # A spawn context queue can be passed to both spawned and forked worker processes
+            log_queue = multiprocessing.get_context("spawn").Queue(-1)
+            log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            log_listener.start()
+            register(log_listener.stop)  # Flush queued records on exit
+
+    return log_queue
+
+
+def attach_logging(queue: Queue) -> None:
+    """
+    Puts the records of a spawned worker process on the main process' queue, instead of starting a listener.
+
+    :param queue: Queue returned by start_logging in the main process
+    """
+    global log_queue
+
+    with _start_lock:
+        log_queue = queue
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that starts the logging listener when the first record is logged."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        start_logging().put_nowait(record)
+
+
 def logger_setup(
         log_name: str,
         filename: str,
         level=logging.INFO,
 ) -> logging.Logger:
     """
-    Sets up a new logger config.
+    Sets up a new logger config. Nothing is opened until the first record is logged.
+    Logging only puts records on a queue, files are written by the listener thread in the main process.
 
     :param log_name: Name of Logger. Make sure unique name is given for each Log
-    :param filename: Name of filename
+    :param filename: Name of filename, relative to LOG_DIR
     :param level: Logger level of severity
     :returns: An instance of the Logger class
     """
-    # Set up formatting style
-    formatter = logging.Formatter(log_format)
-
-    handler = logging.FileHandler(filename)
-    handler.setFormatter(formatter)
+    with _start_lock:
+        log_files[log_name] = filename
+        if log_listener is not None:
+            log_listener.handlers += (logger_file_handler(log_name, filename), )
 
     # Create logger with name, level and handler
     logger = logging.getLogger(log_name)
     logger.setLevel(level)
-    logger.addHandler(handler)
+    logger.addHandler(LazyQueueHandler())
 
     return logger
 
 
 # Configure logging settings
-log_error = logger_setup("error", "./logs/error.log")
-log_fail = logger_setup("fail", "./logs/fail.log")
-log_spam = logger_setup("spam", "./logs/spam.log")
-log_txns = logger_setup("txns", "./logs/txns.log")
+log_error = logger_setup("error", "error.log")
+log_fail = logger_setup("fail", "fail.log")
+log_spam = logger_setup("spam", "spam.log")
+log_txns = logger_setup("txns", "txns.log")
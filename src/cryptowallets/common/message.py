@@ -3,14 +3,8 @@ import requests
 from time import sleep
 from typing import Optional
 
-from requests.exceptions import ConnectionError
-
 from src.cryptowallets.common.logger import log_error
-from src.cryptowallets.common.variables import (
-    TOKEN,
-    CHAT_ID_ALERTS,
-    CHAT_ID_DEBUG,
-)
+from src.cryptowallets.common import variables
 
 
 def telegram_send_message(
@@ -45,45 +39,45 @@ def telegram_send_message(
 
     # if Token not provided - try TOKEN variable from the .env file
     if telegram_token == "":
-        telegram_token = TOKEN
+        telegram_token = variables.TOKEN
 
     # if Chat ID not provided - try CHAT_ID_ALERTS or CHAT_ID_DEBUG variable from the .env file
     if telegram_chat_id == "":
         if debug:
-            telegram_chat_id = CHAT_ID_DEBUG
+            telegram_chat_id = variables.CHAT_ID_DEBUG
         else:
-            telegram_chat_id = CHAT_ID_ALERTS
+            telegram_chat_id = variables.CHAT_ID_ALERTS
 
     # construct url using token for a sendMessage POST request
-    url = "https://api.telegram.org/bot{}/sendMessage".format(telegram_token)
+    url = "{}/bot{}/sendMessage".format(variables.TELEGRAM_API, telegram_token)
 
     # Construct data for the request
     payload = {"chat_id": telegram_chat_id, "text": message_text, "updatePinnedMessage": True,
                "disable_web_page_preview": disable_web_page_preview, "parse_mode": "HTML"}
 
     # send the POST request
-    try:
-        counter = 1
-        # If too many requests, wait for Telegram's rate limit
-        while True:
-            try:
-                post_request = requests.post(url=url, data=payload, timeout=timeout)
-
-                if post_request.json()['ok']:
-                    return post_request
-
-                log_error.warning(f"'telegram_send_message' - Telegram message not sent, attempt {counter}. "
-                                  f"Sleeping for {sleep_time} secs...")
-
-                if counter >= 10:
-                    return None
-
-                counter += 1
-                sleep(sleep_time)
-
-            except Exception as e:
-                log_error.warning(f"'telegram_send_message' - Telegram message not sent for {url} - {e}")
-
-    except ConnectionError as e:
-        log_error.warning(f"'telegram_send_message' - {e} - '{message_text})' was not sent.")
-        return None
+    counter = 1
+    while True:
+        try:
+            post_request = requests.post(url=url, data=payload, timeout=timeout)
+            data = post_request.json()
+
+            if data['ok']:
+                return post_request
+
+            # If too many requests, wait for Telegram's rate limit
+            wait = max(sleep_time, data.get('parameters', {}).get('retry_after', 0))
+            log_error.warning(f"'telegram_send_message' - Telegram message not sent, attempt {counter}. "
+                              f"Sleeping for {wait} secs...")
+
+        except Exception as e:
+            wait = sleep_time
+            log_error.warning(f"'telegram_send_message' - Telegram message not sent for {url}, "
+                              f"attempt {counter} - {e}")
+
+        if counter >= 10:
+            log_error.warning(f"'telegram_send_message' - '{message_text}' was not sent.")
+            return None
+
+        counter += 1
+        sleep(wait)
@@ -0,0 +1,297 @@
+"""
+In-process metrics registry with a Prometheus text format exporter.
+"""
+from collections import deque
+from threading import (
+    Lock,
+    Thread,
+)
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple,
+)
+
+
+default_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+default_quantiles = (0.5, 0.95, 0.99)
+
+
+class Metric:
+    """Base class of a metric with optional labels."""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """
+        :param name: Metric name, eg. debank_fetch_seconds
+        :param documentation: Help text of the metric
+        :param labelnames: Names of the metric's labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+        self._values: dict = {}
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> dict:
+        """Returns a picklable copy of the metric, eg. to send it to another process."""
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+        return {"kind": self.kind, "documentation": self.documentation, "labelnames": self.labelnames,
+                "buckets": getattr(self, "buckets", ()), "values": values}
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # Bucket counts followed by sum and count
+            values = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+
+def quantile(ordered: List[float], q: float) -> float:
+    """Returns the q quantile of sorted values, by nearest rank."""
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+class Summary(Metric):
+    """Quantiles of the most recent observed values, with the sum and count of all observed values."""
+    kind = "summary"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 quantiles: Tuple[float, ...] = default_quantiles, window: int = 1000):
+        """
+        :param quantiles: Quantiles to report, eg. 0.95
+        :param window: Number of most recent values per label set quantiles are computed over
+        """
+        super().__init__(name, documentation, labelnames)
+        self.quantiles = quantiles
+        self.window = window
+
+        self._samples: Dict[Tuple[str, ...], deque] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+                self._values[key] = [0.0, 0]
+
+            samples.append(value)
+            values = self._values[key]
+            values[0] += value
+            values[1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+            totals = {key: list(values) for key, values in self._values.items()}
+
+        # Quantiles followed by sum and count
+        values = {key: [quantile(ordered, q) for q in self.quantiles] + totals[key] for key, ordered in samples.items()}
+
+        return {"kind": self.kind, "documentation": self.documentation, "labelnames": self.labelnames,
+                "buckets": (), "quantiles": self.quantiles, "values": values}
+
+
+class Registry:
+    """Collection of metrics."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = default_buckets) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def summary(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                quantiles: Tuple[float, ...] = default_quantiles, window: int = 1000) -> Summary:
+        return self.register(Summary(name, documentation, labelnames, quantiles, window))
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Returns a picklable copy of all metrics."""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def render(self) -> str:
+        """Returns all metrics in Prometheus text format."""
+        return render_snapshots([({}, self.snapshot())])
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def render_snapshots(snapshots: List[Tuple[Dict[str, str], Dict[str, dict]]]) -> str:
+    """
+    Renders registry snapshots in Prometheus text format, eg. to merge metrics of several processes.
+
+    :param snapshots: List of (extra labels, registry snapshot) tuples
+    :returns: Prometheus text exposition
+    """
+    lines = []
+    names = sorted({name for _, snapshot in snapshots for name in snapshot})
+
+    for name in names:
+        header = False
+        for extra, snapshot in snapshots:
+            if name not in snapshot:
+                continue
+
+            metric = snapshot[name]
+            if not header:
+                lines.append(f"# HELP {name} {metric['documentation']}")
+                lines.append(f"# TYPE {name} {metric['kind']}")
+                header = True
+
+            for key, value in metric['values'].items():
+                labels = {**extra, **dict(zip(metric['labelnames'], key))}
+
+                if metric['kind'] == "summary":
+                    for q, quantile_value in zip(metric['quantiles'], value):
+                        lines.append(f"{name}{_format_labels({**labels, 'quantile': q})} {quantile_value}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+                    continue
+
+                if metric['kind'] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+
+                for bound, count in zip(metric['buckets'], value):
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port: int, render: Callable[[], str], host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves metrics on http://host:port/metrics from a daemon thread.
+
+    :param port: Port number
+    :param render: Function returning the metrics text
+    :param host: Interface to listen on, localhost by default
+    :returns: HTTP server instance
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Keep scrapes out of the program output
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+    return server
+
+
+registry = Registry()
+
+fetch_seconds = registry.histogram("debank_fetch_seconds", "Secs to fetch a wallet's last txns", ("wallet", ))
+rate_limited = registry.counter("debank_rate_limited_total", "DeBank 429 responses")
+json_errors = registry.counter("debank_json_errors_total", "DeBank responses that could not be decoded")
+debank_responses = registry.counter("debank_responses_total", "DeBank history list responses by how they were "
+                                    "handled: not_modified (304), unchanged (same fingerprint) or decoded",
+                                    ("result", ))
+debank_cpu_seconds = registry.counter("debank_response_cpu_seconds_total", "CPU secs spent checking and decoding "
+                                      "DeBank responses", ("result", ))
+debank_bytes_decoded = registry.counter("debank_bytes_decoded_total", "DeBank response bytes decoded")
+request_seconds = registry.histogram("tor_request_seconds", "Secs per request through a Tor session, split into "
+                                     "connect, tls, transfer and total", ("phase", ))
+cache_lookups = registry.counter("metadata_cache_lookups_total", "Token/project cache lookups by result",
+                                 ("cache", "result"))
+cache_evictions = registry.counter("metadata_cache_evictions_total", "Token/project cache entries evicted at "
+                                   "max size", ("cache", ))
+cache_entries = registry.gauge("metadata_cache_entries", "Token/project cache entries", ("cache", ))
+rule_evaluations = registry.counter("filter_rule_evaluations_total", "Txns evaluated by each filter rule",
+                                    ("rule", ))
+rule_hits = registry.counter("filter_rule_hits_total", "Txns rejected first by each filter rule, in its "
+                             "current evaluation order", ("rule", ))
+newnym_requests = registry.counter("tor_newnym_total", "Tor circuit rotations", ("method", ))
+newnym_wait = registry.histogram("tor_newnym_wait_seconds", "Secs Tor asked to wait before the next NEWNYM")
+txns_found = registry.counter("txns_found_total", "New txns found", ("wallet", ))
+alerts_sent = registry.counter("telegram_alerts_sent_total", "Telegram messages sent, after coalescing")
+alerts_queued = registry.gauge("telegram_alerts_queued", "Telegram messages waiting to be sent")
+telegram_seconds = registry.histogram("telegram_send_seconds", "Secs per Telegram sendMessage request")
+loop_seconds = registry.histogram("loop_seconds", "Secs per polling loop")
+shard_loop_seconds = registry.gauge("shard_last_loop_seconds", "Secs of each shard's last polling loop", ("shard", ))
+worker_restarts = registry.counter("worker_restarts_total", "Worker processes restarted", ("shard", ))
+price_lookups = registry.counter("price_lookups_total", "Batched price lookups of tokens missing a price",
+                                 ("chain", ))
+prices_missing = registry.counter("prices_missing_total", "Token prices of new txns missing from the price cache")
+prices_resolved = registry.counter("prices_resolved_total", "Missing token prices resolved by the price source")
+alert_latency = registry.summary("alert_latency_seconds", "Secs per stage from a txn's on-chain time to its Telegram "
+                                 "delivery: poll, fetch, resolve, format, enqueue, send and total", ("stage", ))
+wallet_alert_latency = registry.summary("wallet_alert_latency_seconds", "Secs from a txn's on-chain time to its "
+                                        "Telegram delivery", ("wallet", ), window=100)
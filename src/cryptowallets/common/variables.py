@@ -2,20 +2,55 @@
 Set up program variables.
 """
 import os
-from dotenv import load_dotenv
 
+from functools import lru_cache
 
-load_dotenv()
-# Get env variables
-TOKEN = os.getenv("TOKEN")
-CHAT_ID_ALERTS = os.getenv("CHAT_ID_ALERTS")
-CHAT_ID_ALERTS_ALL = os.getenv("CHAT_ID_ALERTS_ALL")
-CHAT_ID_DEBUG = os.getenv("CHAT_ID_DEBUG")
-TOR_PASSWORD = os.getenv("TOR_PASSWORD")
+
+# Env variables, read from the .env file on first access - name: (default, type)
+env_variables = {
+    'TOKEN': (None, str),
+    'CHAT_ID_ALERTS': (None, str),
+    'CHAT_ID_ALERTS_ALL': (None, str),
+    'CHAT_ID_DEBUG': (None, str),
+    'TOR_PASSWORD': (None, str),
+    'TOR_PROXY': ("socks5h://{credentials}127.0.0.1:{port}", str),  # Proxy of a circuit's sessions, empty for none
+    'DEBANK_API': ("https://api.debank.com", str),  # Override to point at a local DeBank stand-in
+    'TELEGRAM_API': ("https://api.telegram.org", str),  # Override to point at a mock Bot API
+    'PRICE_API': ("", str),  # Price lookup endpoint for tokens missing a price, empty for none
+    'LOG_DIR': ("./logs", str),
+    'LOG_MAX_BYTES': (10 * 1024 * 1024, int),  # Size at which a log file is rotated
+    'LOG_BACKUPS': (5, int),  # Number of gzipped rotated files kept per log
+    'LOG_ROTATE_WHEN': ("", str),  # Rotate by time instead of size, eg. 'midnight'
+    'LOG_JSON': (False, lambda value: value.lower() in ("1", "true", "yes")),  # Write logs as JSON lines
+}
+
+
+@lru_cache(maxsize=None)
+def load_env() -> None:
+    """Loads the .env file into the environment, once."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+def __getattr__(name: str):
+    """Reads env variables on first access, eg. variables.TOKEN, and caches them as module attributes."""
+    if name not in env_variables:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    load_env()
+    default, convert = env_variables[name]
+    value = os.getenv(name)
+    value = default if value is None else convert(value)
+
+    globals()[name] = value
+    return value
 
 
 time_format = "%Y-%m-%d %H:%M:%S, %Z"
 log_format = "%(asctime)s - %(levelname)s - %(message)s"
+state_file = "./state/wallets.db"
+heartbeat_file = "./state/heartbeat-{shard}.json"
 
 
 chains = {
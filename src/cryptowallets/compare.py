@@ -1,274 +1,105 @@
+from time import time
+from functools import partial
 from typing import (
-    Dict,
+    Callable,
     List,
-    Tuple,
-)
-from datetime import (
-    datetime,
-    timezone,
+    NamedTuple,
 )
 
-from src.cryptowallets.datatypes import Wallet
-from src.cryptowallets.common.message import telegram_send_message
+from src.cryptowallets.rules import (
+    RuleSet,
+    default_rules,
+)
+from src.cryptowallets.routing import (
+    Route,
+    default_route,
+)
+from src.cryptowallets.datatypes import (
+    Wallet,
+    SeenTxns,
+    Transaction,
+)
+from src.cryptowallets.render import render_txns
+from src.cryptowallets.latency import latency_tracker
 from src.cryptowallets.common.logger import (
     log_error,
-    log_spam,
-    log_fail,
     log_txns,
 )
-from src.cryptowallets.common.variables import (
-    chains,
-    time_format,
-    CHAT_ID_ALERTS,
-    CHAT_ID_ALERTS_ALL,
-)
 
 
-def compare_lists(new_list: List[dict], old_list: List[dict],
-                  keyword: str = 'id') -> list[dict] | None:
+def compare_seen(new_list: List[Transaction], seen: SeenTxns,
+                 since: float | None = None) -> list[Transaction] | None:
     """
-    Compares two lists of dictionaries.
+    Compares a list of transactions against a wallet's seen transactions.
 
     :param new_list: New list
-    :param old_list: Old list
-    :param keyword: Keyword to compare with
-    :return: List of dictionaries that are in new list but not in old list
+    :param seen: Seen transactions of the wallet
+    :param since: Skip txns older than this instead of the wallet's lookback window
+    :return: List of transactions that are in new list but have not been seen
     """
 
     try:
-        ids = [txn[keyword] for txn in old_list]
-
-        list_diff = [txn for txn in new_list if txn[keyword] not in ids]
+        return seen.diff(new_list, since)
 
-        return list_diff
-
-    except (TypeError, KeyError):
-        log_error.warning(f"'compare_lists' Error - unable to compare")
+    except (TypeError, AttributeError):
+        log_error.warning(f"'compare_seen' Error - unable to compare")
         return None
 
 
-def format_send_receive(txn: dict, keyword: str, chain: str, tokens_dict: Dict[str, dict],
-                        whale_txn_limit: float = 100000.0) -> list:
-    """
-    Formats 'sends' or 'receives' list of items for a transaction.
-
-    :param txn: Transaction dictionary
-    :param keyword: 'sends' or 'receives'
-    :param chain: Chain name, eg. eth, ftm, avax
-    :param tokens_dict: Dictionary with token info
-    :param whale_txn_limit: Mark txns that are above some USD amount
-    """
-    keyword = keyword.lower()
-
-    if keyword == 'sends':
-        sign = '-'
-    elif keyword == 'receives':
-        sign = '+'
-    else:
-        raise Exception(f"Keyword must be 'sends' or 'receives' string.")
-
-    txn_info = txn[keyword]
-    txn_items = []
-
-    if txn_info:
-        for send in txn_info:
-            amount = send['amount']
-            token_id = send['token_id']
-            try:
-                token_url = f"{chains[chain]}/address/{token_id}"
-            except KeyError:
-                token_url = f"https://www.google.com/search?&rls=en&q={chain}+{token_id}&ie=UTF-8&oe=UTF-8"
-
-            try:
-                token_name = tokens_dict[token_id]['symbol']
-            except KeyError:
-                if len(token_id) < 42:
-                    token_name = "+1 Unknown NFT"
-                else:
-                    token_name = "+1 Unknown Item"
-
-                txn_items.append(f"<a href='{token_url}'>{token_name}</a>")
-                continue
-
-            try:
-                token_price = tokens_dict[token_id]['price'] * amount
-                if token_price >= whale_txn_limit:
-                    whale_mark = '🐳'
-                else:
-                    whale_mark = ''
-
-                token_price = f"{token_price:,.2f}"
-
-            except (TypeError, KeyError):
-                token_price = 'n/a'
-                whale_mark = ''
-
-            txn_items.append(f"{whale_mark}<a href='{token_url}'>{sign}{amount:,.2f} {token_name}</a>(${token_price})")
-
-    else:
-        txn_items.append('None')
-
-    return txn_items
-
-
-def format_txn_message(txn: dict, wallet: Wallet, tokens_dict: Dict[str, dict], project_dict: Dict[str, dict],
-                       whale_txn_limit: float = 100000.0) -> Tuple[str, str]:
-    """
-    Formats a transaction into a message string.
-
-    :param txn: Transaction dictionary
-    :param wallet: Wallet txn came from
-    :param tokens_dict: Dictionary with token info
-    :param project_dict: Dictionary with project info
-    :param whale_txn_limit: Mark txns that are above some USD amount
-    :return: Formatted telegram_msg & log_msg
-    """
-
-    chain = str(txn['chain'])  # Shortened name of blockchain
-    txn_hash = txn['id']  # Transaction hash
-    formatted_txn_hash = f"{txn_hash[0:6]}...{txn_hash[-4:]}"  # eg. 0xc43c...37ea
-    time_at_secs = int(txn['time_at'])  # eg. 1664049342 secs
-    other_addr = txn['other_addr']  # eg. Interacted With (To):
-    project_id = txn['project_id']  # Name of project if present
-    token_approve = txn['token_approve']  # If token approval get data
-
-    txn_stamp = datetime.fromtimestamp(time_at_secs, timezone.utc).strftime(time_format)
-
-    receive_items: list = format_send_receive(txn, 'receives', chain, tokens_dict, whale_txn_limit)
-    send_items: list = format_send_receive(txn, 'sends', chain, tokens_dict, whale_txn_limit)
-
-    if txn['tx']:
-        if txn['tx']['name']:
-            txn_type = str(txn['tx']['name']).title()
-        else:
-            txn_type = 'Contract Interaction'
-    elif txn['cate_id']:
-        txn_type = str(txn['cate_id']).title()
-    else:
-        txn_type = 'Contract Interaction'
-
-    if project_id:
-        project_name = project_dict[project_id]['name']
-
-        if token_approve:
-            approve_token_id = txn['token_approve']['token_id']
-            approve_token_name = tokens_dict[approve_token_id]['optimized_symbol']
-
-            txn_type = f"{txn_type} {approve_token_name} on {project_name}"
-        else:
-            txn_type = f"{txn_type}, {project_name}"
-
-    try:
-        txn_link = f"{chains[chain]}/tx/{txn_hash}"
-    except KeyError:
-        txn_link = f"https://www.google.com/search?&rls=en&q={chain}+{txn_hash}&ie=UTF-8&oe=UTF-8"
-
-    wallet_link = f"https://debank.com/profile/{wallet.address}/history"
-    try:
-        interacted_with_link = f"{chains[chain]}/address/{other_addr}"
-    except KeyError:
-        interacted_with_link = f"https://www.google.com/search?&rls=en&q={chain}+{other_addr}&ie=UTF-8&oe=UTF-8"
-
-    timestamp = datetime.now().astimezone().strftime(time_format)
-    message = f"--> {timestamp}\n" \
-              f"<a href='{txn_link}'>{formatted_txn_hash} on {chain.title()}</a> " \
-              f"from <a href='{wallet_link}'>{wallet.name}</a>\n" \
-              f"Stamp:  {txn_stamp}\n" \
-              f"Type: <a href='{interacted_with_link}'>{txn_type}</a>\n" \
-              f"Send: {', '.join(send_items)}\n" \
-              f"Receive: {', '.join(receive_items)}\n"
-
-    log_msg = f"{wallet.address}, {wallet.name} - {txn_stamp}, {txn_link}"
-
-    return message, log_msg
-
-
-def check_txn(txn: dict, tokens_dict: Dict[str, dict], txn_message: str) -> bool:
+def check_txn(txn: Transaction, txn_message: str, rules: RuleSet = default_rules) -> bool:
     """
     Checks whether a transaction is Normal or Spam.
 
-    :param txn: Transaction dictionary
-    :param tokens_dict: Dictionary with token info
+    :param txn: Transaction
     :param txn_message: Log message string to save txn
+    :param rules: Compiled filter rules, defaults to rejecting failed, approval and unverified token txns
     :return: True if transaction is Normal, False if Spam or Failed
     """
-    try:
-        status = txn['tx']['status']  # Check transaction status - 0 for Failed
-        if int(status) == 0:
-            log_fail.info(f"check_txn - Txn failed - {txn_message}")
-            return False
-    except (TypeError, KeyError):
-        pass
-
-    if len(txn['receives']) == 0 and len(txn['sends']) == 0:
-        log_spam.info(f"check_txn - Txn likely an approval - {txn_message}")
-        return False
-
-    try:
-        txn_type = str(txn['tx']['name']).lower()
-    except (TypeError, KeyError):
-        txn_type = str(txn['cate_id']).lower()
-
-    for receive in txn['receives']:
-        token_id = receive['token_id']
-        nft_error_msg = f"check_txn - Txn likely an NFT - {txn_message}"
+    return rules.check(txn, txn_message)
 
-        if 'receive' in txn_type:
-            # Check if token ID is verified
-            try:
-                is_verified = tokens_dict[token_id]['is_verified']
-                if not is_verified:
-                    log_spam.info(nft_error_msg)
-                    return False
 
-            except KeyError:
-                # If token_id not amongst token_dict then probably Spam
-                log_spam.info(nft_error_msg)
-                return False
+class Alert(NamedTuple):
+    """Telegram message of a txn to one of its chats."""
+    chat_id: str
+    text: str
+    on_sent: Callable[[float], None] | None  # Records the txn's latency once Telegram acknowledges it
 
-    for send in txn['sends']:
-        token_id = send['token_id']
-        nft_error_msg = f"check_txn - Txn likely an NFT - {txn_message}"
 
-        # Check if token ID is verified
-        try:
-            is_verified = tokens_dict[token_id]['is_verified']
-            if not is_verified:
-                log_spam.info(nft_error_msg)
-                return False
-
-        except KeyError:
-            # If token_id not amongst token_dict then probably Spam
-            log_spam.info(nft_error_msg)
-            return False
-
-    return True
-
-
-def alert_txns(txns: List[dict], wallet: Wallet, tokens_dict: Dict[str, dict],
-               project_dict: Dict[str, dict], whale_txn_limit: float = 100000.0) -> None:
+def prepare_alerts(txns: List[Transaction], wallet: Wallet, whale_txn_limit: float = 100000.0,
+                   route: Route | None = None, rules: RuleSet = default_rules,
+                   requested: float = 0.0, received: float = 0.0) -> List[Alert]:
     """
-    Alerts for any matching transactions via Telegram message.
+    Renders and routes the alerts of transactions, without sending them.
+    Each txn is formatted once and traced until Telegram acknowledges it, see latency_tracker.
 
-    :param txns: Transaction dictionary
+    :param txns: List of transactions
     :param wallet: Wallet txn came from
-    :param tokens_dict: Dictionary with token info
-    :param project_dict: Dictionary with project info
     :param whale_txn_limit: Mark txns that are above some USD amount
+    :param route: Chats the wallet's txns are sent to, default_route if None
+    :param rules: Compiled filter rules
+    :param requested: Time the DeBank request the txns were found in was started, 0 if unknown
+    :param received: Time its response was received, 0 if unknown
+    :returns: One alert per txn and chat
     """
+    if route is None:
+        route = default_route()
 
-    for txn in txns:
+    detected = time()
 
-        # If nothing returned - continue
-        if not txn or len(txn) == 0:
-            continue
+    # Skip empty entries, then render the whole burst in one call
+    txns = [txn for txn in txns if txn]
+    rendered = render_txns(txns, wallet, whale_txn_limit)
+    formatted = time()
 
-        telegram_msg, log_msg = format_txn_message(txn, wallet, tokens_dict, project_dict, whale_txn_limit)
-
-        # Send every new txn to All Chat
-        telegram_send_message(telegram_msg, telegram_chat_id=CHAT_ID_ALERTS_ALL)
+    alerts = []
+    for txn, (telegram_msg, log_msg) in zip(txns, rendered):
         log_txns.info(log_msg)
 
-        # Send filtered txns to Filtered Chat
-        if check_txn(txn, tokens_dict, log_msg):
-            telegram_send_message(telegram_msg, telegram_chat_id=CHAT_ID_ALERTS)
+        # Every new txn goes to the wallet's All Chats, filtered txns also go to its Filtered Chats
+        chat_ids = route.destinations(check_txn(txn, log_msg, rules))
+
+        trace = latency_tracker.trace(wallet.address, txn.time_at, detected, formatted, requested, received)
+        on_sent = partial(latency_tracker.ack, trace) if trace else None
+        alerts.extend(Alert(chat_id, telegram_msg, on_sent) for chat_id in chat_ids)
+
+    return alerts
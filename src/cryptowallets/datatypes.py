@@ -1,3 +1,9 @@
+from sys import intern
+from typing import (
+    Dict,
+    Iterable,
+    List,
+)
 from dataclasses import dataclass
 
 
@@ -9,3 +15,177 @@ class Wallet:
 
     def __repr__(self):
         return f"{self.name}, {self.address}"
+
+
+class Model:
+    """Base class of the compact txn models."""
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        """Returns the model as a dictionary, eg. to save it as JSON."""
+        return {name: _to_plain(getattr(self, name)) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+def _to_plain(value):
+    if isinstance(value, Model):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_to_plain(item) for item in value]
+
+    return value
+
+
+def _intern(value: str | None) -> str | None:
+    """Interns repeated strings, so that every txn refers to a single copy."""
+    return intern(value) if isinstance(value, str) else value
+
+
+class TokenTransfer(Model):
+    """Amount of a token sent or received in a txn."""
+    __slots__ = ('token_id', 'amount')
+
+    def __init__(self, token_id: str, amount: float):
+        self.token_id = _intern(token_id)
+        self.amount = amount
+
+
+class Transaction(Model):
+    """
+    Transaction of a wallet's history, built once from a DeBank response.
+    Chain names, token ids and other repeated strings are interned.
+    """
+    __slots__ = ('id', 'chain', 'time_at', 'other_addr', 'project_id', 'cate_id',
+                 'tx_name', 'status', 'sends', 'receives', 'approve_token_id')
+
+    def __init__(self, id: str, chain: str, time_at: float, other_addr: str | None = None,
+                 project_id: str | None = None, cate_id: str | None = None, tx_name: str | None = None,
+                 status: int | None = None, sends: List[TokenTransfer] | None = None,
+                 receives: List[TokenTransfer] | None = None, approve_token_id: str | None = None):
+        """
+        :param id: Transaction hash
+        :param chain: Chain name, eg. eth, ftm, avax
+        :param time_at: Transaction timestamp in secs
+        :param other_addr: Address interacted with
+        :param project_id: DeBank project ID, eg. uniswap3
+        :param cate_id: DeBank category of txns without a contract call, eg. send
+        :param tx_name: Name of the contract call, None if the txn has no call
+        :param status: Transaction status, 0 if failed
+        :param sends: Tokens sent
+        :param receives: Tokens received
+        :param approve_token_id: Token approved, None if not an approval
+        """
+        self.id = id
+        self.chain = _intern(chain)
+        self.time_at = time_at
+        self.other_addr = other_addr
+        self.project_id = _intern(project_id)
+        self.cate_id = _intern(cate_id)
+        self.tx_name = _intern(tx_name)
+        self.status = status
+        self.sends = sends or []
+        self.receives = receives or []
+        self.approve_token_id = _intern(approve_token_id)
+
+    @property
+    def txn_type(self) -> str:
+        """Lower case name of the contract call, or the category if there is no call."""
+        return str(self.tx_name if self.tx_name is not None else self.cate_id).lower()
+
+
+class TokenInfo(Model):
+    """Token info shared by all txns of a chain."""
+    __slots__ = ('id', 'chain', 'symbol', 'optimized_symbol', 'price', 'is_verified')
+
+    def __init__(self, id: str, chain: str, symbol: str, optimized_symbol: str | None = None,
+                 price: float | None = None, is_verified: bool | None = None):
+        self.id = _intern(id)
+        self.chain = _intern(chain)
+        self.symbol = symbol
+        self.optimized_symbol = optimized_symbol or symbol
+        self.price = price
+        self.is_verified = is_verified
+
+
+class ProjectInfo(Model):
+    """DeBank project info."""
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id: str, name: str):
+        self.id = _intern(id)
+        self.name = name
+
+
+class SeenTxns:
+    """
+    Insertion ordered set of the last seen transaction ids of a wallet, with a high-water mark on 'time_at'.
+    New txns are found by id. Only txns older than the mark by more than a lookback window are skipped,
+    so that txns DeBank indexes late, with an older 'time_at', are still alerted.
+    Txns no newer than the last evicted id are skipped too, as they may have been seen before.
+    """
+    __slots__ = ('capacity', 'lookback', 'high_water', 'evicted_at', '_ids')
+
+    def __init__(self, txns: Iterable[Transaction] = (), capacity: int = 40, lookback: float = 86400.0):
+        """
+        :param txns: Transactions to mark as seen
+        :param capacity: Max number of ids kept, the oldest ones are dropped first
+        :param lookback: Secs before the high-water mark in which unseen txns are still new
+        """
+        self.capacity = capacity
+        self.lookback = lookback
+        self.high_water = 0.0
+        self.evicted_at = 0.0  # Newest 'time_at' of the evicted ids
+        self._ids: Dict[str, float] = {}
+
+        # DeBank returns newest txns first - add oldest first so they get evicted first
+        self.update(reversed(list(txns)))
+
+    def __contains__(self, txn_id: str) -> bool:
+        return txn_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, txn_id: str, time_at: float = 0.0) -> None:
+        """
+        Marks a transaction id as seen.
+
+        :param txn_id: Transaction hash
+        :param time_at: Transaction timestamp in secs
+        """
+        if txn_id not in self._ids:
+            self._ids[txn_id] = time_at
+            if len(self._ids) > self.capacity:
+                oldest = next(iter(self._ids))
+                self.evicted_at = max(self.evicted_at, self._ids.pop(oldest))
+
+        if time_at > self.high_water:
+            self.high_water = time_at
+
+    def update(self, txns: Iterable[Transaction]) -> None:
+        """
+        Marks a list of transactions as seen.
+
+        :param txns: List of transactions
+        """
+        for txn in txns:
+            self.add(txn.id, txn.time_at)
+
+    def diff(self, new_list: List[Transaction], since: float | None = None) -> List[Transaction]:
+        """
+        Returns transactions that have not been seen yet.
+        Txns older than the high-water mark by more than the lookback window
+        or no newer than the last evicted id are skipped.
+
+        :param new_list: New list of transactions
+        :param since: Skip txns older than this instead, eg. when backfilling up to the high-water mark
+        :return: List of transactions that are in new list but have not been seen
+        """
+        if since is None:
+            since = self.high_water - self.lookback
+
+        return [txn for txn in new_list
+                if txn.time_at >= since and txn.time_at > self.evicted_at and txn.id not in self._ids]
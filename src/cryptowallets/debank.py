@@ -1,50 +1,120 @@
 """
 Asynchronous transaction history scraping of https://debank.com/ for a specified wallet address.
 """
-from typing import List
-from copy import deepcopy
+import asyncio
+import sqlite3
+
+from typing import (
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+)
+from functools import partial
+from collections import deque
+from multiprocessing.queues import Queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from requests import Response
 from time import (
+    monotonic,
     perf_counter,
     sleep,
+    thread_time,
+    time,
 )
 
-from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.datatypes import (
+    Wallet,
+    SeenTxns,
+    Transaction,
+)
 from src.cryptowallets.compare import (
-    compare_lists,
-    alert_txns,
+    compare_seen,
+    prepare_alerts,
+)
+from src.cryptowallets.state import StateStore
+from src.cryptowallets.decode import (
+    HistoryPage,
+    Validators,
+    decode_history,
+    fingerprint,
+    unchanged_page,
 )
+from src.cryptowallets.cache import (
+    cache_response,
+    want_prices,
+)
+from src.cryptowallets.prices import price_cache
+from src.cryptowallets.rules import (
+    RuleSet,
+    compile_rules,
+)
+from src.cryptowallets.scheduler import WalletScheduler
+from src.cryptowallets.routing import Route
+from src.cryptowallets.latency import latency_tracker
 from src.cryptowallets.tor import (
-    change_ip,
-    get_tor_session,
-    user_agent,
+    Circuit,
+    circuit_pool,
+    session_pool,
 )
+from src.cryptowallets.useragents import user_agent_pool
+from src.cryptowallets.common import variables
 from src.cryptowallets.common.logger import log_error
-from src.cryptowallets.common.variables import time_format
-
-
-last_newnym = perf_counter()
+from src.cryptowallets.common.heartbeat import Heartbeat
+from src.cryptowallets.common.dispatcher import dispatcher
+from src.cryptowallets.common.metrics import (
+    registry,
+    debank_bytes_decoded,
+    debank_cpu_seconds,
+    debank_responses,
+    fetch_seconds,
+    json_errors,
+    loop_seconds,
+    rate_limited,
+    txns_found,
+)
+from src.cryptowallets.common.variables import (
+    time_format,
+    state_file,
+    heartbeat_file,
+)
 
 
-def get_debank_resp(wallet: Wallet, txn_count: int = 20,
-                    timeout: int = 10, port: int = 9050) -> Response | None:
+def get_debank_resp(wallet: Wallet, txn_count: int = 20, timeout: int = 10,
+                    circuit: Circuit | None = None, start_time: float = 0,
+                    validators: Validators | None = None) -> Response | None:
     """
     Returns a GET response from https://api.debank.com/history/list for a wallet address.
 
     :param wallet: Address to scrape transactions from
     :param txn_count: Number of transactions to return. Max 20.
     :param timeout: Maximum time to wait for response
-    :param port: Port number
+    :param circuit: Tor circuit to send the request through, defaults to port 9050
+    :param start_time: Return txns older than this timestamp, 0 for the latest txns
+    :param validators: Validators of the wallet's last response, sent as If-None-Match and If-Modified-Since
     :returns: History list transactions data
     """
-    start_time = 0
+    if circuit is None:
+        circuit = Circuit()
 
-    api = f"https://api.debank.com/history/list" \
+    api = f"{variables.DEBANK_API}/history/list" \
           f"?page_count={txn_count}&start_time={start_time}&token_id=&user_addr={wallet.address}"
 
     try:
-        resp = get_tor_session(port=port).get(api, timeout=timeout, headers={"User_Agent": user_agent.random})
+        with session_pool.session(circuit.socks_port, circuit.isolation) as session:
+            # Sessions already carry their circuit's pinned user agent
+            headers = {} if user_agent_pool.pin else {"User-Agent": user_agent_pool.next()}
+            if validators is not None:
+                if validators.etag:
+                    headers["If-None-Match"] = validators.etag
+                if validators.last_modified:
+                    headers["If-Modified-Since"] = validators.last_modified
+
+            resp = session.get(api, timeout=timeout, headers=headers or None)
         return resp
 
     except Exception:
@@ -52,112 +122,492 @@ def get_debank_resp(wallet: Wallet, txn_count: int = 20,
         return None
 
 
-def get_last_txns(wallet: Wallet, txn_count: int = 20,
-                  timeout: int = 8, max_wait_time: int = 15) -> dict | None:
+def get_last_txns(wallet: Wallet, txn_count: int = 20, timeout: int = 8,
+                  max_wait_time: int = 15, start_time: float = 0,
+                  validators: Validators | None = None) -> HistoryPage | None:
     """
     Tries to get last txns from DeBank until max wait time reached.
+    Requests are spread across the circuit pool and a rate limited circuit is benched
+    while the request is retried on another one.
+    Given the validators of the wallet's last response, an unchanged response is detected before it is decoded.
 
     :param wallet: Address to scrape transactions from
     :param txn_count: Number of transactions to return. Max 20
     :param timeout: Maximum time to wait for response
     :param max_wait_time: Max time to wait for rery
-    :returns: Response dictionary
+    :param start_time: Return txns older than this timestamp, 0 for the latest txns
+    :param validators: Validators of the wallet's last processed response
+    :returns: Decoded response, only the fields that are read are kept, or unchanged_page if nothing changed
     """
-    global last_newnym
+    start = perf_counter()
+    requested = time()  # Includes retries of rate limited requests
+    while True:
 
-    # Try to get a response and if unsuccessful return
-    resp = get_debank_resp(wallet, txn_count, timeout)
-    if resp is None:
-        return None
+        if perf_counter() - start >= max_wait_time:
+            log_error.warning(f"'get_last_txns' - Max wait time exceeded for {wallet.name}")
+            return None
 
-    # If request is rate limited enter loop
-    start = perf_counter()
-    while resp.status_code == 429:
+        circuit = circuit_pool.acquire()
+        if circuit is None:
+            # All circuits are benched - sleep until one becomes available
+            sleep(max(0.0, min(circuit_pool.wait_time(), max_wait_time - (perf_counter() - start))))
+            continue
 
-        if perf_counter() >= last_newnym:
-            secs = change_ip()  # Change IP using tor router
-            last_newnym = perf_counter() + secs
-        else:
-            sleep(last_newnym - perf_counter())  # sleep before retrying new control connection
+        try:
+            resp = get_debank_resp(wallet, txn_count, timeout, circuit, start_time, validators)
+        finally:
+            circuit_pool.release(circuit)
 
-        resp = get_debank_resp(wallet, txn_count, timeout)
+        # Try to get a response and if unsuccessful return
         if resp is None:
             return None
 
-        if perf_counter() - start >= max_wait_time:
-            log_error.warning(f"'get_last_txns' - Max wait time exceeded for {wallet.name}")
-            return None
+        # If request is rate limited bench circuit and retry
+        if resp.status_code == 429:
+            rate_limited.inc()
+            circuit_pool.bench(circuit)
+            continue
+
+        break
+
+    received = time()
+    if resp.status_code == 304:
+        debank_responses.inc(result="not_modified")
+        return unchanged_page
+
+    # Compare the ids and timestamps of the raw response with the last one, before paying for a decode
+    start_cpu = thread_time()
+    digest = fingerprint(resp.content)
+    if digest is not None and validators is not None and digest == validators.fingerprint:
+        debank_responses.inc(result="unchanged")
+        debank_cpu_seconds.inc(thread_time() - start_cpu, result="unchanged")
+        return unchanged_page
 
     try:
-        data = resp.json()
+        page = decode_history(resp.content)
+        page.validators = Validators(resp.headers.get("ETag"), resp.headers.get("Last-Modified"), digest)
+        page.requested, page.received = requested, received
 
-        return data['data']
+        debank_responses.inc(result="decoded")
+        debank_cpu_seconds.inc(thread_time() - start_cpu, result="decoded")
+        debank_bytes_decoded.inc(len(resp.content))
+        return page
 
     except Exception as e:
+        json_errors.inc()
         log_error.warning(f"'get_last_txns' - JSON Error for {wallet.name} - {e}")
         return None
 
 
+def next_page_start(page: HistoryPage, until_time: float, txn_count: int = 20) -> float | None:
+    """
+    Returns the start_time of the page of txns preceding a history list page.
+
+    :param page: Decoded history list response
+    :param until_time: Timestamp of the last seen txn, paging stops once it is reached
+    :param txn_count: Number of transactions per page
+    :returns: start_time of the previous page or None if there is nothing older to fetch
+    """
+    history_list = page.history_list
+    if len(history_list) < txn_count:
+        return None
+
+    oldest = min(txn.time_at for txn in history_list)
+    if oldest <= until_time:
+        return None
+
+    return oldest
+
+
+def iter_txn_pages(wallet: Wallet, until_time: float, start_time: float = 0,
+                   txn_count: int = 20, max_pages: int = 50) -> Iterator[HistoryPage]:
+    """
+    Pages backwards through a wallet's history, from start_time until until_time is reached.
+
+    :param wallet: Address to scrape transactions from
+    :param until_time: Timestamp at which paging stops
+    :param start_time: Timestamp to page backwards from, 0 for the latest txns
+    :param txn_count: Number of transactions per page. Max 20
+    :param max_pages: Max number of pages to fetch
+    :returns: Decoded history list responses, newest first
+    """
+    for _ in range(max_pages):
+        page = get_last_txns(wallet, txn_count, start_time=start_time)
+        if not page or not page.history_list:
+            return
+
+        yield page
+
+        start_time = next_page_start(page, until_time, txn_count)
+        if start_time is None:
+            return
+
+
+async def backfill_wallets(jobs: List[Tuple[int, Wallet, float, float]], executor: ThreadPoolExecutor,
+                           max_in_flight: int = 10, max_pages: int = 10) -> AsyncIterator[Tuple[int, HistoryPage]]:
+    """
+    Pages backwards through several wallets' histories concurrently and yields pages as they arrive.
+    Pages of one wallet depend on each other and are fetched one after another.
+
+    :param jobs: List of (wallet index, wallet, start_time, until_time) tuples
+    :param executor: Thread pool that runs the blocking get_last_txns calls
+    :param max_in_flight: Max number of wallets paged at the same time
+    :param max_pages: Max number of pages fetched per wallet
+    :returns: (wallet index, decoded history list response) tuples
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    pages: asyncio.Queue = asyncio.Queue()
+
+    async def backfill(index: int, wallet: Wallet, start_time: float, until_time: float) -> None:
+        async with semaphore:
+            for _ in range(max_pages):
+                page = await loop.run_in_executor(executor, partial(get_last_txns, wallet, start_time=start_time))
+                if not page or not page.history_list:
+                    return
+
+                await pages.put((index, page))
+
+                start_time = next_page_start(page, until_time)
+                if start_time is None:
+                    return
+
+            log_error.warning(f"'backfill_wallets' - {wallet.name} - Stopped after {max_pages} pages.")
+
+    tasks = [asyncio.create_task(backfill(*job)) for job in jobs]
+    done = asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        while not (done.done() and pages.empty()):
+            getter = asyncio.ensure_future(pages.get())
+            await asyncio.wait([getter, done], return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+
+        # A failed wallet does not stop the others, but its error is reported
+        for (_, wallet, _, _), result in zip(jobs, done.result()):
+            if isinstance(result, Exception):
+                log_error.warning(f"'backfill_wallets' - {wallet.name} - Backfill failed - {result}")
+
+    finally:
+        # Stop paging if the caller stops consuming pages, eg. on an error
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_wallets(wallets_list: List[Wallet], executor: ThreadPoolExecutor,
+                        max_in_flight: int = 10, wallet_deadline: float = 30.0,
+                        validators: List[Validators | None] | None = None) -> List[HistoryPage | None]:
+    """
+    Fetches last txns for all wallets concurrently, keeping at most max_in_flight requests running.
+
+    :param wallets_list: List of Wallet[addr, name] data types
+    :param executor: Thread pool that runs the blocking get_last_txns calls
+    :param max_in_flight: Max number of wallets fetched at the same time
+    :param wallet_deadline: Max secs to wait for a single wallet, including 429 retries
+    :param validators: Validators of each wallet's last processed response, in wallets_list order
+    :returns: List of decoded responses, None for every wallet that failed and unchanged_page for every
+        wallet whose history has not changed, in wallets_list order
+    """
+    if validators is None:
+        validators = [None] * len(wallets_list)
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def fetch(wallet: Wallet, wallet_validators: Validators | None) -> HistoryPage | None:
+        async with semaphore:
+            start = perf_counter()
+            try:
+                getter = partial(get_last_txns, wallet, validators=wallet_validators)
+                return await asyncio.wait_for(loop.run_in_executor(executor, getter), timeout=wallet_deadline)
+            except asyncio.TimeoutError:
+                log_error.warning(f"'fetch_wallets' - Deadline of {wallet_deadline} secs exceeded for {wallet.name}")
+                return None
+            except Exception as e:
+                log_error.warning(f"'fetch_wallets' - {wallet.name} - {e}")
+                return None
+            finally:
+                fetch_seconds.observe(perf_counter() - start, wallet=wallet.address)
+
+    return await asyncio.gather(*[fetch(wallet, wallet_validators)
+                                  for wallet, wallet_validators in zip(wallets_list, validators)])
+
+
+def acknowledge(delivered: Deque[int], alert_id: int, on_sent: Callable[[float], None] | None,
+                acked: float) -> None:
+    """
+    Records an alert Telegram acknowledged, to be deleted from the outbox by the polling loop,
+    and passes the acknowledgement on. Called from a dispatcher worker thread.
+    """
+    delivered.append(alert_id)
+    if on_sent is not None:
+        on_sent(acked)
+
+
+def drain(delivered: Deque[int]) -> List[int]:
+    """Pops the ids of all alerts acknowledged so far."""
+    return [delivered.popleft() for _ in range(len(delivered))]
+
+
+def delete_delivered(store: StateStore, delivered: Deque[int]) -> None:
+    """Deletes the alerts acknowledged so far from the outbox, those that can't be deleted yet are kept for later."""
+    alert_ids = drain(delivered)
+    try:
+        store.delete_alerts(alert_ids)
+    except sqlite3.OperationalError as error:
+        log_error.warning(f"'delete_delivered' - {len(alert_ids)} alerts not deleted - {error}")
+        delivered.extend(alert_ids)
+
+
+def process_page(store: StateStore, delivered: Deque[int], rules: RuleSet, whale_txn_limit: float,
+                 wallet: Wallet, seen: SeenTxns, route: Route | None, page: HistoryPage,
+                 since: float | None = None) -> List[Transaction] | None:
+    """
+    Diffs a history list page of a wallet against its seen txns, alerts and saves new ones.
+    Alerts are queued only once they are saved, so that none is lost if the worker stops.
+
+    :param store: State store the txns and their alerts are saved to
+    :param delivered: Ids of alerts Telegram acknowledged, appended to from dispatcher threads
+    :param rules: Compiled filter rules
+    :param whale_txn_limit: Mark txns that are above some USD amount
+    :param wallet: Wallet the page came from
+    :param seen: Seen txns of the wallet, updated with the new ones
+    :param route: Chats the wallet's txns are sent to, default_route if None
+    :param page: History list page
+    :param since: Only txns made after since are new, see compare_seen
+    :returns: List of new txns or None if the page could not be diffed
+    """
+    # If new txns found - check them for spam
+    found_txns = compare_seen(page.history_list, seen, since=since)
+
+    if found_txns:
+        txns_found.inc(len(found_txns), wallet=wallet.address)
+        alerts = prepare_alerts(found_txns, wallet, whale_txn_limit, route, rules, page.requested, page.received)
+
+        # Save latest txn data only if there is a new txn
+        seen.update(reversed(found_txns))  # Oldest first, so the newest are evicted last
+
+        try:
+            alert_ids = store.save_wallet(wallet.address, found_txns, seen,
+                                          [(alert.chat_id, alert.text) for alert in alerts])
+            store.save_metadata(page)
+        except sqlite3.OperationalError as error:
+            # Eg. other shards kept the database locked - the txns are alerted again after a restart
+            log_error.warning(f"'process_page' - {wallet.address} - State not saved - {error}")
+            alert_ids = [None] * len(alerts)
+
+        for alert_id, alert in zip(alert_ids, alerts):
+            on_sent = alert.on_sent if alert_id is None else partial(acknowledge, delivered, alert_id, alert.on_sent)
+            dispatcher.send(alert.text, telegram_chat_id=alert.chat_id, on_sent=on_sent)
+
+    return found_txns
+
+
+async def process_backfills(jobs: List[Tuple[int, Wallet, float, float]], seen_txns: List[SeenTxns],
+                            routes: Dict[str, Route], process: Callable[..., List[Transaction] | None],
+                            executor: ThreadPoolExecutor, heartbeat: Heartbeat, expect_within: float,
+                            max_in_flight: int, max_backfill_pages: int, wallet_deadline: float,
+                            **beat_fields) -> None:
+    """
+    Streams backfilled pages into process as they arrive.
+
+    :param jobs: List of (index, Wallet, start_time, until_time), see backfill_wallets
+    :param seen_txns: Seen txns of every wallet, by index
+    :param routes: Routing table of wallet address to the chats its txns are sent to
+    :param process: process_page with the worker's state bound, called with (wallet, seen, route, page, since)
+    :param executor: Executor the requests are run in
+    :param heartbeat: Heartbeat of the worker
+    :param expect_within: Secs the fetches are expected to take
+    :param max_in_flight: Max number of pages fetched at the same time
+    :param max_backfill_pages: Max older pages fetched per wallet
+    :param wallet_deadline: Secs added to the deadline for processing each page
+    :param beat_fields: Fields written to the heartbeat, eg. shard, loop and loop_time
+    """
+    wallets = {i: wallet for i, wallet, _, _ in jobs}
+    until_times = {i: until_time for i, _, _, until_time in jobs}
+    deadline = monotonic() + expect_within
+    async for i, page in backfill_wallets(jobs, executor, max_in_flight, max_backfill_pages):
+        cache_response(page)
+        want_prices(page, seen_txns[i], until_times[i])
+
+        # Price lookups and processing of each page come on top of the fetch budget
+        deadline += price_cache.resolve_time() + wallet_deadline
+        heartbeat.beat("backfill", deadline - monotonic(), **beat_fields)
+        # Off the event loop, so that the other wallets' pages keep streaming in
+        await asyncio.to_thread(price_cache.resolve)
+        process(wallets[i], seen_txns[i], routes.get(wallets[i].address), page, since=until_times[i])
+
+
 def scrape_wallets(wallets_list: List[Wallet], sleep_time: int,
-                   whale_txn_limit: float = 100000.0) -> None:
+                   whale_txn_limit: float = 100000.0, max_in_flight: int = 10,
+                   wallet_deadline: float = 30.0, circuits: List[Circuit] | None = None,
+                   seen_capacity: int = 40, state_path: str = state_file,
+                   routes: Dict[str, Route] | None = None, filters: dict | None = None,
+                   max_interval: float = 300.0, requests_per_min: float = 0.0,
+                   max_backfill_pages: int = 10, shard: int = 0, stats_queue: Queue | None = None,
+                   stats_every: float = 5.0, heartbeat_path: str = heartbeat_file,
+                   pin_user_agent: bool = True) -> None:
     """
     Screens each wallet address for a new transaction and alerts via Telegram.
 
     :param wallets_list: List of Wallet[addr, name] data types.
     :param whale_txn_limit: Mark txns that are above some USD amount
-    :param sleep_time: Time to sleep between loops
+    :param sleep_time: Min secs between two polls of a wallet
+    :param max_in_flight: Max number of wallets fetched at the same time
+    :param wallet_deadline: Max secs to wait for a single wallet in each loop
+    :param circuits: Tor circuits to spread requests over, defaults to a single circuit on port 9050
+    :param seen_capacity: Number of last txn ids remembered per wallet
+    :param state_path: SQLite file the wallets' state is saved to and resumed from
+    :param routes: Routing table of wallet address to the chats its txns are sent to
+    :param filters: Filter settings of the input data, compiled into filter rules
+    :param max_interval: Max secs between two polls of a quiet wallet
+    :param requests_per_min: Max DeBank polls per minute across all wallets, 0 for no limit
+    :param max_backfill_pages: Max older pages fetched for a wallet whose latest page is all new txns
+    :param shard: Shard number when run by the supervisor
+    :param stats_queue: Queue that (shard, loop time, metrics snapshot) is reported to after every loop
+    :param stats_every: Min secs between two metrics snapshots sent to stats_queue
+    :param heartbeat_path: Heartbeat file rewritten at every stage of a loop, '{shard}' is replaced by the shard
+    :param pin_user_agent: Keep one user agent per Tor circuit instead of rotating it on every request
     """
+    if routes is None:
+        routes = {}
 
-    # Make sure all txns are fetched in the beginning to prevent Telegram msg glut
-    data = []
-    for wallet in wallets_list:
-        while True:
-            last_txns = get_last_txns(wallet)
-            if last_txns:
-                data.append(last_txns)
-                break
+    rules = compile_rules(filters, whale_txn_limit)
 
-    old_txns = [[tx['history_list'], tx['token_dict'], tx['project_dict']]
-                if tx else [[], {}, {}] for tx in data]
+    if circuits:
+        circuit_pool.reset(circuits)
 
-    loop_counter = 1
-    while True:
-        # Wait for new transaction to appear
-        start = perf_counter()
-        sleep(sleep_time)
+    user_agent_pool.pin = pin_user_agent
 
-        data = [get_last_txns(wallet) for wallet in wallets_list]
-        new_txns = [[tx['history_list'], tx['token_dict'], tx['project_dict']]
-                    if tx else [[], {}, {}] for tx in data]
+    # Txns made before the worker started are alerted, but their latency is not tracked
+    latency_tracker.reset()
 
-        # Iterate through all wallets
-        for i, txns in enumerate(zip(new_txns, old_txns)):
-            wallet = wallets_list[i]  # Get wallet data
-            new_txn, old_txn = txns  # Unpack new and old txns
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
 
-            new_history_list, new_token_dict, new_project_dict = new_txn  # Unpack new data
-            old_history_list, old_token_dict, old_project_dict = old_txn  # Unpack old data
+    # Resume wallets from their saved state. Txns made while stopped are alerted in the first loop
+    store = StateStore(state_path)
+    store.load_metadata()
+    saved = store.load_wallets([wallet.address for wallet in wallets_list], seen_capacity)
+    seen_txns = [saved.get(wallet.address) for wallet in wallets_list]
 
-            # If empty list returned - no point to compare
-            if len(new_history_list) == 0:
-                continue
+    # Alerts are saved with their txns and deleted once Telegram acknowledges them,
+    # those still queued when the worker stopped are sent again
+    delivered: Deque[int] = deque()
+    for alert_id, chat_id, text in store.load_alerts(wallet.address for wallet in wallets_list):
+        dispatcher.send(text, telegram_chat_id=chat_id, on_sent=partial(acknowledge, delivered, alert_id, None))
 
-            # If new txns found - check them for spam
-            found_txns = compare_lists(new_history_list, old_history_list)
+    # Validators of each wallet's last processed response, to skip the next one cheaply if nothing changed
+    validators: List[Validators | None] = [None] * len(wallets_list)
 
-            if found_txns:
-                all_token_dict = new_token_dict | old_token_dict  # Merge dictionaries
-                all_project_dict = new_project_dict | old_project_dict  # Merge dictionaries
-                alert_txns(found_txns, wallet, all_token_dict, all_project_dict, whale_txn_limit)
+    # Make sure all txns of new wallets are fetched in the beginning to prevent Telegram msg glut
+    heartbeat = Heartbeat(heartbeat_path.format(shard=shard))
+    while missing := [i for i, seen in enumerate(seen_txns) if seen is None]:
+        heartbeat.beat("baseline", wallet_deadline * -(-len(missing) // max_in_flight), shard=shard)
+        results = asyncio.run(fetch_wallets([wallets_list[i] for i in missing], executor,
+                                            max_in_flight, wallet_deadline))
+        for i, last_txns in zip(missing, results):
+            if not last_txns:
+                continue
+
+            cache_response(last_txns)
+            validators[i] = last_txns.validators
+            seen_txns[i] = SeenTxns(last_txns.history_list, seen_capacity)
+            store.save_wallet(wallets_list[i].address, last_txns.history_list, seen_txns[i])
+            store.save_metadata(last_txns)
 
-                # Save latest txn data in old_txns only if there is a new txn
-                old_txns[i][0].extend(found_txns)  # Extend txn list
-                if len(old_txns[i][0]) > 40:  # Keep list size to 40
-                    old_txns[i][0] = old_txns[i][0][len(found_txns):]
+    scheduler = WalletScheduler(len(wallets_list), sleep_time, max_interval, requests_per_min)
 
-                old_txns[i][1] = deepcopy(new_txns[i][1])  # Update old token_dict
-                old_txns[i][2] = deepcopy(new_txns[i][2])  # Update old project_dict
+    # Diffs, alerts and saves a wallet's page against the worker's state
+    process = partial(process_page, store, delivered, rules, whale_txn_limit)
 
-        timestamp = datetime.now().astimezone().strftime(time_format)
-        print(f"{timestamp} - Loop {loop_counter} executed in {(perf_counter() - start):,.2f} secs.")
-        loop_counter += 1
+    last_stats = 0.0
+    loop_time = 0.0
+    loop_counter = 1
+    try:
+        while True:
+            # Forget alerts Telegram has acknowledged, then wait for the next wallets to fall due
+            delete_delivered(store, delivered)
+            start = perf_counter()
+            wait_time = scheduler.wait_time()
+            heartbeat.beat("sleep", wait_time, shard=shard, loop=loop_counter, loop_time=loop_time)
+            sleep(wait_time)
+
+            # Each batch of max_in_flight wallets takes at most wallet_deadline secs
+            due = scheduler.pop_due()
+            heartbeat.beat("fetch", wallet_deadline * -(-len(due) // max_in_flight),
+                           shard=shard, loop=loop_counter, loop_time=loop_time)
+            data = asyncio.run(fetch_wallets([wallets_list[i] for i in due], executor, max_in_flight, wallet_deadline,
+                                             [validators[i] for i in due]))
+
+            # Share token info and prices of every response across wallets, then look up the prices
+            # new txns are still missing, with one batched lookup per chain for all wallets
+            for i, new_txns in zip(due, data):
+                if new_txns and new_txns is not unchanged_page:
+                    cache_response(new_txns)
+                    want_prices(new_txns, seen_txns[i])
+            heartbeat.beat("resolve", price_cache.resolve_time(), shard=shard, loop=loop_counter, loop_time=loop_time)
+            price_cache.resolve()
+
+            # Diffing, alerting and saving only queue and write locally, one wallet_deadline covers all due wallets
+            heartbeat.beat("process", wallet_deadline, shard=shard, loop=loop_counter, loop_time=loop_time)
+
+            # Iterate through all due wallets
+            backfill_jobs = []
+            for i, new_txns in zip(due, data):
+
+                # Same txns as the wallet's last response - nothing to decode, diff or save
+                if new_txns is unchanged_page:
+                    scheduler.reschedule(i, 0)
+                    continue
+
+                # If nothing returned - no point to compare
+                if not new_txns or len(new_txns.history_list) == 0:
+                    scheduler.reschedule(i, None)
+                    continue
+
+                until_time = seen_txns[i].high_water
+                found_txns = process(wallets_list[i], seen_txns[i], routes.get(wallets_list[i].address), new_txns)
+                scheduler.reschedule(i, len(found_txns) if found_txns is not None else None)
+
+                # Only a processed response may be skipped next time, so that a failed diff is retried
+                if found_txns is not None:
+                    validators[i] = new_txns.validators
+
+                # If every txn of the page is new, older ones may have been missed - page back to the last seen one
+                if found_txns and len(found_txns) == len(new_txns.history_list) and until_time > 0:
+                    start_time = next_page_start(new_txns, until_time)
+                    if start_time is not None:
+                        backfill_jobs.append((i, wallets_list[i], start_time, until_time))
+
+            if backfill_jobs:
+                expect_within = wallet_deadline * max_backfill_pages * -(-len(backfill_jobs) // max_in_flight)
+                heartbeat.beat("backfill", expect_within, shard=shard, loop=loop_counter, loop_time=loop_time)
+                asyncio.run(process_backfills(backfill_jobs, seen_txns, routes, process, executor, heartbeat,
+                                              expect_within, max_in_flight, max_backfill_pages, wallet_deadline,
+                                              shard=shard, loop=loop_counter, loop_time=loop_time))
+
+            loop_time = perf_counter() - start
+            loop_seconds.observe(loop_time)
+
+            if stats_queue is not None:
+                # Metrics snapshots are large with many wallets - send them at most every stats_every secs
+                snapshot = None
+                if perf_counter() - last_stats >= stats_every:
+                    snapshot = registry.snapshot()
+                    last_stats = perf_counter()
+
+                stats_queue.put((shard, loop_time, snapshot))
+
+            timestamp = datetime.now().astimezone().strftime(time_format)
+            print(f"{timestamp} - Loop {loop_counter} executed in {loop_time:,.2f} secs. "
+                  f"Polled {len(due)} wallets in shard {shard}.")
+            loop_counter += 1
+
+    finally:
+        # Send what is still queued, alerts that are not acknowledged by then stay in the outbox
+        dispatcher.stop()
+        delete_delivered(store, delivered)
+        store.close()
@@ -0,0 +1,130 @@
+"""
+Decoding of DeBank history list responses into compact models holding only the fields that are read.
+"""
+import re
+
+from hashlib import blake2b
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+)
+
+try:
+    from orjson import loads  # Fast path if orjson is installed
+except ImportError:
+    from json import loads
+
+from src.cryptowallets.datatypes import (
+    ProjectInfo,
+    TokenInfo,
+    TokenTransfer,
+    Transaction,
+)
+
+
+class Validators(NamedTuple):
+    """What a history list response is checked against on the next poll, to tell whether anything changed."""
+    etag: str | None
+    last_modified: str | None
+    fingerprint: bytes | None
+
+
+class HistoryPage:
+    """Decoded history list response, with the epoch times it was requested at and received."""
+    __slots__ = ('history_list', 'token_dict', 'project_dict', 'validators', 'requested', 'received')
+
+    def __init__(self, history_list: List[Transaction], token_dict: Dict[str, TokenInfo],
+                 project_dict: Dict[str, ProjectInfo], validators: Validators | None = None,
+                 requested: float = 0.0, received: float = 0.0):
+        self.history_list = history_list
+        self.token_dict = token_dict
+        self.project_dict = project_dict
+        self.validators = validators
+        self.requested = requested
+        self.received = received
+
+
+# Returned instead of a page when a wallet's history has not changed since its last poll
+unchanged_page = HistoryPage([], {}, {})
+
+# Ids, time_at and status values anywhere in a raw response, ie. txn hashes, token and project ids,
+# their timestamps and txn statuses
+_fingerprint_pattern = re.compile(rb'"(id|time_at|status)":\s*("[^"]*"|[-+.\deE]+|null)')
+
+
+def fingerprint(content: bytes) -> bytes | None:
+    """
+    Returns a digest of the ids, time_at and status values of a raw history list response, without decoding it.
+    Responses with the same fingerprint list the same txns, so a diff of the second one finds nothing new.
+    Token prices are left out: a response whose only change is prices has no new txns to alert,
+    and prices are refreshed from other wallets' responses and PRICE_API.
+
+    :param content: Response body
+    :returns: 16 byte digest or None if the response has no ids, eg. an error response
+    """
+    values = _fingerprint_pattern.findall(content)
+    if not values:
+        return None
+
+    return blake2b(b",".join(key + b"=" + value for key, value in values), digest_size=16).digest()
+
+
+def decode_transfer(item: dict) -> TokenTransfer:
+    return TokenTransfer(item['token_id'], item.get('amount') or 0.0)
+
+
+def decode_txn(txn: dict) -> Transaction:
+    """Projects a txn dictionary onto a Transaction."""
+    tx = txn.get('tx')
+    approve = txn.get('token_approve')
+
+    return Transaction(
+        id=txn['id'],
+        chain=txn['chain'],
+        time_at=txn.get('time_at') or 0.0,
+        other_addr=txn.get('other_addr'),
+        project_id=txn.get('project_id'),
+        cate_id=txn.get('cate_id'),
+        tx_name=(tx.get('name') or "") if tx else None,
+        status=tx.get('status') if tx else None,
+        sends=[decode_transfer(item) for item in txn.get('sends') or ()],
+        receives=[decode_transfer(item) for item in txn.get('receives') or ()],
+        approve_token_id=approve['token_id'] if approve else None,
+    )
+
+
+def decode_token(token: dict) -> TokenInfo:
+    """Projects a token info dictionary onto a TokenInfo."""
+    return TokenInfo(token.get('id'), token.get('chain'), token.get('symbol'), token.get('optimized_symbol'),
+                     token.get('price'), token.get('is_verified'))
+
+
+def decode_project(project: dict) -> ProjectInfo:
+    """Projects a project info dictionary onto a ProjectInfo."""
+    return ProjectInfo(project.get('id'), project.get('name'))
+
+
+def decode_page(data: dict) -> HistoryPage:
+    """
+    Projects the 'data' of a history list response onto models. All other fields are dropped.
+
+    :param data: History list response dictionary
+    :returns: HistoryPage instance
+    """
+    return HistoryPage(
+        history_list=[decode_txn(txn) for txn in data['history_list']],
+        token_dict={token_id: decode_token(token) for token_id, token in (data.get('token_dict') or {}).items()},
+        project_dict={project_id: decode_project(project)
+                      for project_id, project in (data.get('project_dict') or {}).items()},
+    )
+
+
+def decode_history(content: bytes) -> HistoryPage:
+    """
+    Decodes a raw history list response body.
+
+    :param content: Response body
+    :returns: HistoryPage instance
+    """
+    return decode_page(loads(content)['data'])
@@ -0,0 +1,98 @@
+"""
+End-to-end latency of alerted txns, from their on-chain time to Telegram's acknowledgement.
+"""
+from time import time
+from threading import Lock
+
+from src.cryptowallets.common.metrics import (
+    alert_latency,
+    wallet_alert_latency,
+)
+
+
+class TxnTrace:
+    """Epoch timestamps of a txn on its way from the chain to a Telegram chat."""
+    __slots__ = ('wallet', 'time_at', 'requested', 'received', 'detected', 'formatted', 'enqueued', 'acked')
+
+    def __init__(self, wallet: str, time_at: float, detected: float, formatted: float,
+                 requested: float = 0.0, received: float = 0.0):
+        """
+        :param wallet: Wallet address
+        :param time_at: On-chain time of the txn
+        :param detected: Time the txn was found in a DeBank response
+        :param formatted: Time its message was rendered
+        :param requested: Time the DeBank request it was found in was started, detected if unknown
+        :param received: Time that response was received, requested if unknown
+        """
+        self.wallet = wallet
+        self.time_at = time_at
+        self.requested = requested or detected
+        self.received = received or self.requested
+        self.detected = detected
+        self.formatted = formatted
+        self.enqueued = time()
+        self.acked = 0.0
+
+    def stages(self) -> dict:
+        """Returns the secs spent in each stage, once acknowledged."""
+        return {
+            "poll": self.requested - self.time_at,  # Polling cadence and DeBank indexing
+            "fetch": self.received - self.requested,  # Tor, DeBank and retries of rate limited requests
+            "resolve": self.detected - self.received,  # Decoding, the rest of the batch and price lookups
+            "format": self.formatted - self.detected,
+            "enqueue": self.enqueued - self.formatted,
+            "send": self.acked - self.enqueued,  # Dispatcher queue, rate limits and the Telegram request
+            "total": self.acked - self.time_at,
+        }
+
+
+class LatencyTracker:
+    """Records the stage latencies of every alerted txn as it is first acknowledged by Telegram."""
+
+    def __init__(self):
+        self.started = time()
+        self._lock = Lock()
+
+    def reset(self) -> None:
+        """Only tracks txns made from now on, eg. when a worker starts."""
+        self.started = time()
+
+    def trace(self, wallet: str, time_at: float, detected: float, formatted: float,
+              requested: float = 0.0, received: float = 0.0) -> TxnTrace | None:
+        """
+        Starts tracing a txn that is about to be queued for Telegram.
+
+        :param wallet: Wallet address
+        :param time_at: On-chain time of the txn
+        :param detected: Time the txn was found in a DeBank response
+        :param formatted: Time its message was rendered
+        :param requested: Time the DeBank request it was found in was started, 0 if unknown
+        :param received: Time that response was received, 0 if unknown
+        :returns: TxnTrace or None if the txn was made before tracking started, eg. while the screener was stopped
+        """
+        if time_at < self.started:
+            return None
+
+        return TxnTrace(wallet, time_at, detected, formatted, requested, received)
+
+    def ack(self, trace: TxnTrace, acked: float | None = None) -> None:
+        """
+        Records a txn's latencies when its message is acknowledged by Telegram in the first of its chats.
+
+        :param trace: TxnTrace of the txn
+        :param acked: Time of the acknowledgement, defaults to now
+        """
+        with self._lock:
+            if trace.acked:
+                return
+
+            trace.acked = acked or time()
+
+        stages = trace.stages()
+        for stage, secs in stages.items():
+            alert_latency.observe(max(0.0, secs), stage=stage)  # Clocks of DeBank and this host may differ
+
+        wallet_alert_latency.observe(max(0.0, stages["total"]), wallet=trace.wallet)
+
+
+latency_tracker = LatencyTracker()
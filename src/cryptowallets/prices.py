@@ -0,0 +1,229 @@
+"""
+Process wide token price cache, fed by every DeBank response. Prices it is missing are looked up in batches.
+"""
+from time import monotonic
+from threading import Lock
+from functools import lru_cache
+from collections import (
+    Counter,
+    defaultdict,
+)
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+)
+
+from src.cryptowallets.tor import (
+    Circuit,
+    circuit_pool,
+    session_pool,
+)
+from src.cryptowallets.common import variables
+from src.cryptowallets.common.logger import log_error
+from src.cryptowallets.common.metrics import (
+    price_lookups,
+    prices_missing,
+    prices_resolved,
+)
+
+
+class PriceSource:
+    """Source of token prices for tokens DeBank responses came without. The base source knows no prices."""
+
+    def lookup(self, chain: str, token_ids: List[str]) -> Dict[str, float]:
+        """
+        Returns the USD prices of several tokens of a chain, in a single request.
+
+        :param chain: Chain name, eg. eth, ftm, avax
+        :param token_ids: Token IDs, eg. token contract addresses
+        :returns: Dictionary of token_id: price, tokens without a known price are left out
+        """
+        return {}
+
+    def lookup_time(self, count: int) -> float:
+        """
+        Returns the max secs looking up the prices of count tokens of a chain may take.
+
+        :param count: Number of token IDs
+        :returns: Secs, 0 for a source that does not make requests
+        """
+        return 0.0
+
+
+class HttpPriceSource(PriceSource):
+    """
+    Price source at an HTTP endpoint, requested through the Tor circuit pool as
+    GET <url>?chain=<chain>&ids=<id>,<id>,... and answering with a JSON object of token_id: price.
+    """
+
+    def __init__(self, url: str, batch_size: int = 100, timeout: float = 10):
+        """
+        :param url: Endpoint URL, eg. http://127.0.0.1:8080/token/prices
+        :param batch_size: Max number of token IDs per request
+        :param timeout: Max secs to wait for a response
+        """
+        self.url = url
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+    def _get(self, chain: str, token_ids: List[str]) -> dict:
+        circuit = circuit_pool.acquire()
+        try:
+            route = circuit or Circuit()  # All circuits benched - use the default one
+            with session_pool.session(route.socks_port, route.isolation) as session:
+                resp = session.get(self.url, params={"chain": chain, "ids": ",".join(token_ids)},
+                                   timeout=self.timeout)
+            return resp.json()
+
+        finally:
+            if circuit is not None:
+                circuit_pool.release(circuit)
+
+    def lookup(self, chain: str, token_ids: List[str]) -> Dict[str, float]:
+        prices = {}
+        for i in range(0, len(token_ids), self.batch_size):
+            batch = token_ids[i:i + self.batch_size]
+            try:
+                data = self._get(chain, batch)
+                prices.update((token_id, float(data[token_id])) for token_id in batch
+                              if data.get(token_id) is not None)
+
+            except Exception as e:
+                log_error.warning(f"'HttpPriceSource' - {len(batch)} {chain} prices not fetched - {e}")
+
+        return prices
+
+    def lookup_time(self, count: int) -> float:
+        return -(-count // self.batch_size) * self.timeout
+
+
+@lru_cache(maxsize=None)
+def default_price_source() -> PriceSource:
+    """Returns the price source at PRICE_API or, if it is not set, a source that knows no prices."""
+    return HttpPriceSource(variables.PRICE_API) if variables.PRICE_API else PriceSource()
+
+
+class PriceCache:
+    """
+    Token prices in USD keyed by (chain, token_id), fed by every DeBank response and expiring by age.
+    Tokens without a fresh price are collected across wallets and resolved together, one lookup per chain.
+    """
+
+    def __init__(self, ttl: float = 300.0, source: PriceSource | None = None):
+        """
+        :param ttl: Secs after which a price is considered stale
+        :param source: Source missing prices are looked up in, default_price_source() if None
+        """
+        self.ttl = ttl
+        self.source = source
+
+        self._prices: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._missing: Set[Tuple[str, str]] = set()
+        self._unpriced: Dict[Tuple[str, str], float] = {}  # Tokens the source had no price for, oldest first
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def update(self, prices: Iterable[Tuple[Tuple[str, str], float | None]], updated_at: float | None = None) -> None:
+        """
+        Adds or refreshes prices, None prices are skipped.
+
+        :param prices: Iterable of ((chain, token_id), price) pairs
+        :param updated_at: Monotonic time the prices were fetched at, defaults to now
+        """
+        if updated_at is None:
+            updated_at = monotonic()
+
+        with self._lock:
+            for key, price in prices:
+                if price is not None:
+                    self._prices[key] = (updated_at, price)
+
+    def get(self, chain: str, token_id: str) -> float | None:
+        """
+        Returns a token's price if it has not expired.
+
+        :param chain: Chain name, eg. eth, ftm, avax
+        :param token_id: Token ID, eg. token contract address
+        :returns: Price in USD or None if unknown or stale
+        """
+        item = self._prices.get((chain, token_id))
+        if item is None or monotonic() - item[0] >= self.ttl:
+            return None
+
+        return item[1]
+
+    def want(self, chain: str, token_id: str) -> None:
+        """Marks a token's price to be resolved by the next resolve(), unless it is fresh."""
+        key = (chain, token_id)
+        if self.get(chain, token_id) is not None:
+            return
+
+        unpriced_at = self._unpriced.get(key)
+        if unpriced_at is not None and monotonic() - unpriced_at < self.ttl:
+            return  # The source had no price for it a moment ago
+
+        with self._lock:
+            self._missing.add(key)
+
+    def resolve_time(self) -> float:
+        """Returns the max secs the next resolve() may take, from the number of wanted prices per chain."""
+        with self._lock:
+            counts = Counter(chain for chain, _ in self._missing)
+
+        source = self.source or default_price_source()
+
+        return sum(source.lookup_time(count) for count in counts.values())
+
+    def resolve(self) -> int:
+        """
+        Looks up all wanted prices, with one batched lookup per chain.
+
+        :returns: Number of prices resolved
+        """
+        now = monotonic()
+        with self._lock:
+            missing, self._missing = self._missing, set()
+
+            # Forget tokens the source had no price for once they may be asked again
+            expired = []
+            for key, unpriced_at in self._unpriced.items():
+                if now - unpriced_at < self.ttl:
+                    break
+                expired.append(key)
+            for key in expired:
+                del self._unpriced[key]
+
+        if not missing:
+            return 0
+
+        by_chain: Dict[str, List[str]] = defaultdict(list)
+        for chain, token_id in missing:
+            by_chain[chain].append(token_id)
+
+        source = self.source or default_price_source()
+        resolved = 0
+        for chain, token_ids in by_chain.items():
+            price_lookups.inc(chain=chain)
+            prices = source.lookup(chain, sorted(token_ids))
+            self.update((((chain, token_id), price) for token_id, price in prices.items()), now)
+
+            with self._lock:
+                for token_id in token_ids:
+                    if token_id not in prices:
+                        # Moved to the end, so that the dict stays ordered by time asked
+                        self._unpriced.pop((chain, token_id), None)
+                        self._unpriced[(chain, token_id)] = now
+            resolved += len(prices)
+
+        prices_missing.inc(len(missing))
+        prices_resolved.inc(resolved)
+
+        return resolved
+
+
+price_cache = PriceCache()
@@ -0,0 +1,220 @@
+"""
+Rendering of transactions into Telegram and log messages, with links, labels and timestamps resolved once.
+"""
+from time import time
+from functools import lru_cache
+from datetime import (
+    datetime,
+    timezone,
+)
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from src.cryptowallets.datatypes import (
+    TokenTransfer,
+    Transaction,
+    Wallet,
+)
+from src.cryptowallets.cache import (
+    get_project,
+    get_token,
+    get_token_price,
+)
+from src.cryptowallets.common.variables import (
+    chains,
+    time_format,
+)
+
+
+class ChainLinks:
+    """Explorer link builder of a chain, falls back to a Google search for chains without a known explorer."""
+    __slots__ = ('title', '_tx_prefix', '_address_prefix', '_suffix')
+
+    def __init__(self, chain: str):
+        """
+        :param chain: Chain name, eg. eth, ftm, avax
+        """
+        self.title = chain.title()
+
+        if chain in chains:
+            explorer = chains[chain]
+            self._tx_prefix = f"{explorer}/tx/"
+            self._address_prefix = f"{explorer}/address/"
+            self._suffix = ""
+        else:
+            self._tx_prefix = self._address_prefix = f"https://www.google.com/search?&rls=en&q={chain}+"
+            self._suffix = "&ie=UTF-8&oe=UTF-8"
+
+    def tx(self, txn_hash: str) -> str:
+        return self._tx_prefix + txn_hash + self._suffix
+
+    def address(self, address: str) -> str:
+        return self._address_prefix + str(address) + self._suffix
+
+
+@lru_cache(maxsize=None)
+def chain_links(chain: str) -> ChainLinks:
+    """Returns the link builder of a chain, built once per chain."""
+    return ChainLinks(chain)
+
+
+class SecondClock:
+    """Local time string, formatted at most once per second."""
+    __slots__ = ('_second', '_text')
+
+    def __init__(self):
+        self._second = -1
+        self._text = ""
+
+    def now(self) -> str:
+        second = int(time())
+        if second != self._second:
+            self._text = datetime.now().astimezone().strftime(time_format)
+            self._second = second
+
+        return self._text
+
+
+clock = SecondClock()
+
+
+@lru_cache(maxsize=4096)
+def utc_stamp(time_at: int) -> str:
+    """Returns a txn timestamp as a UTC time string. Txns of a burst often share their block time."""
+    return datetime.fromtimestamp(time_at, timezone.utc).strftime(time_format)
+
+
+# Opening link tag and symbol per (chain, token_id). Unknown tokens are not cached, as they may become known
+_token_labels: Dict[Tuple[str, str], Tuple[str, str]] = {}
+max_token_labels = 50000
+
+
+def token_label(chain: str, token_id: str) -> Tuple[str, str | None]:
+    """
+    Returns the opening link tag of a token and its symbol.
+
+    :param chain: Chain name, eg. eth, ftm, avax
+    :param token_id: Token ID, eg. token contract address
+    :returns: Opening link tag and token symbol, None if the token is unknown
+    """
+    key = (chain, token_id)
+    label = _token_labels.get(key)
+    if label is not None:
+        return label
+
+    link = f"<a href='{chain_links(chain).address(token_id)}'>"
+    token = get_token(chain, token_id)
+    if token is None:
+        return link, None
+
+    if len(_token_labels) >= max_token_labels:
+        _token_labels.clear()
+
+    label = _token_labels[key] = (link, str(token.symbol))
+
+    return label
+
+
+def transfer_items(transfers: List[TokenTransfer], sign: str, chain: str,
+                   whale_txn_limit: float = 100000.0) -> List[str]:
+    """
+    Renders the tokens sent or received in a txn.
+
+    :param transfers: Tokens sent or received
+    :param sign: '-' for sends, '+' for receives
+    :param chain: Chain name, eg. eth, ftm, avax
+    :param whale_txn_limit: Mark txns that are above some USD amount
+    :returns: One item per token, ['None'] if nothing was transferred
+    """
+    if not transfers:
+        return ['None']
+
+    items = []
+    for transfer in transfers:
+        link, symbol = token_label(chain, transfer.token_id)
+        if symbol is None:
+            token_name = "+1 Unknown NFT" if len(transfer.token_id) < 42 else "+1 Unknown Item"
+            items.append(f"{link}{token_name}</a>")
+            continue
+
+        amount = transfer.amount
+        price = get_token_price(chain, transfer.token_id)
+        if price is None:
+            items.append(f"{link}{sign}{amount:,.2f} {symbol}</a>($n/a)")
+            continue
+
+        value = price * amount
+        whale_mark = '🐳' if value >= whale_txn_limit else ''
+        items.append(f"{whale_mark}{link}{sign}{amount:,.2f} {symbol}</a>(${value:,.2f})")
+
+    return items
+
+
+def txn_type_label(txn: Transaction) -> str:
+    """Returns the txn type shown in messages, eg. 'Swap, Uniswap V3'."""
+    if txn.tx_name:
+        txn_type = txn.tx_name.title()
+    elif txn.tx_name is None and txn.cate_id:
+        txn_type = txn.cate_id.title()
+    else:
+        txn_type = 'Contract Interaction'
+
+    project = get_project(txn.project_id) if txn.project_id else None
+    if project is None:
+        return txn_type
+
+    if txn.approve_token_id:
+        approve_token = get_token(txn.chain, txn.approve_token_id)
+        approve_token_name = approve_token.optimized_symbol if approve_token else "Unknown"
+
+        return f"{txn_type} {approve_token_name} on {project.name}"
+
+    return f"{txn_type}, {project.name}"
+
+
+def render_txn(txn: Transaction, wallet: Wallet, whale_txn_limit: float = 100000.0,
+               timestamp: str | None = None) -> Tuple[str, str]:
+    """
+    Renders a transaction into a Telegram message and a log message.
+
+    :param txn: Transaction
+    :param wallet: Wallet txn came from
+    :param whale_txn_limit: Mark txns that are above some USD amount
+    :param timestamp: Local time shown in the message, defaults to now
+    :returns: Telegram message and log message
+    """
+    links = chain_links(txn.chain)
+    txn_hash = txn.id
+    txn_link = links.tx(txn_hash)
+    txn_stamp = utc_stamp(int(txn.time_at))
+
+    message = f"--> {timestamp or clock.now()}\n" \
+              f"<a href='{txn_link}'>{txn_hash[0:6]}...{txn_hash[-4:]} on {links.title}</a> " \
+              f"from <a href='https://debank.com/profile/{wallet.address}/history'>{wallet.name}</a>\n" \
+              f"Stamp:  {txn_stamp}\n" \
+              f"Type: <a href='{links.address(txn.other_addr)}'>{txn_type_label(txn)}</a>\n" \
+              f"Send: {', '.join(transfer_items(txn.sends, '-', txn.chain, whale_txn_limit))}\n" \
+              f"Receive: {', '.join(transfer_items(txn.receives, '+', txn.chain, whale_txn_limit))}\n"
+
+    log_msg = f"{wallet.address}, {wallet.name} - {txn_stamp}, {txn_link}"
+
+    return message, log_msg
+
+
+def render_txns(txns: Iterable[Transaction], wallet: Wallet,
+                whale_txn_limit: float = 100000.0) -> List[Tuple[str, str]]:
+    """
+    Renders many transactions of a wallet in one call, sharing a single timestamp.
+
+    :param txns: Transactions
+    :param wallet: Wallet txns came from
+    :param whale_txn_limit: Mark txns that are above some USD amount
+    :returns: List of (Telegram message, log message) tuples, in txns order
+    """
+    timestamp = clock.now()
+
+    return [render_txn(txn, wallet, whale_txn_limit, timestamp) for txn in txns]
@@ -0,0 +1,648 @@
+"""
+Offline replay of recorded DeBank responses, to benchmark the screening pipeline without DeBank, Tor or Telegram.
+"""
+import os
+import re
+import sys
+import json
+import random
+import hashlib
+import tempfile
+
+from glob import glob
+from queue import Empty
+from multiprocessing import (
+    Process,
+    Queue,
+)
+from threading import (
+    Lock,
+    Thread,
+)
+from urllib.parse import (
+    parse_qs,
+    urlparse,
+)
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from time import (
+    sleep,
+    time,
+)
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Tuple,
+)
+
+from tabulate import tabulate
+
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.tor import build_circuits
+from src.cryptowallets.common import variables
+from src.cryptowallets.common.logger import log_error
+from src.cryptowallets.common.dispatcher import (
+    TelegramDispatcher,
+    message_size,
+)
+
+
+# Txn hashes in a Telegram message, eg. in its explorer links
+txn_hash_pattern = re.compile(r"0x[0-9a-fA-F]{64}(?![0-9a-fA-F])")
+
+
+def capture_fixtures(wallets_list: List[Wallet], directory: str, txn_count: int = 20) -> int:
+    """
+    Saves the raw history list response of each wallet as a fixture. Requires a running Tor client.
+
+    :param wallets_list: List of Wallet[addr, name] data types
+    :param directory: Directory fixtures are saved to, one <address>.json file per wallet
+    :param txn_count: Number of transactions per response. Max 20
+    :returns: Number of fixtures saved
+    """
+    from src.cryptowallets.debank import get_debank_resp
+
+    os.makedirs(directory, exist_ok=True)
+
+    saved = 0
+    for wallet in wallets_list:
+        resp = get_debank_resp(wallet, txn_count)
+        if resp is None or resp.status_code != 200:
+            log_error.warning(f"'capture_fixtures' - {wallet} - Response not captured.")
+            continue
+
+        with open(os.path.join(directory, f"{wallet.address}.json"), "wb") as file:
+            file.write(resp.content)
+        saved += 1
+
+    return saved
+
+
+def load_fixtures(directory: str) -> List[dict]:
+    """
+    Loads captured fixtures.
+
+    :param directory: Directory of <address>.json fixtures
+    :returns: List of the 'data' of each recorded response
+    """
+    fixtures = []
+    for path in sorted(glob(os.path.join(directory, "*.json"))):
+        with open(path, "rb") as file:
+            fixtures.append(json.load(file)['data'])
+
+    return fixtures
+
+
+def synthetic_fixture(txn_count: int = 20, t0: float | None = None) -> dict:
+    """
+    Returns a made-up history list response, for replays when no fixtures have been captured.
+
+    :param txn_count: Number of transactions
+    :param t0: Timestamp of the newest txn, defaults to now
+    :returns: 'data' of a history list response
+    """
+    t0 = t0 or time()
+    usdc = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"
+
+    history_list = []
+    for i in range(txn_count):
+        swap = i % 2 == 1
+        history_list.append({
+            "id": "0x" + hashlib.sha256(f"synthetic-{i}".encode()).hexdigest(),
+            "chain": "eth",
+            "time_at": t0 - i * 600,
+            "other_addr": "0x68b3465833fb72a70ecdf485e0e4c7bd8665fc45",
+            "project_id": "uniswap3" if swap else None,
+            "cate_id": None if swap else "send",
+            "tx": {"name": "multicall" if swap else "", "status": 1},
+            "sends": [{"amount": 1.5 + i, "token_id": "eth"}],
+            "receives": [{"amount": 2500.0 * (1.5 + i), "token_id": usdc}] if swap else [],
+            "token_approve": None,
+        })
+
+    return {
+        "history_list": history_list,
+        "token_dict": {
+            "eth": {"id": "eth", "chain": "eth", "symbol": "ETH", "optimized_symbol": "ETH",
+                    "price": 2500.0, "is_verified": True},
+            usdc: {"id": usdc, "chain": "eth", "symbol": "USDC", "optimized_symbol": "USDC",
+                   "price": 1.0, "is_verified": True},
+        },
+        "project_dict": {"uniswap3": {"id": "uniswap3", "name": "Uniswap V3"}},
+    }
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that ignores clients dropping their connections, eg. when a replay is stopped."""
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(handler: type, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serves a request handler from a daemon thread, port 0 picks a free port."""
+    server = ReplayServer((host, port), handler)
+    Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+
+    return server
+
+
+class Feed:
+    """Txn history of a wallet served by FakeDebank, newest first."""
+    __slots__ = ('fixture', 'token_dict', 'history', 'offset', 'published', 'body')
+
+    def __init__(self, fixture: dict, token_dict: dict, offset: float):
+        self.fixture = fixture
+        self.token_dict = token_dict
+        self.history: List[dict] = list(fixture['history_list'])
+        self.offset = offset
+        self.published = 0
+        self.body: bytes | None = None
+
+
+class FakeDebank:
+    """
+    Local stand-in for the DeBank history list API serving recorded responses.
+    Each wallet is served one of the fixtures and new txns are published to it on a fixed schedule,
+    cloned from the fixture's txns and stamped with their publish time.
+    429s, latency and timeouts can be injected into any history list request.
+    With etags, responses carry an ETag and a request whose If-None-Match matches is answered with a 304.
+    Prices of all fixtures' tokens are served as a price source at /token/prices, see HttpPriceSource.
+    """
+
+    def __init__(self, fixtures: List[dict], txn_interval: float = 30.0, rate_limit: float = 0.0,
+                 latency: float = 0.0, timeout: float = 0.0, hang_time: float = 30.0,
+                 drop_tokens: float = 0.0, max_history: int = 200, etags: bool = False, seed: int = 0):
+        """
+        :param fixtures: 'data' of recorded history list responses
+        :param txn_interval: Secs between two new txns of a wallet, 0 for no new txns
+        :param rate_limit: Share of requests answered with a 429
+        :param latency: Max secs a response is delayed by, delays are spread evenly between 0 and latency
+        :param timeout: Share of requests left hanging for hang_time secs, so that the client times out
+        :param hang_time: Secs a timed out request hangs for
+        :param drop_tokens: Share of tokens left out of each wallet's token_dict, so that their prices are missing
+        :param max_history: Max number of txns kept per wallet
+        :param etags: Send ETags and answer conditional requests with a 304 if nothing changed
+        :param seed: Random seed of the injected failures
+        """
+        if not fixtures:
+            raise Exception("At least one fixture is required.")
+
+        self.fixtures = fixtures
+        self.txn_interval = txn_interval
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.timeout = timeout
+        self.hang_time = hang_time
+        self.drop_tokens = drop_tokens
+        self.max_history = max_history
+        self.etags = etags
+
+        self.prices = {(token.get('chain'), token_id): token.get('price') for fixture in fixtures
+                       for token_id, token in (fixture.get('token_dict') or {}).items()}
+
+        self.started = time()
+        self.stopped: float | None = None
+        self.published: Dict[str, float] = {}  # Txn id: publish time
+        self.stats = {"requests": 0, "rate_limited": 0, "timeouts": 0, "not_modified": 0, "price_requests": 0}
+        self.server: ThreadingHTTPServer | None = None
+
+        self._feeds: Dict[str, Feed] = {}
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _feed(self, address: str) -> Feed:
+        """Returns a wallet's feed, assigning it a fixture on its first request."""
+        feed = self._feeds.get(address)
+        if feed is None:
+            index = int(hashlib.md5(address.encode()).hexdigest(), 16) % len(self.fixtures)
+            fixture = self.fixtures[index]
+            token_dict = {token_id: token for token_id, token in (fixture.get('token_dict') or {}).items()
+                          if self._random.random() >= self.drop_tokens}
+            offset = self._random.uniform(0, self.txn_interval)  # Spread new txns of different wallets
+            feed = self._feeds[address] = Feed(fixture, token_dict, offset)
+
+        return feed
+
+    def _publish(self, address: str, feed: Feed, now: float) -> None:
+        """Adds the txns that are due to a wallet's history."""
+        templates = feed.fixture['history_list']
+        if not self.txn_interval or not templates:
+            return
+
+        due = int((min(now, self.stopped or now) - self.started - feed.offset) / self.txn_interval)
+        while feed.published < due:
+            feed.published += 1
+            time_at = self.started + feed.offset + feed.published * self.txn_interval
+            txn_id = "0x" + hashlib.sha256(f"{address}-{feed.published}".encode()).hexdigest()
+
+            template = templates[feed.published % len(templates)]
+            feed.history.insert(0, {**template, "id": txn_id, "time_at": time_at})
+            del feed.history[self.max_history:]
+
+            self.published[txn_id] = time_at
+            feed.body = None
+
+    def stop_publishing(self) -> None:
+        """Stops publishing new txns, so that the published ones can be drained."""
+        with self._lock:
+            self.stopped = time()
+
+    def published_since(self, since: float | None) -> Dict[str, float]:
+        """Returns the publish time of each txn published since a timestamp, by txn id."""
+        with self._lock:
+            return {txn_id: time_at for txn_id, time_at in self.published.items()
+                    if since is not None and since <= time_at}
+
+    def due_since(self, since: float | None) -> int:
+        """Returns the number of txns due to be published since a timestamp, across the served wallets."""
+        if since is None or not self.txn_interval:
+            return 0
+
+        now = time()
+        with self._lock:
+            feeds = [feed for feed in self._feeds.values() if feed.fixture['history_list']]
+
+        def count(feed: Feed, at: float) -> int:
+            return max(0, int((min(at, self.stopped or at) - self.started - feed.offset) / self.txn_interval))
+
+        return sum(count(feed, now) - count(feed, since - 1e-6) for feed in feeds)
+
+    @staticmethod
+    def _body(feed: Feed, txns: List[dict]) -> bytes:
+        data = {"history_list": txns, "token_dict": feed.token_dict,
+                "project_dict": feed.fixture.get('project_dict', {})}
+
+        return json.dumps({"_cache_seconds": 0, "data": data, "error_code": 0}).encode()
+
+    def history_list(self, address: str, page_count: int = 20, start_time: float = 0) -> bytes:
+        """
+        Returns the body of a history list response, as DeBank would at this point of the replay.
+
+        :param address: Wallet address
+        :param page_count: Number of transactions
+        :param start_time: Return txns older than this timestamp, 0 for the latest txns
+        :returns: Response body
+        """
+        with self._lock:
+            feed = self._feed(address)
+            self._publish(address, feed, time())
+
+            if start_time:
+                return self._body(feed, [txn for txn in feed.history if txn['time_at'] < start_time][:page_count])
+
+            if feed.body is None:
+                feed.body = self._body(feed, feed.history[:page_count])
+
+            return feed.body
+
+    def token_prices(self, chain: str, token_ids: List[str]) -> bytes:
+        """Returns the body of a price source response, a JSON object of token_id: price."""
+        with self._lock:
+            self.stats["price_requests"] += 1
+
+        return json.dumps({token_id: self.prices.get((chain, token_id)) for token_id in token_ids}).encode()
+
+    def _failure(self) -> str | None:
+        """Draws the failure injected into a request, if any."""
+        with self._lock:
+            self.stats["requests"] += 1
+            draw = self._random.random()
+            delay = self._random.uniform(0, self.latency)
+
+            if draw < self.rate_limit:
+                self.stats["rate_limited"] += 1
+                failure = "rate_limited"
+            elif draw < self.rate_limit + self.timeout:
+                self.stats["timeouts"] += 1
+                failure = "timeout"
+            else:
+                failure = None
+
+        sleep(delay)
+        return failure
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeDebank":
+        """Starts serving http://host:port/history/list and /token/prices from a daemon thread."""
+        debank = self
+
+        class DebankHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/token/prices":
+                    query = parse_qs(url.query)
+                    self.respond(200, debank.token_prices(query.get('chain', [""])[0],
+                                                          query.get('ids', [""])[0].split(",")))
+                    return
+
+                if url.path != "/history/list":
+                    self.send_error(404)
+                    return
+
+                failure = debank._failure()
+                if failure == "timeout":
+                    sleep(debank.hang_time)
+                    self.close_connection = True  # The client has given up by now
+                    return
+
+                if failure == "rate_limited":
+                    self.respond(429, b'{"error_code": 429, "error_msg": "Too Many Requests"}')
+                    return
+
+                query = parse_qs(url.query)
+                body = debank.history_list(query.get('user_addr', [""])[0], int(query.get('page_count', ["20"])[0]),
+                                           float(query.get('start_time', ["0"])[0]))
+                if not debank.etags:
+                    self.respond(200, body)
+                    return
+
+                etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with debank._lock:
+                        debank.stats["not_modified"] += 1
+                    self.respond(304, b"", etag)
+                else:
+                    self.respond(200, body, etag)
+
+            def respond(self, status: int, body: bytes, etag: str | None = None) -> None:
+                self.send_response(status)
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = serve(DebankHandler, host, port)
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockTelegram:
+    """
+    Local stand-in for the Telegram Bot API sendMessage method that records every message it receives.
+    Messages longer than Telegram's limit are rejected as Telegram would.
+    """
+
+    def __init__(self, rate_limit: float = 0.0, retry_after: int = 1, seed: int = 0):
+        """
+        :param rate_limit: Share of messages answered with a 429 and retry_after
+        :param retry_after: Secs a rate limited sender is asked to wait
+        :param seed: Random seed of the injected 429s
+        """
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+
+        self.messages: List[Tuple[float, str, str]] = []  # (Time received, chat id, text)
+        self.stats = {"requests": 0, "rate_limited": 0, "too_long": 0}
+        self.server: ThreadingHTTPServer | None = None
+
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def receive(self, chat_id: str, text: str) -> dict:
+        """Records a message and returns the Bot API's answer."""
+        with self._lock:
+            self.stats["requests"] += 1
+            if message_size(text)[0] > TelegramDispatcher.max_message_len:
+                self.stats["too_long"] += 1
+                return {"ok": False, "error_code": 400, "description": "Bad Request: message is too long"}
+
+            if self._random.random() < self.rate_limit:
+                self.stats["rate_limited"] += 1
+                return {"ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after}}
+
+            self.messages.append((time(), chat_id, text))
+            return {"ok": True, "result": {"message_id": len(self.messages), "chat": {"id": chat_id}, "text": text}}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "MockTelegram":
+        """Starts serving http://host:port/bot<token>/sendMessage from a daemon thread."""
+        telegram = self
+
+        class TelegramHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                if not self.path.endswith("/sendMessage"):
+                    self.send_error(404)
+                    return
+
+                form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+                answer = telegram.receive(form.get('chat_id', [""])[0], form.get('text', [""])[0])
+
+                body = json.dumps(answer).encode()
+                self.send_response(200 if answer['ok'] else answer['error_code'])
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = serve(TelegramHandler, host, port)
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def delivered(self) -> Dict[str, float]:
+        """Returns the time each txn hash was first received, in any chat."""
+        delivered = {}
+        with self._lock:
+            for received, _, text in self.messages:
+                for txn_hash in txn_hash_pattern.findall(text):
+                    delivered.setdefault(txn_hash, received)
+
+        return delivered
+
+
+def percentile(values: List[float], q: float) -> float | None:
+    """Returns the q-th percentile of values, nearest rank, None if there are no values."""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def process_usage(pid: int) -> Tuple[float | None, float | None]:
+    """
+    Returns CPU secs and peak RSS in MB of a running process, read from /proc.
+
+    :param pid: Process ID
+    :returns: (CPU secs, peak RSS MB), (None, None) where /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as file:
+            status = dict(line.split(":", 1) for line in file if ":" in line)
+
+    except OSError:
+        return None, None
+
+    cpu_secs = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+    peak_rss = int(status["VmHWM"].split()[0]) / 1024
+
+    return cpu_secs, peak_rss
+
+
+class ReplayResult(NamedTuple):
+    """Measurements of a single replay."""
+    wallets: int
+    loop_times: List[float]
+    alert_latencies: List[float]
+    published: int
+    delivered: int
+    debank_stats: dict
+    telegram_stats: dict
+    cpu_secs: float | None
+    peak_rss: float | None
+
+
+def replay_worker(env: Dict[str, str], wallets_list: List[Wallet], **kwargs) -> None:
+    """Runs scrape_wallets against the stand-in servers, in a worker process."""
+    from src.cryptowallets.debank import scrape_wallets
+
+    # Env variables already read in the parent process are read again
+    os.environ.update(env)
+    for name in env:
+        vars(variables).pop(name, None)
+
+    scrape_wallets(wallets_list, **kwargs)
+
+
+def run_replay(fixtures: List[dict], wallet_count: int, duration: float = 60.0, loop_sleep: float = 1.0,
+               drain_time: float = 60.0, debank_kwargs: dict | None = None, telegram_kwargs: dict | None = None,
+               **worker_kwargs) -> ReplayResult:
+    """
+    Screens wallets against a FakeDebank and MockTelegram for a while and measures the pipeline.
+
+    :param fixtures: 'data' of recorded history list responses, spread over the wallets
+    :param wallet_count: Number of wallets to screen
+    :param duration: Secs to screen for, after the wallets' baseline fetch
+    :param loop_sleep: Min secs between two polls of a wallet
+    :param drain_time: Max secs to wait for the txns published during the replay to be alerted
+    :param debank_kwargs: Keyword arguments of FakeDebank, eg. failures to inject
+    :param telegram_kwargs: Keyword arguments of MockTelegram
+    :param worker_kwargs: Keyword arguments passed on to scrape_wallets
+    :returns: ReplayResult
+    """
+    debank = FakeDebank(fixtures, **(debank_kwargs or {})).start()
+    telegram = MockTelegram(**(telegram_kwargs or {})).start()
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    env = {"DEBANK_API": debank.url, "TELEGRAM_API": telegram.url, "PRICE_API": f"{debank.url}/token/prices",
+           "TOR_PROXY": "", "TOKEN": "replay", "LOG_DIR": os.path.join(workdir, "logs"),
+           # Group chat IDs, so that alerts are sent at Telegram's group rate limit
+           "CHAT_ID_ALERTS": "-1001", "CHAT_ID_ALERTS_ALL": "-1002", "CHAT_ID_DEBUG": "-1003"}
+
+    wallets_list = [Wallet(f"0x{i:040x}", f"wallet{i}") for i in range(wallet_count)]
+    stats_queue = Queue()
+    worker_kwargs = {
+        "sleep_time": loop_sleep,
+        "max_interval": loop_sleep,  # Poll every wallet every loop, so that loop times compare across runs
+        # Isolation circuits are rotated without a Tor control port
+        "circuits": build_circuits([9050], circuits_per_port=4),
+        "state_path": os.path.join(workdir, "wallets.db"),
+        "heartbeat_path": os.path.join(workdir, "heartbeat-{shard}.json"),
+        "stats_queue": stats_queue,
+        **worker_kwargs,
+    }
+
+    process = Process(target=replay_worker, name="replay", args=(env, wallets_list), kwargs=worker_kwargs)
+    process.start()
+
+    # The clock starts once the baseline fetch is done and the first loop is reported
+    loop_times = []
+    started = deadline = None
+    while process.is_alive() and (deadline is None or time() < deadline):
+        try:
+            _, loop_time, _ = stats_queue.get(timeout=1)
+        except Empty:
+            continue
+
+        if deadline is None:
+            started = time()
+            deadline = started + duration
+        loop_times.append(loop_time)
+
+    # Txns published before the baseline are not alerted, wait for the rest to be alerted
+    debank.stop_publishing()
+    drain_deadline = time() + drain_time
+    while process.is_alive() and time() < drain_deadline:
+        # Due txns are only published once their wallet is polled again
+        published = debank.published_since(started)
+        if len(published) == debank.due_since(started) and published.keys() <= telegram.delivered().keys():
+            break
+
+        sleep(0.5)
+
+    cpu_secs, peak_rss = process_usage(process.pid)
+    process.terminate()
+    process.join()
+
+    debank.stop()
+    telegram.stop()
+
+    # Loop times reported while draining are left out
+    delivered = telegram.delivered()
+    published = debank.published_since(started)
+    latencies = [delivered[txn_id] - time_at for txn_id, time_at in published.items() if txn_id in delivered]
+
+    return ReplayResult(wallet_count, loop_times, latencies, len(published), len(latencies),
+                        debank.stats, telegram.stats, cpu_secs, peak_rss)
+
+
+def format_results(results: List[ReplayResult]) -> str:
+    """Returns a table of replay results."""
+    def secs(value: float | None) -> str:
+        return f"{value:,.2f}" if value is not None else "n/a"
+
+    rows = []
+    for result in results:
+        rows.append([
+            result.wallets,
+            len(result.loop_times),
+            secs(percentile(result.loop_times, 50)),
+            secs(percentile(result.loop_times, 95)),
+            f"{result.delivered}/{result.published}",
+            secs(percentile(result.alert_latencies, 50)),
+            secs(percentile(result.alert_latencies, 95)),
+            secs(max(result.alert_latencies, default=None)),
+            f"{result.debank_stats['requests']}/{result.debank_stats['rate_limited']}/"
+            f"{result.debank_stats['timeouts']}/{result.debank_stats['not_modified']}",
+            secs(result.cpu_secs),
+            secs(result.peak_rss),
+        ])
+
+    columns = ["Wallets", "Loops", "Loop p50", "Loop p95", "Alerted", "Alert p50", "Alert p95", "Alert max",
+               "Requests/429/Timeouts/304", "CPU secs", "Peak RSS MB"]
+
+    return tabulate(rows, headers=columns, tablefmt="fancy_grid")
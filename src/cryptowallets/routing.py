@@ -0,0 +1,71 @@
+"""
+Routing of transaction alerts to Telegram chats, built once at startup from the input data.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import (
+    Dict,
+    FrozenSet,
+    List,
+)
+
+from src.cryptowallets.common import variables
+
+
+@dataclass(frozen=True)
+class Route:
+    """Chats a wallet's txns are sent to, depending on whether the txn passed the filter."""
+    rejected: FrozenSet[str]
+    passed: FrozenSet[str]
+
+    def destinations(self, is_passed: bool) -> FrozenSet[str]:
+        """Returns the chats to send a txn to, each chat once."""
+        return self.passed if is_passed else self.rejected
+
+
+def parse_chat_ids(chat_id: str | List[str] | None, default: str) -> FrozenSet[str]:
+    """
+    Parses a chat id field of the input data, which can be a single chat id or a list of them.
+
+    :param chat_id: Chat id, list of chat ids or empty
+    :param default: Chat id used if none given
+    :returns: Set of chat ids
+    """
+    if not chat_id:
+        return frozenset([default])
+
+    if isinstance(chat_id, (list, tuple)):
+        return frozenset(str(chat) for chat in chat_id if chat) or frozenset([default])
+
+    return frozenset([str(chat_id)])
+
+
+def build_route(details: dict) -> Route:
+    """
+    Builds the route of a wallet.
+    Every txn goes to 'chat_id_all' (default CHAT_ID_ALERTS_ALL), txns that pass
+    the filter also go to 'chat_id' (default CHAT_ID_ALERTS).
+
+    :param details: Wallet details of the input data
+    :returns: Route instance
+    """
+    all_chats = parse_chat_ids(details.get('chat_id_all'), variables.CHAT_ID_ALERTS_ALL)
+    filtered_chats = parse_chat_ids(details.get('chat_id'), variables.CHAT_ID_ALERTS)
+
+    return Route(rejected=all_chats, passed=all_chats | filtered_chats)
+
+
+def build_routes(info: dict) -> Dict[str, Route]:
+    """
+    Builds the routing table of all wallets.
+
+    :param info: Info dictionary with input data
+    :returns: Dictionary of wallet address to its Route
+    """
+    return {address: build_route(details) for address, details in info['wallets'].items()}
+
+
+@lru_cache(maxsize=None)
+def default_route() -> Route:
+    """Returns the route of wallets without chat ids, built on first use."""
+    return build_route({})
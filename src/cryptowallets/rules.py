@@ -0,0 +1,210 @@
+"""
+Transaction filter rules, compiled once at startup from the input data.
+"""
+from logging import Logger
+from typing import (
+    Callable,
+    List,
+)
+
+from src.cryptowallets.datatypes import Transaction
+from src.cryptowallets.cache import (
+    get_token,
+    get_token_price,
+)
+from src.cryptowallets.common.logger import (
+    log_fail,
+    log_spam,
+)
+from src.cryptowallets.common.metrics import (
+    rule_evaluations,
+    rule_hits,
+)
+
+
+# Rule predicate - (txn, txn_type, chain) -> True if the txn should be rejected
+Predicate = Callable[[Transaction, str, str], bool]
+
+
+class Rule:
+    """A single filter rule that rejects transactions, with hit counters."""
+    __slots__ = ('name', 'predicate', 'logger', 'reason', 'priority', 'hits', 'evaluated')
+
+    def __init__(self, name: str, predicate: Predicate, logger: Logger, reason: str):
+        """
+        :param name: Name of the rule
+        :param predicate: Function returning True if a txn should be rejected
+        :param logger: Logger rejected txns are logged to
+        :param reason: Reason logged for rejected txns
+        """
+        self.name = name
+        self.predicate = predicate
+        self.logger = logger
+        self.reason = reason
+        self.priority = 0  # Position in the rule set's initial order
+        self.hits = 0
+        self.evaluated = 0
+
+    def __repr__(self):
+        return f"Rule {self.name}, {self.hits}/{self.evaluated} hits"
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.evaluated if self.evaluated else 0.0
+
+
+class RuleSet:
+    """
+    Short-circuiting evaluator of filter rules. Rules are periodically reordered
+    so that the ones rejecting the most txns are evaluated first.
+    A rejected txn is logged with the reason of the first rule in the initial order that rejects it,
+    so that reordering never moves txns between the fail and spam logs.
+    Evaluations and hits of every rule are exported as metrics.
+    """
+
+    def __init__(self, rules: List[Rule], reorder_every: int = 500):
+        """
+        :param rules: List of rules in their initial evaluation order
+        :param reorder_every: Number of evaluated txns after which rules are reordered by hit rate
+        """
+        self.rules = rules
+        self.reorder_every = reorder_every
+        self.checked = 0
+
+        for priority, rule in enumerate(rules):
+            rule.priority = priority
+
+    def check(self, txn: Transaction, txn_message: str) -> bool:
+        """
+        Checks a transaction against all rules, stopping at the first one that rejects it.
+
+        :param txn: Transaction
+        :param txn_message: Log message string to save txn
+        :return: True if transaction passed all rules
+        """
+        self.checked += 1
+        if self.checked % self.reorder_every == 0:
+            self.rules.sort(key=lambda r: r.hit_rate, reverse=True)
+
+        txn_type = txn.txn_type
+        chain = txn.chain
+
+        for position, rule in enumerate(self.rules):
+            rule.evaluated += 1
+            rule_evaluations.inc(rule=rule.name)
+            if rule.predicate(txn, txn_type, chain):
+                rule.hits += 1
+                rule_hits.inc(rule=rule.name)
+
+                # Rules that were moved behind this one only need to be checked for the logged reason
+                for earlier in sorted(self.rules[position + 1:], key=lambda r: r.priority):
+                    if earlier.priority > rule.priority:
+                        break
+                    if earlier.predicate(txn, txn_type, chain):
+                        rule = earlier
+                        break
+
+                rule.logger.info(f"check_txn - {rule.reason} - {txn_message}")
+                return False
+
+        return True
+
+
+def is_failed(txn: Transaction, txn_type: str, chain: str) -> bool:
+    """Transaction status is 0, DeBank sends it as a number or a numeric string."""
+    try:
+        return int(txn.status) == 0
+    except (TypeError, ValueError):
+        return False
+
+
+def is_empty(txn: Transaction, txn_type: str, chain: str) -> bool:
+    """Nothing was sent or received."""
+    return not txn.receives and not txn.sends
+
+
+def is_unverified(token_id: str, chain: str, allow_tokens: frozenset) -> bool:
+    """Token is unknown to DeBank or not verified, and not explicitly allowed."""
+    if token_id in allow_tokens:
+        return False
+
+    token = get_token(chain, token_id)
+
+    return token is None or not token.is_verified
+
+
+def txn_value(txn: Transaction, chain: str) -> float:
+    """Returns USD value of everything sent and received, tokens without a price count as 0."""
+    value = 0.0
+    for item in txn.sends + txn.receives:
+        price = get_token_price(chain, item.token_id)
+        if price:
+            value += price * item.amount
+
+    return value
+
+
+def compile_rules(filters: dict | None = None, whale_txn_limit: float = 100000.0) -> RuleSet:
+    """
+    Compiles filter settings of the input data into a RuleSet. With no filters the
+    rule set rejects failed, approval and unverified token txns.
+
+    Supported filters:
+        chains: List of chains to allow, eg. ["eth", "arb"]
+        txn_types: List of txn types to allow, eg. ["swap", "send"]
+        deny_txn_types: List of txn types to reject
+        allow_tokens: List of token ids to accept even if unverified
+        deny_tokens: List of token ids to reject
+        min_usd: Min USD value sent and received
+        whale_only: If true reject txns below whale_txn_limit
+
+    :param filters: Filters dictionary
+    :param whale_txn_limit: Mark txns that are above some USD amount
+    :returns: RuleSet instance
+    """
+    if filters is None:
+        filters = {}
+
+    allow_tokens = frozenset(filters.get('allow_tokens', []))
+    rules = []
+
+    # Cheapest and most selective rules go first
+    if chains := frozenset(filters.get('chains', [])):
+        rules.append(Rule('chains', lambda txn, txn_type, chain: chain not in chains,
+                          log_spam, "Txn chain not allowed"))
+
+    if txn_types := frozenset(t.lower() for t in filters.get('txn_types', [])):
+        rules.append(Rule('txn_types', lambda txn, txn_type, chain: txn_type not in txn_types,
+                          log_spam, "Txn type not allowed"))
+
+    if deny_txn_types := frozenset(t.lower() for t in filters.get('deny_txn_types', [])):
+        rules.append(Rule('deny_txn_types', lambda txn, txn_type, chain: txn_type in deny_txn_types,
+                          log_spam, "Txn type denied"))
+
+    rules.append(Rule('failed', is_failed, log_fail, "Txn failed"))
+    rules.append(Rule('approval', is_empty, log_spam, "Txn likely an approval"))
+
+    if deny_tokens := frozenset(filters.get('deny_tokens', [])):
+        rules.append(Rule('deny_tokens', lambda txn, txn_type, chain: any(
+            item.token_id in deny_tokens for item in txn.sends + txn.receives),
+            log_spam, "Txn token denied"))
+
+    rules.append(Rule('unverified_receive', lambda txn, txn_type, chain: 'receive' in txn_type and any(
+        is_unverified(item.token_id, chain, allow_tokens) for item in txn.receives),
+        log_spam, "Txn likely an NFT"))
+    rules.append(Rule('unverified_send', lambda txn, txn_type, chain: any(
+        is_unverified(item.token_id, chain, allow_tokens) for item in txn.sends),
+        log_spam, "Txn likely an NFT"))
+
+    min_usd = float(filters.get('min_usd', 0))
+    if filters.get('whale_only'):
+        min_usd = max(min_usd, whale_txn_limit)
+
+    if min_usd > 0:
+        rules.append(Rule('min_usd', lambda txn, txn_type, chain: txn_value(txn, chain) < min_usd,
+                          log_spam, f"Txn below ${min_usd:,.2f}"))
+
+    return RuleSet(rules)
+
+
+default_rules = compile_rules()
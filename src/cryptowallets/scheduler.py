@@ -0,0 +1,97 @@
+"""
+Adaptive polling schedule of the screened wallets.
+"""
+import heapq
+
+from time import monotonic
+from typing import (
+    List,
+    Tuple,
+)
+
+
+class WalletScheduler:
+    """
+    Priority queue of wallets ordered by their next due poll time.
+    A wallet's interval backs off while it is quiet and drops back to the min interval
+    after activity. Polls are capped by an overall request budget per minute.
+    """
+
+    def __init__(self, wallet_count: int, min_interval: float = 5.0, max_interval: float = 300.0,
+                 requests_per_min: float = 0.0, backoff: float = 1.5):
+        """
+        :param wallet_count: Number of wallets, wallets are referred to by their index
+        :param min_interval: Min secs between two polls of a wallet
+        :param max_interval: Max secs between two polls of a wallet
+        :param requests_per_min: Max polls per minute across all wallets, 0 for no limit
+        :param backoff: Factor a quiet wallet's interval is multiplied by after each poll
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.requests_per_min = requests_per_min
+        self.backoff = backoff
+
+        now = monotonic()
+        self.intervals = [min_interval] * wallet_count
+        # Spread first polls over the min interval so wallets don't all fall due together
+        self._queue: List[Tuple[float, int]] = [(now + min_interval * i / max(wallet_count, 1), i)
+                                                for i in range(wallet_count)]
+        heapq.heapify(self._queue)
+
+        self._tokens = float(requests_per_min)
+        self._last_refill = now
+
+    def _refill(self, now: float) -> None:
+        """Refills the request budget token bucket."""
+        if self.requests_per_min:
+            self._tokens = min(self.requests_per_min,
+                               self._tokens + (now - self._last_refill) * self.requests_per_min / 60)
+        self._last_refill = now
+
+    def wait_time(self) -> float:
+        """Returns secs until the next wallet is due and the budget allows polling it."""
+        if not self._queue:
+            return self.min_interval
+
+        now = monotonic()
+        self._refill(now)
+        wait = self._queue[0][0] - now
+
+        if self.requests_per_min and self._tokens < 1:
+            wait = max(wait, (1 - self._tokens) * 60 / self.requests_per_min)
+
+        return max(0.0, wait)
+
+    def pop_due(self) -> List[int]:
+        """
+        Pops all wallets that are due, as far as the request budget allows.
+
+        :returns: List of wallet indexes, earliest due first
+        """
+        now = monotonic()
+        self._refill(now)
+
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            if self.requests_per_min:
+                if self._tokens < 1:
+                    break
+                self._tokens -= 1
+
+            due.append(heapq.heappop(self._queue)[1])
+
+        return due
+
+    def reschedule(self, index: int, found: int | None) -> None:
+        """
+        Schedules a wallet's next poll based on the result of its last one.
+
+        :param index: Wallet index
+        :param found: Number of new txns found, None if the poll failed
+        """
+        if found:
+            self.intervals[index] = self.min_interval
+        elif found is not None:
+            self.intervals[index] = min(self.intervals[index] * self.backoff, self.max_interval)
+
+        heapq.heappush(self._queue, (monotonic() + self.intervals[index], index))
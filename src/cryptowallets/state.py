@@ -0,0 +1,197 @@
+"""
+Persistent on-disk state of the screened wallets, so that a restart resumes where it stopped.
+"""
+import os
+import json
+import sqlite3
+
+from time import time
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from src.cryptowallets.datatypes import (
+    SeenTxns,
+    Transaction,
+)
+from src.cryptowallets.decode import (
+    HistoryPage,
+    decode_project,
+    decode_token,
+)
+from src.cryptowallets.cache import (
+    token_cache,
+    project_cache,
+)
+
+
+class StateStore:
+    """
+    SQLite store of every wallet's seen txn ids and 'time_at' high-water mark, of the alerts
+    Telegram has not acknowledged yet and of the shared token/project metadata.
+    Changes are committed as soon as they are saved.
+
+    Every shard's worker writes the same file, so that wallets can move between shards. Writes wait up to
+    timeout secs for another shard's write to finish, after that sqlite3.OperationalError is raised.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        """
+        :param path: Path of the SQLite database file, created if missing
+        :param timeout: Max secs to wait for the database to be unlocked by another connection
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS seen_txns "
+                              "(address TEXT, txn_id TEXT, time_at REAL, PRIMARY KEY (address, txn_id))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS wallets "
+                              "(address TEXT PRIMARY KEY, high_water REAL, evicted_at REAL DEFAULT 0)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tokens "
+                              "(chain TEXT, token_id TEXT, info TEXT, PRIMARY KEY (chain, token_id))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS projects (project_id TEXT PRIMARY KEY, info TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS history "
+                              "(address TEXT, txn_id TEXT, time_at REAL, txn TEXT, PRIMARY KEY (address, txn_id))")
+            # Ids are never reused, so that a late acknowledgement can't delete a newer alert
+            self.conn.execute("CREATE TABLE IF NOT EXISTS outbox (alert_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                              "address TEXT, chat_id TEXT, text TEXT, created REAL)")
+
+            # State files saved before evicted_at was kept
+            if "evicted_at" not in {row[1] for row in self.conn.execute("PRAGMA table_info(wallets)")}:
+                self.conn.execute("ALTER TABLE wallets ADD COLUMN evicted_at REAL DEFAULT 0")
+
+    def load_wallet(self, address: str, capacity: int = 40) -> SeenTxns | None:
+        """
+        Loads a wallet's saved state.
+
+        :param address: Wallet address
+        :param capacity: Max number of ids kept in the returned SeenTxns
+        :returns: Seen txns or None if the wallet has no saved state
+        """
+        row = self.conn.execute("SELECT high_water, evicted_at FROM wallets WHERE address = ?",
+                                (address, )).fetchone()
+        if row is None:
+            return None
+
+        high_water, evicted_at = row
+
+        seen = SeenTxns(capacity=capacity)
+        for txn_id, time_at in self.conn.execute("SELECT txn_id, time_at FROM seen_txns "
+                                                 "WHERE address = ? ORDER BY rowid", (address, )):
+            seen.add(txn_id, time_at)
+        seen.high_water = max(seen.high_water, high_water)
+        seen.evicted_at = max(seen.evicted_at, evicted_at or 0.0)
+
+        return seen
+
+    def load_wallets(self, addresses: List[str], capacity: int = 40) -> Dict[str, SeenTxns]:
+        """
+        Loads the saved state of several wallets.
+
+        :param addresses: Wallet addresses
+        :param capacity: Max number of ids kept per wallet
+        :returns: Dictionary of address to saved state, wallets without a saved state are left out
+        """
+        states = {}
+        for address in addresses:
+            state = self.load_wallet(address, capacity)
+            if state is not None:
+                states[address] = state
+
+        return states
+
+    def save_wallet(self, address: str, txns: List[Transaction], seen: SeenTxns,
+                    alerts: Iterable[Tuple[str, str]] = ()) -> List[int]:
+        """
+        Saves new txns of a wallet together with its high-water mark and the time of its last evicted txn.
+        Their alerts are saved in the same transaction, so that txns are never seen without being alerted.
+
+        :param address: Wallet address
+        :param txns: Newly seen txns, newest first
+        :param seen: Seen txns of the wallet
+        :param alerts: (chat_id, text) of the txns' alerts, kept until delete_alerts
+        :returns: Alert ids, in alerts order
+        """
+        with self.conn:
+            now = time()
+            alert_ids = [self.conn.execute("INSERT INTO outbox (address, chat_id, text, created) VALUES (?, ?, ?, ?)",
+                                           (address, chat_id, text, now)).lastrowid for chat_id, text in alerts]
+            self.conn.executemany("INSERT OR IGNORE INTO seen_txns VALUES (?, ?, ?)",
+                                  [(address, txn.id, txn.time_at) for txn in reversed(txns)])
+            # Keep only as many ids as the in-memory set holds
+            self.conn.execute("DELETE FROM seen_txns WHERE address = ? AND rowid NOT IN "
+                              "(SELECT rowid FROM seen_txns WHERE address = ? ORDER BY rowid DESC LIMIT ?)",
+                              (address, address, seen.capacity))
+            self.conn.execute("INSERT OR REPLACE INTO wallets (address, high_water, evicted_at) VALUES (?, ?, ?)",
+                              (address, seen.high_water, seen.evicted_at))
+
+        return alert_ids
+
+    def load_alerts(self, addresses: Iterable[str], max_age: float = 86400.0) -> List[Tuple[int, str, str]]:
+        """
+        Loads the alerts of some wallets Telegram has not acknowledged, eg. those still queued when the worker stopped.
+        Older alerts, eg. those the dispatcher dropped, are deleted instead.
+
+        :param addresses: Addresses of the wallets, other shards' alerts are left to them
+        :param max_age: Max secs since an alert was saved
+        :returns: List of (alert_id, chat_id, text), oldest first
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM outbox WHERE created < ?", (time() - max_age, ))
+
+        addresses = set(addresses)
+        return [(alert_id, chat_id, text) for alert_id, address, chat_id, text
+                in self.conn.execute("SELECT alert_id, address, chat_id, text FROM outbox ORDER BY alert_id")
+                if address in addresses]
+
+    def delete_alerts(self, alert_ids: Iterable[int]) -> None:
+        """
+        Deletes alerts Telegram has acknowledged.
+
+        :param alert_ids: Ids returned by save_wallet
+        """
+        with self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE alert_id = ?", [(alert_id, ) for alert_id in alert_ids])
+
+    def load_metadata(self) -> None:
+        """Loads saved token and project info into the shared caches. Their prices are treated as stale."""
+        token_cache.update((((chain, token_id), decode_token(json.loads(info))) for chain, token_id, info
+                            in self.conn.execute("SELECT chain, token_id, info FROM tokens")), float('-inf'))
+        project_cache.update(((project_id, decode_project(json.loads(info))) for project_id, info
+                              in self.conn.execute("SELECT project_id, info FROM projects")), float('-inf'))
+
+    def save_metadata(self, data: HistoryPage) -> None:
+        """
+        Saves the token and project dicts of a DeBank history list response.
+
+        :param data: Decoded history list response
+        """
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)",
+                                  [(token.chain, token_id, json.dumps(token.to_dict()))
+                                   for token_id, token in data.token_dict.items()])
+            self.conn.executemany("INSERT OR REPLACE INTO projects VALUES (?, ?)",
+                                  [(project_id, json.dumps(project.to_dict()))
+                                   for project_id, project in data.project_dict.items()])
+
+    def save_history(self, address: str, txns: List[Transaction]) -> None:
+        """
+        Saves txns of a wallet's history, eg. from a backfill.
+
+        :param address: Wallet address
+        :param txns: Transactions
+        """
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?)",
+                                  [(address, txn.id, txn.time_at, json.dumps(txn.to_dict())) for txn in txns])
+
+    def close(self) -> None:
+        """Closes the database connection."""
+        self.conn.close()
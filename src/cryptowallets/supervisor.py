@@ -0,0 +1,322 @@
+"""
+Supervisor that shards the screened wallets across worker processes and restarts crashed workers.
+"""
+import os
+import sys
+import signal
+import glob
+import hashlib
+
+from bisect import bisect
+from secrets import token_hex
+from dataclasses import replace
+from datetime import datetime
+from time import (
+    monotonic,
+    sleep,
+)
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from queue import Empty
+from threading import Thread
+from typing import (
+    Dict,
+    List,
+)
+
+from src.cryptowallets.tor import Circuit
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.debank import scrape_wallets
+from src.cryptowallets.common.logger import (
+    attach_logging,
+    log_error,
+    start_logging,
+)
+from src.cryptowallets.common.message import telegram_send_message
+from src.cryptowallets.common.dispatcher import dispatcher
+from src.cryptowallets.common.metrics import (
+    alert_latency,
+    wallet_alert_latency,
+    registry,
+    render_snapshots,
+    shard_loop_seconds,
+    start_metrics_server,
+    worker_restarts,
+)
+from src.cryptowallets.common.variables import (
+    time_format,
+    heartbeat_file,
+)
+
+# Workers are spawned rather than forked: the supervisor runs the metrics server, latency report and
+# logging listener threads, and a fork taken while one of them holds a lock would deadlock the child
+mp_context = get_context("spawn")
+
+
+class HashRing:
+    """Consistent hash ring mapping wallet addresses to shards."""
+
+    def __init__(self, shards: int, replicas: int = 100):
+        """
+        :param shards: Number of shards
+        :param replicas: Number of points per shard on the ring, more points spread wallets more evenly
+        """
+        points = sorted((self._hash(f"{shard}-{replica}"), shard)
+                        for shard in range(shards) for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def shard(self, address: str) -> int:
+        """Returns the shard a wallet address belongs to."""
+        index = bisect(self._hashes, self._hash(address.lower())) % len(self._hashes)
+
+        return self._shards[index]
+
+
+def shard_wallets(wallets_list: List[Wallet], shards: int) -> List[List[Wallet]]:
+    """
+    Splits wallets into shards by consistent hashing on their address.
+
+    :param wallets_list: List of Wallet[addr, name] data types
+    :param shards: Number of shards
+    :returns: List of wallet lists, one per shard
+    """
+    ring = HashRing(shards)
+    sharded = [[] for _ in range(shards)]
+    for wallet in wallets_list:
+        sharded[ring.shard(wallet.address)].append(wallet)
+
+    return sharded
+
+
+def assign_circuits(circuits: List[Circuit], shards: int) -> List[List[Circuit]]:
+    """
+    Splits Tor circuits between shards. If there are fewer circuits than shards,
+    shards share a SOCKS port but get their own SOCKS-auth isolated circuit.
+
+    :param circuits: List of circuits
+    :param shards: Number of shards
+    :returns: List of circuit lists, one per shard
+    """
+    if len(circuits) >= shards:
+        return [circuits[shard::shards] for shard in range(shards)]
+
+    return [[replace(circuits[shard % len(circuits)], control_port=None, isolation=token_hex(8))]
+            for shard in range(shards)]
+
+
+def run_worker(wallets_list: List[Wallet], log_queue: Queue, alert_queue: Queue | None = None,
+               ack_queue: Queue | None = None, **kwargs) -> None:
+    """
+    Entry point of a worker process, runs scrape_wallets logging through the supervisor's listener
+    and sending alerts through the supervisor's dispatcher.
+
+    :param wallets_list: List of Wallet[addr, name] data types
+    :param log_queue: Queue of the supervisor's logging listener
+    :param alert_queue: Queue the supervisor's dispatcher relays alerts from, None to send them from the worker
+    :param ack_queue: Queue the supervisor's dispatcher acknowledges the worker's alerts on
+    :param kwargs: Keyword arguments passed on to scrape_wallets
+    """
+    attach_logging(log_queue)
+    if alert_queue is not None:
+        dispatcher.forward(alert_queue, ack_queue, kwargs.get("shard", 0))
+
+    # Exit through scrape_wallets' finally when terminated, so queued alerts are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    scrape_wallets(wallets_list, **kwargs)
+
+
+class Supervisor:
+    """Runs one scrape_wallets worker process per shard and restarts workers that exit."""
+
+    def __init__(self, wallets_list: List[Wallet], workers: int = 1, circuits: List[Circuit] | None = None,
+                 restart_delay: float = 5.0, report_every: float = 600.0, metrics_port: int = 0,
+                 latency_report_every: float = 3600.0, **worker_kwargs):
+        """
+        :param wallets_list: List of Wallet[addr, name] data types
+        :param workers: Number of worker processes
+        :param circuits: Tor circuits split between workers, defaults to a single circuit on port 9050
+        :param restart_delay: Secs to wait before restarting a crashed worker
+        :param report_every: Secs between per-shard loop time reports
+        :param metrics_port: Port metrics are served on at http://127.0.0.1:port/metrics, 0 to disable
+        :param latency_report_every: Secs between alert latency summaries sent to the debug chat, 0 to disable
+        :param worker_kwargs: Keyword arguments passed on to scrape_wallets
+        """
+        self.workers = max(1, min(workers, len(wallets_list)))
+        self.shards = shard_wallets(wallets_list, self.workers)
+        self.circuits = assign_circuits(circuits or [Circuit()], self.workers)
+        self.restart_delay = restart_delay
+        self.report_every = report_every
+        self.metrics_port = metrics_port
+        self.latency_report_every = latency_report_every
+        self.worker_kwargs = worker_kwargs
+
+        self.stats_queue: Queue = mp_context.Queue()
+        # Alerts of all workers are sent by the supervisor's dispatcher, so that Telegram's limits apply across shards
+        self.alert_queue: Queue = mp_context.Queue()
+        self.ack_queues: Dict[int, Queue] = {shard: mp_context.Queue() for shard in range(self.workers)}
+        self.relay: Thread | None = None
+        self.processes: Dict[int, BaseProcess] = {}
+        self.restarts: Dict[int, int] = {shard: 0 for shard in range(self.workers)}
+        self.loop_times: Dict[int, float] = {}
+        self.snapshots: Dict[int, dict] = {}
+
+    def start_worker(self, shard: int) -> None:
+        """Starts the worker process of a shard."""
+        process = mp_context.Process(target=run_worker, name=f"shard-{shard}",
+                                     args=(self.shards[shard], start_logging(), self.alert_queue,
+                                           self.ack_queues[shard]),
+                                     kwargs={**self.worker_kwargs, "circuits": self.circuits[shard],
+                                             "shard": shard, "stats_queue": self.stats_queue})
+        process.start()
+        self.processes[shard] = process
+
+    def start(self) -> None:
+        """Starts all worker processes, the alert relay and the metrics server."""
+        # Workers log through the main process' listener
+        start_logging()
+
+        self.relay = Thread(target=dispatcher.relay, args=(self.alert_queue, self.ack_queues), name="telegram-relay",
+                            daemon=True)
+        self.relay.start()
+
+        # Heartbeats of a previous run, possibly with more workers, would read as stalled workers
+        for path in glob.glob(self.worker_kwargs.get("heartbeat_path", heartbeat_file).format(shard="*")):
+            os.remove(path)
+
+        for shard in range(self.workers):
+            self.start_worker(shard)
+
+        if self.metrics_port:
+            start_metrics_server(self.metrics_port, self.render_metrics)
+
+    def collect_stats(self) -> None:
+        """Drains loop times and metrics snapshots reported by the workers."""
+        while True:
+            try:
+                shard, loop_time, snapshot = self.stats_queue.get_nowait()
+            except Empty:
+                return
+
+            self.loop_times[shard] = loop_time
+            shard_loop_seconds.set(loop_time, shard=shard)
+            if snapshot is not None:
+                # Workers register the supervisor's own metrics too, which are only reported once
+                for name in (shard_loop_seconds.name, worker_restarts.name):
+                    snapshot.pop(name, None)
+                self.snapshots[shard] = snapshot
+
+    def render_metrics(self) -> str:
+        """Returns the supervisor's and the latest metrics of every shard in Prometheus text format."""
+        snapshots = [({}, registry.snapshot())]
+        snapshots.extend(({"shard": str(shard)}, snapshot) for shard, snapshot in sorted(self.snapshots.items()))
+
+        return render_snapshots(snapshots)
+
+    def report(self) -> str:
+        """Returns a summary of each shard's wallets, last loop time and restarts."""
+        timestamp = datetime.now().astimezone().strftime(time_format)
+        lines = [f"{timestamp} - Shard report:"]
+        for shard in range(self.workers):
+            loop_time = self.loop_times.get(shard)
+            loop_time = f"{loop_time:,.2f}s" if loop_time is not None else "n/a"
+            lines.append(f"Shard {shard}: {len(self.shards[shard])} wallets, last loop {loop_time}, "
+                         f"{self.restarts[shard]} restarts")
+
+        return "\n".join(lines)
+
+    def latency_report(self, slowest: int = 5) -> str | None:
+        """
+        Returns a summary of each shard's alert latency by stage and its slowest wallets.
+
+        :param slowest: Number of slowest wallets listed per shard
+        :returns: Summary or None if no txns have been alerted yet
+        """
+        names = {wallet.address: wallet.name for wallets in self.shards for wallet in wallets}
+        timestamp = datetime.now().astimezone().strftime(time_format)
+
+        lines = [f"<b>Alert latency</b> - {timestamp}"]
+        for shard, snapshot in sorted(self.snapshots.items()):
+            stages = snapshot.get(alert_latency.name, {}).get('values', {})
+            if not stages:
+                continue
+
+            # Values are p50, p95 and p99 of the latest txns, followed by sum and count of all txns
+            lines.append(f"Shard {shard}, {stages[('total', )][-1]:,} txns - p50 / p95 / p99 secs:")
+            for stage in ("poll", "fetch", "resolve", "format", "enqueue", "send", "total"):
+                if values := stages.get((stage, )):
+                    lines.append(f"{stage.title()}: {values[0]:,.2f} / {values[1]:,.2f} / {values[2]:,.2f}")
+
+            wallets = snapshot.get(wallet_alert_latency.name, {}).get('values', {})
+            if wallets:
+                slow = sorted(wallets.items(), key=lambda item: item[1][1], reverse=True)[:slowest]
+                lines.append("Slowest p95: " + ", ".join(f"{names.get(address, address)} {values[1]:,.2f}"
+                                                         for (address, ), values in slow))
+
+        return "\n".join(lines) if len(lines) > 1 else None
+
+    def run(self, check_every: float = 1.0) -> None:
+        """
+        Supervises the workers forever, restarting any worker that exits.
+        Other workers keep running and a restarted worker resumes from its saved state.
+
+        :param check_every: Secs between checks of the worker processes
+        """
+        last_report = last_latency_report = monotonic()
+        try:
+            while True:
+                sleep(check_every)
+                self.collect_stats()
+
+                for shard, process in self.processes.items():
+                    if process.is_alive():
+                        continue
+
+                    log_error.warning(f"'Supervisor' - Shard {shard} exited with code {process.exitcode}, "
+                                      f"restarting in {self.restart_delay} secs.")
+                    sleep(self.restart_delay)
+
+                    self.restarts[shard] += 1
+                    worker_restarts.inc(shard=shard)
+                    self.start_worker(shard)
+
+                if monotonic() - last_report >= self.report_every:
+                    print(self.report())
+                    last_report = monotonic()
+
+                if self.latency_report_every and monotonic() - last_latency_report >= self.latency_report_every:
+                    # Sent from a thread, so that Telegram retries don't hold up restarts
+                    if message := self.latency_report():
+                        Thread(target=telegram_send_message, args=(message, ), kwargs={"debug": True},
+                               daemon=True).start()
+                    last_latency_report = monotonic()
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 60.0) -> None:
+        """
+        Terminates the workers, which wait for their queued alerts to be acknowledged before exiting,
+        then sends the alerts still queued.
+
+        :param timeout: Max secs to wait for each worker to exit
+        """
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        for shard, process in self.processes.items():
+            process.join(timeout)
+            if process.is_alive():
+                log_error.warning(f"'Supervisor' - Shard {shard} did not exit within {timeout} secs, killing it.")
+                process.kill()
+
+        if self.relay is not None:
+            self.alert_queue.put(None)
+            self.relay.join(timeout)
+            self.relay = None
+        dispatcher.stop()
@@ -1,27 +1,381 @@
 """
 torrc file located at /usr/local/etc/tor on mac.
 """
+import re
 import requests
-from stem import Signal
+import subprocess
+
+from secrets import token_hex
+from time import (
+    perf_counter,
+    sleep,
+)
+from dataclasses import dataclass
+from threading import (
+    Lock,
+    local,
+)
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from stem import (
+    Signal,
+    SocketError,
+)
 from stem.control import Controller
-from fake_useragent import UserAgent
+from requests.adapters import HTTPAdapter
+
+from src.cryptowallets.useragents import user_agent_pool
+from src.cryptowallets.common import variables
+from src.cryptowallets.common.logger import log_error
+from src.cryptowallets.common.metrics import (
+    newnym_requests,
+    newnym_wait,
+    request_seconds,
+)
+
+
+class RequestTiming(NamedTuple):
+    """Latency of a single request in secs, split into SOCKS/TCP connect, TLS handshake and transfer."""
+    connect: float
+    tls: float
+    transfer: float
+    total: float
+
+
+# Connect/TLS times are recorded per thread while a request is being sent
+_timings = local()
+_timed_classes: dict = {}
+
+
+def _timed_connection_cls(connection_cls: type) -> type:
+    """
+    Returns a subclass of an urllib3 connection class that records connect and TLS handshake times.
+
+    :param connection_cls: urllib3 connection class used by a connection pool
+    :returns: Timed connection class
+    """
+    if connection_cls in _timed_classes:
+        return _timed_classes[connection_cls]
+
+    class TimedConnection(connection_cls):
+        timed = True
+
+        def _new_conn(self):
+            start = perf_counter()
+            conn = super()._new_conn()
+            _timings.connect += perf_counter() - start
+            return conn
+
+        def connect(self):
+            start = perf_counter()
+            connect_before = _timings.connect
+            super().connect()
+            _timings.tls += perf_counter() - start - (_timings.connect - connect_before)
+
+    _timed_classes[connection_cls] = TimedConnection
+
+    return TimedConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that attaches a RequestTiming to every response as 'response.timing'
+    and records it in the tor_request_seconds metric.
+    """
+
+    @staticmethod
+    def _timed_pool(pool):
+        if not getattr(pool.ConnectionCls, 'timed', False):
+            pool.ConnectionCls = _timed_connection_cls(pool.ConnectionCls)
+
+        return pool
+
+    def get_connection(self, url, proxies=None):
+        return self._timed_pool(super().get_connection(url, proxies))
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        # Used instead of get_connection from requests 2.32 on
+        return self._timed_pool(super().get_connection_with_tls_context(request, verify, proxies, cert))
+
+    def send(self, request, stream=False, **kwargs):
+        _timings.connect = _timings.tls = 0.0
+
+        start = perf_counter()
+        response = super().send(request, stream=stream, **kwargs)
+        if not stream:
+            response.content  # Read body here so transfer time is included
+        total = perf_counter() - start
+
+        connect, tls = _timings.connect, _timings.tls
+        response.timing = RequestTiming(connect, tls, total - connect - tls, total)
+        for phase, secs in response.timing._asdict().items():
+            request_seconds.observe(secs, phase=phase)
+
+        return response
+
+
+class SessionPool:
+    """
+    Pool of keep-alive Tor sessions keyed by SOCKS port and SOCKS isolation credentials.
+    Idle sessions are reused across loops so the SOCKS and TLS handshakes are not repeated per request.
+    """
+
+    def __init__(self, max_size: int = 20, idle_timeout: float = 300.0):
+        """
+        :param max_size: Max number of idle sessions kept per port
+        :param idle_timeout: Secs after which an idle session is closed
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self._idle: Dict[Tuple[int, str], List[Tuple[float, requests.Session]]] = defaultdict(list)
+        self._generation: Dict[Tuple[int, str], int] = defaultdict(int)
+        self._lock = Lock()
+
+    def acquire(self, port: int = 9050, isolation: str = "") -> requests.Session:
+        """
+        Returns an idle session for a port or creates a new one.
+
+        :param port: SOCKS port number
+        :param isolation: SOCKS username that isolates the session on its own circuit
+        :return: Session instance
+        """
+        self.evict_idle()
+        key = (port, isolation)
+
+        with self._lock:
+            if self._idle[key]:
+                _, session = self._idle[key].pop()
+                return session
+
+            generation = self._generation[key]
+
+        session = get_tor_session(port=port, isolation=isolation)
+        session.pool_generation = generation
+
+        return session
+
+    def release(self, session: requests.Session, port: int = 9050, isolation: str = "") -> None:
+        """
+        Returns a session to the pool. Sessions created before the last clear() are closed instead.
+
+        :param session: Session instance
+        :param port: SOCKS port number
+        :param isolation: SOCKS username the session was created with
+        """
+        key = (port, isolation)
+
+        with self._lock:
+            if session.pool_generation == self._generation[key] and len(self._idle[key]) < self.max_size:
+                self._idle[key].append((perf_counter(), session))
+                return
+
+        session.close()
+
+    @contextmanager
+    def session(self, port: int = 9050, isolation: str = "") -> Iterator[requests.Session]:
+        """Context manager that acquires a session and returns it to the pool afterwards."""
+        session = self.acquire(port, isolation)
+        try:
+            yield session
+        finally:
+            self.release(session, port, isolation)
+
+    def evict_idle(self) -> None:
+        """Closes all sessions that have been idle for longer than idle_timeout."""
+        expired = []
+        cutoff = perf_counter() - self.idle_timeout
+
+        with self._lock:
+            for idle in self._idle.values():
+                expired.extend(session for last_used, session in idle if last_used < cutoff)
+                idle[:] = [item for item in idle if item[0] >= cutoff]
+
+        for session in expired:
+            session.close()
+
+    def clear(self, port: int | None = None, isolation: str | None = None) -> None:
+        """
+        Closes idle sessions and invalidates checked out ones, eg. after a NEWNYM.
+
+        :param port: SOCKS port number, all ports if None
+        :param isolation: SOCKS username, all usernames if None
+        """
+        with self._lock:
+            keys = [key for key in set(self._idle) | set(self._generation)
+                    if (port is None or key[0] == port) and (isolation is None or key[1] == isolation)]
+            closed = []
+            for key in keys:
+                closed.extend(session for _, session in self._idle.pop(key, []))
+                self._generation[key] += 1
+
+        for session in closed:
+            session.close()
+
+
+session_pool = SessionPool()
+
+
+@dataclass
+class Circuit:
+    """
+    A Tor circuit requests can be scheduled on.
+    Circuits with a control_port belong to their own Tor instance and are rotated with NEWNYM,
+    circuits sharing a Tor instance are isolated by SOCKS username and rotated by changing it.
+    """
+    socks_port: int = 9050
+    control_port: Optional[int] = 9051
+    isolation: str = ""
+    benched_until: float = 0.0
+    next_newnym: float = 0.0
+    in_flight: int = 0
+
+    def __repr__(self):
+        return f"Circuit {self.socks_port}/{self.isolation or '-'}"
+
+
+def build_circuits(socks_ports: List[int], circuits_per_port: int = 1,
+                   control_ports: List[int] | None = None) -> List[Circuit]:
+    """
+    Builds a list of circuits for the given Tor SOCKS ports.
+
+    :param socks_ports: SOCKS port of each Tor instance, eg. [9050]
+    :param circuits_per_port: Number of SOCKS-auth isolated circuits to open on each port
+    :param control_ports: Control port of each Tor instance, in socks_ports order.
+        Defaults to 9051 for a single port, required for several ports unless their circuits are isolated
+    :returns: List of circuits
+    """
+    if control_ports is None:
+        if len(socks_ports) > 1 and circuits_per_port == 1:
+            # Every circuit would send NEWNYM to the same Tor instance
+            raise Exception("A control port is required for each Tor SOCKS port.")
+
+        control_ports = [9051] * len(socks_ports)
 
-from src.cryptowallets.common.variables import TOR_PASSWORD
+    if len(control_ports) != len(socks_ports):
+        raise Exception(f"Got {len(control_ports)} Tor control ports for {len(socks_ports)} SOCKS ports.")
 
+    circuits = []
+    for socks_port, control_port in zip(socks_ports, control_ports):
+        if circuits_per_port == 1:
+            circuits.append(Circuit(socks_port, control_port))
+        else:
+            circuits.extend(Circuit(socks_port, None, token_hex(8)) for _ in range(circuits_per_port))
 
-user_agent = UserAgent(verify_ssl=False)
+    return circuits
 
 
-def change_ip(password: str = "", port: int = 9051) -> float:
+class CircuitPool:
+    """
+    Schedules requests across Tor circuits. A circuit that gets rate limited is benched
+    and rotated while the other circuits keep working.
+    """
+
+    def __init__(self, circuits: List[Circuit] | None = None, bench_time: float = 5.0):
+        """
+        :param circuits: List of circuits, defaults to a single circuit on port 9050
+        :param bench_time: Min secs a rate limited circuit is kept out of rotation
+        """
+        self.bench_time = bench_time
+        self.circuits = circuits or [Circuit()]
+        self._lock = Lock()
+
+    def reset(self, circuits: List[Circuit]) -> None:
+        """Replaces the circuits in the pool."""
+        with self._lock:
+            self.circuits = circuits
+
+    def acquire(self) -> Circuit | None:
+        """
+        Returns the least busy circuit that is not benched.
+
+        :returns: Circuit instance or None if all circuits are benched
+        """
+        now = perf_counter()
+        with self._lock:
+            available = [circuit for circuit in self.circuits if circuit.benched_until <= now]
+            if not available:
+                return None
+
+            circuit = min(available, key=lambda c: c.in_flight)
+            circuit.in_flight += 1
+
+        return circuit
+
+    def release(self, circuit: Circuit) -> None:
+        """Marks a request on a circuit as finished."""
+        with self._lock:
+            circuit.in_flight -= 1
+
+    def wait_time(self) -> float:
+        """Returns secs until the next benched circuit becomes available."""
+        with self._lock:
+            return max(0.0, min(circuit.benched_until for circuit in self.circuits) - perf_counter())
+
+    def bench(self, circuit: Circuit) -> None:
+        """
+        Benches a rate limited circuit and rotates it to a new identity.
+
+        :param circuit: Rate limited circuit
+        """
+        now = perf_counter()
+        with self._lock:
+            if circuit.benched_until > now:
+                return  # Already benched by another request
+
+            circuit.benched_until = now + self.bench_time
+
+            if circuit.control_port is None:
+                old_isolation = circuit.isolation
+                circuit.isolation = token_hex(8)
+                rotate = False
+            else:
+                rotate = now >= circuit.next_newnym
+                circuit.benched_until = max(circuit.benched_until, circuit.next_newnym)
+
+        if circuit.control_port is None:
+            newnym_requests.inc(method="isolation")
+            session_pool.clear(circuit.socks_port, old_isolation)
+
+        elif rotate:
+            try:
+                secs = change_ip(port=circuit.control_port, socks_port=circuit.socks_port)
+
+            except Exception as e:
+                # Eg. wrong password or control port closed - the circuit stays benched and is rotated next time
+                log_error.warning(f"'CircuitPool.bench' - NEWNYM failed on control port {circuit.control_port} - {e}")
+                return
+
+            newnym_requests.inc(method="newnym")
+            newnym_wait.observe(secs)
+            with self._lock:
+                circuit.next_newnym = perf_counter() + secs
+
+
+circuit_pool = CircuitPool()
+
+
+def change_ip(password: str = "", port: int = 9051, socks_port: int | None = None) -> float:
     """
     Changes your IP address and returns Tor's NEWNYM wait time.
+    Pooled sessions are dropped so that new connections use the new circuits.
 
     :param password: Controller authentication password. No password by default
     :param port: Port number, defaults to 9050
+    :param socks_port: SOCKS port of the Tor instance, all pooled sessions are dropped if None
     :returns: Number of seconds until a new NEWNYM can be requested
     """
     if password == "":
-        password = TOR_PASSWORD
+        password = variables.TOR_PASSWORD
 
     with Controller.from_port(port=port) as controller:
         controller.authenticate(password=password)
@@ -29,23 +383,115 @@ def change_ip(password: str = "", port: int = 9051) -> float:
         secs = controller.get_newnym_wait()
         controller.close()
 
+    session_pool.clear(socks_port)
+
     return secs
 
 
-def get_tor_session(port: int = 9050) -> requests.Session:
+class TorStartup(NamedTuple):
+    """Secs from launch until Tor's control port answered and until its circuits were ready."""
+    control_port: float
+    bootstrap: float
+
+
+def wait_for_tor(password: str = "", port: int = 9051, timeout: float = 120.0, check_every: float = 0.2,
+                 process: subprocess.Popen | None = None) -> TorStartup:
+    """
+    Waits until Tor has bootstrapped and established a circuit, watching progress through its control port.
+
+    :param password: Controller authentication password. No password by default
+    :param port: Control port number, defaults to 9051
+    :param timeout: Max secs to wait, Tor is checked at least once
+    :param check_every: Secs between two checks
+    :param process: Tor process, stop waiting if it exits
+    :returns: TorStartup timings
+    """
+    if password == "":
+        password = variables.TOR_PASSWORD
+
+    start = perf_counter()
+    deadline = start + timeout
+    control_port_secs = None
+    progress = 0
+
+    while True:
+        if process is not None and process.poll() is not None:
+            raise Exception(f"Tor exited with code {process.returncode} while bootstrapping.")
+
+        try:
+            with Controller.from_port(port=port) as controller:
+                controller.authenticate(password=password)
+                if control_port_secs is None:
+                    control_port_secs = perf_counter() - start
+
+                while True:
+                    # Eg. warnings about the network are reported without a progress
+                    phase = controller.get_info("status/bootstrap-phase")
+                    if match := re.search(r"PROGRESS=(\d+)", phase):
+                        progress = int(match.group(1))
+
+                    if progress >= 100 and controller.get_info("status/circuit-established") == "1":
+                        return TorStartup(control_port_secs, perf_counter() - start)
+
+                    if perf_counter() >= deadline:
+                        break
+                    sleep(check_every)
+
+        except SocketError:
+            if perf_counter() < deadline:
+                sleep(check_every)  # Control port not open yet
+
+        if perf_counter() >= deadline:
+            raise TimeoutError(f"Tor not ready after {timeout:,.1f} secs, bootstrapped {progress}%.")
+
+
+def launch_tor(out_file_name: str, control_ports: List[int] | None = None,
+               timeout: float = 120.0) -> Tuple[subprocess.Popen, TorStartup]:
+    """
+    Starts a Tor client and returns as soon as all its control ports report ready circuits.
+
+    :param out_file_name: File Tor's output is appended to
+    :param control_ports: Control ports to wait for, defaults to [9051]
+    :param timeout: Max secs to wait for Tor to bootstrap, shared by all control ports
+    :returns: Tor process and its startup timings, bootstrap covers all control ports
     """
-    Create a new socks5h:// configured Tor session.
+    if control_ports is None:
+        control_ports = [9051]
+
+    launched = perf_counter()
+    with open(out_file_name, "a") as out_file:
+        process = subprocess.Popen(["tor"], stdout=out_file, stderr=subprocess.STDOUT)
+
+    deadline = launched + timeout
+    startups = [wait_for_tor(port=port, timeout=max(0.0, deadline - perf_counter()), process=process)
+                for port in control_ports]
+
+    return process, TorStartup(startups[0].control_port, perf_counter() - launched)
+
+
+def get_tor_session(port: int = 9050, isolation: str = "") -> requests.Session:
+    """
+    Create a new socks5h:// configured Tor session. Sessions connect directly if TOR_PROXY is empty.
 
     :param port: Port number, defaults to 9050
+    :param isolation: SOCKS username, Tor puts each username on a separate circuit
     :return: Session instance
     """
+    credentials = f"{isolation}:{isolation}@" if isolation else ""
 
     tor_session = requests.session()
-    tor_session.proxies = {
-        'http': f"socks5h://127.0.0.1:{port}",
-        'https': f"socks5h://127.0.0.1:{port}",
-    }
+    if variables.TOR_PROXY:
+        proxy = variables.TOR_PROXY.format(credentials=credentials, port=port)
+        tor_session.proxies = {
+            'http': proxy,
+            'https': proxy,
+        }
+
+    adapter = TimedAdapter()
+    tor_session.mount('http://', adapter)
+    tor_session.mount('https://', adapter)
 
-    tor_session.headers = {"User_Agent": user_agent.random}
+    # Keep requests' default headers, eg. Accept-Encoding, and add the circuit's user agent
+    tor_session.headers["User-Agent"] = user_agent_pool.get(port, isolation)
 
     return tor_session
@@ -0,0 +1,67 @@
+"""
+Pool of browser user agents, loaded from a bundled file and rotated without any per-request lookups.
+"""
+import os
+
+from zlib import crc32
+from random import shuffle
+from itertools import count
+from typing import List
+
+
+user_agents_file = os.path.join(os.path.dirname(__file__), "data", "user_agents.txt")
+
+
+class UserAgentPool:
+    """
+    Round-robin pool of user agents. If pinned, each Tor circuit keeps the same user agent
+    until it is rotated, so that a circuit's fingerprint stays consistent.
+    """
+
+    def __init__(self, path: str = user_agents_file, pin: bool = True):
+        """
+        :param path: File with one user agent per line, lines starting with '#' are ignored
+        :param pin: Pin a user agent to each circuit instead of rotating it on every request
+        """
+        self.path = path
+        self.pin = pin
+
+        self._agents: List[str] = []
+        self._counter = count()
+
+    @property
+    def agents(self) -> List[str]:
+        """User agents, read from file on first use."""
+        if not self._agents:
+            with open(self.path) as file:
+                agents = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+            shuffle(agents)  # Workers don't all start on the same user agent
+            self._agents = agents
+
+        return self._agents
+
+    def next(self) -> str:
+        """Returns the next user agent in the rotation."""
+        agents = self.agents
+
+        return agents[next(self._counter) % len(agents)]
+
+    def pinned(self, port: int, isolation: str = "") -> str:
+        """Returns the user agent of a circuit, a rotated circuit gets a new one."""
+        agents = self.agents
+
+        return agents[crc32(f"{port}-{isolation}".encode()) % len(agents)]
+
+    def get(self, port: int, isolation: str = "") -> str:
+        """
+        Returns the user agent to send on a circuit.
+
+        :param port: SOCKS port number
+        :param isolation: SOCKS username of the circuit
+        :returns: User agent string
+        """
+        return self.pinned(port, isolation) if self.pin else self.next()
+
+
+user_agent_pool = UserAgentPool()
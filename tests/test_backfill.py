@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from backfill import backfill_history
+from src.cryptowallets import debank
+from src.cryptowallets.debank import (
+    backfill_wallets,
+    iter_txn_pages,
+    process_backfills,
+)
+from src.cryptowallets.common.heartbeat import Heartbeat
+from src.cryptowallets.decode import HistoryPage
+from src.cryptowallets.datatypes import (
+    SeenTxns,
+    Transaction,
+    Wallet,
+)
+
+
+def page_before(start_time: float, count: int = 20) -> HistoryPage:
+    """Page of count txns one minute apart, older than start_time."""
+    start_time = start_time or 1_700_000_000.0
+    return HistoryPage([Transaction(f"0x{int(start_time) - i:064x}", "eth", start_time - 60 * (i + 1))
+                        for i in range(count)], {}, {})
+
+
+def test_paging_stops_on_an_empty_page(monkeypatch):
+    monkeypatch.setattr(debank, "get_last_txns", lambda wallet, txn_count=20, start_time=0: HistoryPage([], {}, {}))
+
+    assert list(iter_txn_pages(Wallet("0xabc", "abc"), until_time=0)) == []
+
+
+def test_backfill_of_a_range_without_txns(monkeypatch, tmp_path):
+    monkeypatch.setattr(debank, "get_last_txns", lambda wallet, txn_count=20, start_time=0: HistoryPage([], {}, {}))
+
+    saved = backfill_history("0xabc", datetime(2022, 10, 1), datetime(2022, 10, 31), path=str(tmp_path / "wallets.db"))
+
+    assert saved == 0
+
+
+def test_failed_backfills_are_reported(monkeypatch, caplog):
+    def get_last_txns(wallet, txn_count=20, start_time=0):
+        if wallet.name == "broken":
+            raise ValueError("unexpected response")
+        return page_before(start_time)
+
+    monkeypatch.setattr(debank, "get_last_txns", get_last_txns)
+    jobs = [(0, Wallet("0xabc", "broken"), 1_700_000_000.0, 0.0),
+            (1, Wallet("0xdef", "working"), 1_700_000_000.0, 1_700_000_000.0 - 30 * 60)]
+
+    async def collect():
+        return [index async for index, _ in backfill_wallets(jobs, ThreadPoolExecutor(2), max_pages=5)]
+
+    with caplog.at_level(logging.WARNING):
+        indexes = asyncio.run(collect())
+
+    assert indexes == [1, 1]  # Paged back 40 minutes, 20 minutes per page
+    assert any("broken - Backfill failed - unexpected response" in record.getMessage()
+               for record in caplog.records)
+
+
+def test_backfills_are_cancelled_when_pages_are_not_consumed(monkeypatch):
+    calls = []
+
+    def get_last_txns(wallet, txn_count=20, start_time=0):
+        calls.append(start_time)
+        return page_before(start_time)
+
+    monkeypatch.setattr(debank, "get_last_txns", get_last_txns)
+    jobs = [(0, Wallet("0xabc", "abc"), 1_700_000_000.0, 0.0)]
+
+    async def first_page():
+        pages = backfill_wallets(jobs, ThreadPoolExecutor(1), max_pages=1000)
+        page = await pages.__anext__()
+        await pages.aclose()
+        await asyncio.sleep(0.1)
+        return page
+
+    asyncio.run(first_page())
+
+    assert len(calls) < 10
+
+
+def test_backfilled_pages_are_processed_with_their_wallet(monkeypatch, tmp_path):
+    monkeypatch.setattr(debank, "get_last_txns", lambda wallet, txn_count=20, start_time=0: page_before(start_time))
+    wallet, until_time = Wallet("0xdef", "def"), 1_700_000_000.0 - 30 * 60
+    seen_txns = [None, SeenTxns([], capacity=10)]
+    processed = []
+
+    def process(wallet, seen, route, page, since=None):
+        processed.append((wallet, seen, route, len(page.history_list), since))
+        return page.history_list
+
+    heartbeat = Heartbeat(str(tmp_path / "heartbeat-0.json"))
+    asyncio.run(process_backfills([(1, wallet, 1_700_000_000.0, until_time)], seen_txns, {wallet.address: "route"},
+                                  process, ThreadPoolExecutor(1), heartbeat, 60.0, max_in_flight=1,
+                                  max_backfill_pages=5, wallet_deadline=30.0, shard=0, loop=1, loop_time=0.0))
+
+    assert processed == [(wallet, seen_txns[1], "route", 20, until_time)] * 2
@@ -0,0 +1,63 @@
+from src.cryptowallets.cache import (
+    MetadataCache,
+    want_prices,
+)
+from src.cryptowallets.datatypes import (
+    ProjectInfo,
+    SeenTxns,
+    TokenTransfer,
+    Transaction,
+)
+from src.cryptowallets.decode import HistoryPage
+from src.cryptowallets.prices import price_cache
+from src.cryptowallets.common.metrics import (
+    cache_entries,
+    cache_evictions,
+    cache_lookups,
+)
+
+
+def test_least_recently_updated_are_evicted():
+    cache = MetadataCache("test-evict", max_size=2)
+    cache.update([("a", ProjectInfo("a", "A")), ("b", ProjectInfo("b", "B"))])
+    cache.update([("a", ProjectInfo("a", "A"))])  # Refreshed, so b is now the oldest
+    cache.update([("c", ProjectInfo("c", "C"))])
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a").name == "A" and cache.get("c").name == "C"
+    assert cache_evictions.snapshot()["values"][("test-evict", )] == 1
+    assert cache_entries.snapshot()["values"][("test-evict", )] == 2
+
+
+def test_lookups_are_exported():
+    cache = MetadataCache("test-lookups")
+    cache.update([("a", ProjectInfo("a", "A"))])
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    values = cache_lookups.snapshot()["values"]
+    assert values[("test-lookups", "hit")] == 2
+    assert values[("test-lookups", "miss")] == 1
+
+
+def test_want_prices_matches_the_alerted_txns():
+    seen = SeenTxns([Transaction("0xseen", "eth", 1000.0, receives=[TokenTransfer("seen-token", 1.0)])])
+    page = HistoryPage([
+        Transaction("0xnew", "eth", 1010.0, receives=[TokenTransfer("new-token", 1.0)]),
+        Transaction("0xseen", "eth", 1000.0, receives=[TokenTransfer("seen-token", 1.0)]),
+        # Indexed late, stamped before the high-water mark but within the lookback window
+        Transaction("0xlate", "eth", 900.0, sends=[TokenTransfer("late-token", 1.0)]),
+    ], {}, {})
+
+    try:
+        want_prices(page, seen)
+        assert price_cache._missing == {("eth", "new-token"), ("eth", "late-token")}
+
+        # Backfilled pages are diffed since the wallet's last seen txn
+        price_cache._missing.clear()
+        want_prices(page, seen, since=1000.0)
+        assert price_cache._missing == {("eth", "new-token")}
+    finally:
+        price_cache._missing.clear()
@@ -0,0 +1,82 @@
+from src.cryptowallets.datatypes import (
+    SeenTxns,
+    Transaction,
+)
+
+
+def make_txns(count: int, newest: float = 1_700_000_000.0, prefix: str = "0x") -> list:
+    """Returns count txns one minute apart, newest first, as DeBank lists them."""
+    return [Transaction(f"{prefix}{i:064x}", "eth", newest - 60 * i) for i in range(count)]
+
+
+def test_diff_finds_new_txns_by_id():
+    old = make_txns(20)
+    seen = SeenTxns(old)
+    new = make_txns(2, newest=old[0].time_at + 120, prefix="0xa") + old[:18]
+
+    assert seen.diff(new) == new[:2]
+    assert seen.high_water == old[0].time_at
+
+
+def test_diff_keeps_late_indexed_txns():
+    seen = SeenTxns(make_txns(20))
+
+    # Indexed after the newest seen txn, but stamped 10 minutes before it
+    late = Transaction("0x" + "f" * 64, "eth", seen.high_water - 600)
+    assert seen.diff([late]) == [late]
+
+    # Txns older than the lookback window are history, not new txns
+    ancient = Transaction("0x" + "e" * 64, "eth", seen.high_water - 2 * seen.lookback)
+    assert seen.diff([ancient]) == []
+
+
+def test_diff_since_overrides_lookback():
+    seen = SeenTxns(make_txns(20))
+    old = Transaction("0x" + "f" * 64, "eth", seen.high_water - 600)
+
+    assert seen.diff([old], since=seen.high_water) == []
+
+
+def test_capacity_evicts_oldest_first():
+    txns = make_txns(5)
+    seen = SeenTxns(txns, capacity=3)
+
+    assert len(seen) == 3
+    assert txns[0].id in seen and txns[4].id not in seen
+
+
+def test_diff_skips_evicted_txns():
+    txns = make_txns(20)
+    seen = SeenTxns(txns, capacity=10)
+
+    # The 10 oldest txns were evicted, but are still within the lookback window
+    assert seen.diff(txns) == []
+    assert seen.diff(txns, since=0) == []
+
+
+def compare_lists(new_list: list, old_list: list) -> list:
+    """Diff of raw txn dicts by id, as txns were compared before SeenTxns, kept as its baseline."""
+    ids = {txn['id'] for txn in old_list}
+
+    return [txn for txn in new_list if txn['id'] not in ids]
+
+
+def test_bench_diff_against_compare_lists(bench):
+    old = make_txns(40)
+    new = make_txns(2, newest=old[0].time_at + 120, prefix="0xa") + old[:18]
+    seen = SeenTxns(old)
+
+    old_dicts = [txn.to_dict() for txn in old]
+    new_dicts = [txn.to_dict() for txn in new]
+
+    def baseline_compare_lists():
+        ids = [txn['id'] for txn in old_dicts]
+        return [txn for txn in new_dicts if txn['id'] not in ids]
+
+    diff_secs = bench(lambda: seen.diff(new))
+    compare_secs = bench(lambda: compare_lists(new_dicts, old_dicts))
+    baseline_secs = bench(baseline_compare_lists)
+
+    print(f"\nSeenTxns.diff {diff_secs * 1e6:.2f}us, compare_lists {compare_secs * 1e6:.2f}us, "
+          f"list based compare_lists {baseline_secs * 1e6:.2f}us per 20 txn page")
+    assert [txn.id for txn in seen.diff(new)] == [txn['id'] for txn in compare_lists(new_dicts, old_dicts)]
@@ -0,0 +1,124 @@
+import asyncio
+
+from time import (
+    perf_counter,
+    sleep,
+)
+from threading import Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.cryptowallets import debank
+from src.cryptowallets.state import StateStore
+from src.cryptowallets.rules import compile_rules
+from src.cryptowallets.decode import decode_history
+from src.cryptowallets.routing import Route
+from src.cryptowallets.datatypes import (
+    SeenTxns,
+    Wallet,
+)
+from src.cryptowallets.debank import fetch_wallets
+
+
+def make_wallets(count: int) -> list:
+    return [Wallet(f"0x{i:040x}", f"wallet {i}") for i in range(count)]
+
+
+class InFlight:
+    """Stand-in for get_last_txns that records how many calls run at the same time."""
+
+    def __init__(self, secs: float = 0.05, slow: str | None = None):
+        self.secs = secs
+        self.slow = slow
+        self.running = 0
+        self.peak = 0
+        self._lock = Lock()
+
+    def __call__(self, wallet, validators=None):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            sleep(1.0 if wallet.address == self.slow else self.secs)
+            return wallet.address
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def test_fetch_wallets_bounds_requests_in_flight(monkeypatch):
+    getter = InFlight()
+    monkeypatch.setattr(debank, "get_last_txns", getter)
+    wallets = make_wallets(20)
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = asyncio.run(fetch_wallets(wallets, executor, max_in_flight=4))
+
+    assert getter.peak == 4
+    assert results == [wallet.address for wallet in wallets]  # In wallets_list order
+
+
+def test_fetch_wallets_deadline_skips_slow_wallet(monkeypatch):
+    wallets = make_wallets(3)
+    monkeypatch.setattr(debank, "get_last_txns", InFlight(slow=wallets[1].address))
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = asyncio.run(fetch_wallets(wallets, executor, max_in_flight=3, wallet_deadline=0.3))
+
+    assert results == [wallets[0].address, None, wallets[2].address]
+
+
+@pytest.mark.parametrize("fake_debank", [{"latency": 0.2}], indirect=True)
+def test_bench_loop_time_by_wallet_count(fake_debank):
+    # Responses are delayed by up to 0.2 secs, like a (fast) Tor round trip
+    timings = []
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        # One at a time, as wallets were polled before, then 10 in flight
+        for count, max_in_flight in ((10, 1), (10, 10), (50, 10), (100, 10)):
+            start = perf_counter()
+            pages = asyncio.run(fetch_wallets(make_wallets(count), executor, max_in_flight))
+            timings.append((count, max_in_flight, perf_counter() - start))
+
+            assert all(page is not None and len(page.history_list) == 20 for page in pages)
+
+    print("\nLoop time by wallet count: " + ", ".join(f"{count} wallets {max_in_flight} in flight {secs:.2f}s"
+                                                    for count, max_in_flight, secs in timings))
+
+
+def test_acknowledged_alerts_are_drained():
+    delivered, acked = deque(), []
+    for alert_id in (3, 4):
+        debank.acknowledge(delivered, alert_id, acked.append, 100.0 + alert_id)
+    debank.acknowledge(delivered, 5, None, 105.0)
+
+    assert debank.drain(delivered) == [3, 4, 5]
+    assert acked == [103.0, 104.0] and not delivered
+
+
+def test_alerts_are_sent_when_the_state_is_locked(tmp_path, history_body, monkeypatch, caplog):
+    page = decode_history(history_body)
+    sent = []
+    monkeypatch.setattr(debank.dispatcher, "send", lambda text, telegram_chat_id, on_sent=None: sent.append(on_sent))
+
+    path = str(tmp_path / "wallets.db")
+    locker = StateStore(path)
+    locker.conn.execute("BEGIN IMMEDIATE")
+    store, delivered = StateStore(path, timeout=0), deque()
+
+    seen = SeenTxns(page.history_list[5:], capacity=40)
+    found = debank.process_page(store, delivered, compile_rules(), 100000.0, Wallet("0xabc", "abc"), seen,
+                                Route(frozenset({"-1"}), frozenset({"-1"})), page)
+
+    assert len(found) == 5 and len(sent) == 5
+    assert all(on_sent is None or on_sent.func is not debank.acknowledge for on_sent in sent)
+    assert "State not saved" in caplog.text
+
+    # Acknowledged alerts whose delete fails are deleted after the next loop
+    delivered.extend([1, 2])
+    debank.delete_delivered(store, delivered)
+    assert list(delivered) == [1, 2]
+    locker.conn.rollback()
+    debank.delete_delivered(store, delivered)
+    assert not delivered
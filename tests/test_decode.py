@@ -0,0 +1,147 @@
+import sys
+import json
+import tracemalloc
+import importlib.util
+
+import pytest
+
+from src.cryptowallets import decode
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.debank import get_last_txns
+from src.cryptowallets.decode import (
+    decode_history,
+    decode_page,
+    fingerprint,
+    unchanged_page,
+)
+from src.cryptowallets.replay import synthetic_fixture
+from src.cryptowallets.common.metrics import (
+    debank_bytes_decoded,
+    debank_responses,
+)
+
+
+def retained_bytes(build) -> int:
+    """Returns the bytes still allocated by what build() returns."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    del result
+    return size
+
+
+def test_decode_page_keeps_read_fields(history_data):
+    page = decode_page(history_data)
+    raw = history_data['history_list'][1]
+    txn = page.history_list[1]
+
+    assert len(page.history_list) == 20
+    assert (txn.id, txn.chain, txn.time_at, txn.project_id) == (raw['id'], "eth", raw['time_at'], "uniswap3")
+    assert txn.txn_type == "multicall" and page.history_list[0].txn_type == ""
+    assert [(item.token_id, item.amount) for item in txn.receives] == [
+        (item['token_id'], item['amount']) for item in raw['receives']]
+    assert page.token_dict["eth"].price == 2500.0 and page.project_dict["uniswap3"].name == "Uniswap V3"
+
+
+def test_repeated_strings_are_interned(history_body):
+    first, second = decode_history(history_body), decode_history(history_body)
+
+    assert first.history_list[0].chain is second.history_list[0].chain
+    assert first.history_list[1].receives[0].token_id is second.history_list[1].receives[0].token_id
+
+
+def test_json_is_used_without_orjson(monkeypatch, history_body):
+    # A separate copy of the module, so that the one the rest of the package imported keeps its classes
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    spec = importlib.util.spec_from_file_location("decode_without_orjson", decode.__file__)
+    fallback = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fallback)
+
+    assert fallback.loads is json.loads
+    page, expected = fallback.decode_history(history_body), decode_history(history_body)
+    assert [txn.to_dict() for txn in page.history_list] == [txn.to_dict() for txn in expected.history_list]
+    assert page.token_dict.keys() == expected.token_dict.keys()
+
+
+def test_bench_models_against_dicts(history_body, bench):
+    pages = 50
+    dict_bytes = retained_bytes(lambda: [json.loads(history_body)['data'] for _ in range(pages)])
+    model_bytes = retained_bytes(lambda: [decode_history(history_body) for _ in range(pages)])
+
+    loads_secs = bench(lambda: json.loads(history_body)['data'], number=200)
+    decode_secs = bench(lambda: decode_history(history_body), number=200)
+
+    print(f"\nRetained per 20 txn page: dicts {dict_bytes / pages / 1024:.1f}KiB, "
+          f"models {model_bytes / pages / 1024:.1f}KiB; "
+          f"json.loads {loads_secs * 1e6:.0f}us, decode_history {decode_secs * 1e6:.0f}us")
+    assert model_bytes < dict_bytes
+
+
+def test_fingerprint_ignores_formatting(history_data, history_body):
+    reformatted = json.dumps({"data": history_data, "error_code": 0}, indent=2).encode()
+
+    assert fingerprint(history_body) == fingerprint(reformatted)
+    assert fingerprint(b'{"error_code": 429, "error_msg": "Too Many Requests"}') is None
+
+
+def test_fingerprint_changes_with_a_new_txn(history_body):
+    newer = synthetic_fixture(t0=1_700_000_600.0)
+    body = json.dumps({"data": newer, "error_code": 0}).encode()
+
+    assert fingerprint(body) != fingerprint(history_body)
+
+
+def test_fingerprint_changes_with_a_status(history_data, history_body):
+    failed = json.loads(json.dumps(history_data))
+    failed['history_list'][3]['tx']['status'] = 0
+    body = json.dumps({"data": failed, "error_code": 0}).encode()
+
+    assert fingerprint(body) != fingerprint(history_body)
+
+
+def test_fingerprint_ignores_prices(history_data, history_body):
+    repriced = json.loads(json.dumps(history_data))
+    repriced['token_dict']['eth']['price'] = 3000.0
+    body = json.dumps({"data": repriced, "error_code": 0}).encode()
+
+    assert fingerprint(body) == fingerprint(history_body)
+
+
+def counted(result: str) -> float:
+    return debank_responses.snapshot()["values"].get((result, ), 0)
+
+
+def test_unchanged_response_is_not_decoded(fake_debank):
+    wallet = Wallet("0x" + "1" * 40, "wallet")
+    page = get_last_txns(wallet)
+    assert len(page.history_list) == 20 and page.validators.fingerprint is not None
+
+    unchanged, decoded_bytes = counted("unchanged"), debank_bytes_decoded.snapshot()["values"][()]
+    assert get_last_txns(wallet, validators=page.validators) is unchanged_page
+    assert counted("unchanged") == unchanged + 1
+    assert debank_bytes_decoded.snapshot()["values"][()] == decoded_bytes
+
+
+@pytest.mark.parametrize("fake_debank", [{"etags": True}], indirect=True)
+def test_matching_etag_is_answered_with_304(fake_debank):
+    wallet = Wallet("0x" + "2" * 40, "wallet")
+    page = get_last_txns(wallet)
+    assert page.validators.etag
+
+    not_modified = counted("not_modified")
+    assert get_last_txns(wallet, validators=page.validators) is unchanged_page
+    assert counted("not_modified") == not_modified + 1
+    assert fake_debank.stats["not_modified"] == 1
+
+
+def test_bench_fingerprint_against_decode(history_body, bench):
+    fingerprint_secs = bench(lambda: fingerprint(history_body), number=200)
+    decode_secs = bench(lambda: decode_history(history_body), number=200)
+
+    print(f"\nUnchanged 20 txn page: fingerprint {fingerprint_secs * 1e6:.0f}us, "
+          f"decode_history {decode_secs * 1e6:.0f}us")
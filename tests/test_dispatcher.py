@@ -0,0 +1,119 @@
+from threading import Thread
+
+from src.cryptowallets.supervisor import mp_context
+from src.cryptowallets.common.dispatcher import (
+    TelegramDispatcher,
+    message_size,
+)
+
+
+class RecordingDispatcher(TelegramDispatcher):
+    """Dispatcher that records posts instead of sending them, answering each with the next of answers."""
+
+    def __init__(self, answers=(), **kwargs):
+        super().__init__(chat_interval=0, group_interval=0, **kwargs)
+        self.answers = list(answers)
+        self.posts = []
+
+    def _post(self, message_text, telegram_chat_id):
+        self.posts.append((telegram_chat_id, message_text))
+        return self.answers.pop(0) if self.answers else (True, None)
+
+
+def alert(i: int) -> str:
+    links = "".join(f"<a href='https://etherscan.io/address/0x{i:040x}/{j}'>link {j}</a>\n" for j in range(5))
+    return f"--> Alert {i}\n{links}"
+
+
+def test_message_size_counts_parsed_text():
+    assert message_size("<a href='https://etherscan.io'>0xab &amp; cd</a>\nSend: -1.50 ETH") == (25, 1)
+
+
+def test_backlog_is_coalesced_within_limits():
+    dispatcher = RecordingDispatcher()
+
+    # Hold the queue so that the whole backlog is waiting when the workers look at it
+    with dispatcher._cond:
+        for i in range(50):
+            dispatcher.send(alert(i), "-1001")
+    dispatcher.stop()
+
+    texts = [text for _, text in dispatcher.posts]
+    assert "\n".join(texts) == "\n".join(alert(i) for i in range(50))  # All sent once, in order
+    assert len(texts) == 3  # 20 alerts of 5 links each per message
+    assert all(message_size(text)[1] <= TelegramDispatcher.max_entities for text in texts)
+    assert dispatcher.queued() == 0
+
+
+def test_failed_posts_are_retried():
+    acked = []
+    dispatcher = RecordingDispatcher(answers=[(False, None), (False, 0.1)], max_attempts=3)
+
+    dispatcher.send("hello", "-1001", on_sent=acked.append)
+    dispatcher.stop()
+
+    assert [text for _, text in dispatcher.posts] == ["hello"] * 3
+    assert len(acked) == 1
+    assert dispatcher.queued() == 0
+
+
+def test_messages_are_dropped_after_max_attempts():
+    acked = []
+    dispatcher = RecordingDispatcher(answers=[(False, None)] * 10, max_attempts=2)
+
+    dispatcher.send("hello", "-1001", on_sent=acked.append)
+    dispatcher.stop()
+
+    assert len(dispatcher.posts) == 2
+    assert acked == [] and dispatcher.queued() == 0
+
+
+def test_groups_are_sent_to_at_the_group_rate():
+    dispatcher = TelegramDispatcher()
+
+    assert dispatcher.interval("-1001") == dispatcher.group_interval
+    assert dispatcher.interval("1001") == dispatcher.chat_interval
+
+
+def forward_alerts(alert_queue, ack_queue, shard: int, count: int, results) -> None:
+    """Worker process that forwards its alerts to the parent's dispatcher and reports how many were acknowledged."""
+    dispatcher = TelegramDispatcher()
+    dispatcher.forward(alert_queue, ack_queue, shard)
+
+    acked = []
+    for i in range(count):
+        dispatcher.send(f"shard {shard} alert {i}", "-1001", on_sent=acked.append)
+    dispatcher.stop()
+
+    results.put((shard, len(acked), dispatcher.queued()))
+
+
+def test_shards_share_the_relaying_dispatcher():
+    shards, count = 3, 20
+    alert_queue, results = mp_context.Queue(), mp_context.Queue()
+    ack_queues = {shard: mp_context.Queue() for shard in range(shards)}
+
+    # The group interval makes the shards' alerts back up in the one chat queue
+    dispatcher = RecordingDispatcher()
+    dispatcher.group_interval = 1.0
+    relay = Thread(target=dispatcher.relay, args=(alert_queue, ack_queues))
+    relay.start()
+
+    processes = [mp_context.Process(target=forward_alerts, args=(alert_queue, ack_queues[shard], shard, count, results))
+                 for shard in range(shards)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+
+    alert_queue.put(None)
+    relay.join()
+    dispatcher.stop()
+
+    assert sorted(results.get(timeout=5) for _ in range(shards)) == [(shard, count, 0) for shard in range(shards)]
+    texts = [text for _, text in dispatcher.posts]
+    assert sorted("\n".join(texts).split("\n")) == sorted(f"shard {shard} alert {i}" for shard in range(shards)
+                                                           for i in range(count))
+    # Coalesced and rate limited as one chat, not once per shard
+    assert len(texts) < shards * count
+    assert any(len({line.split(" alert")[0] for line in text.split("\n")}) > 1 for text in texts)
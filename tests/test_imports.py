@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import subprocess
+
+
+def run_python(code: str, cwd: str, **env) -> str:
+    """Runs code in a fresh interpreter, with the test run's sys.path, and returns its stdout."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(path for path in sys.path if path), **env}
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env,
+                            capture_output=True, text=True, timeout=60, check=True)
+
+    return result.stdout
+
+
+def test_imports_have_no_side_effects(tmp_path):
+    log_dir = tmp_path / "logs"
+    code = """
+import sys, json
+import src.cryptowallets.supervisor
+from src.cryptowallets.useragents import user_agent_pool
+from src.cryptowallets.common import logger, variables
+print(json.dumps({"dotenv": "dotenv" in sys.modules, "agents": len(user_agent_pool._agents),
+                  "listener": logger.log_listener is not None, "token": "TOKEN" in vars(variables)}))
+"""
+    state = json.loads(run_python(code, str(tmp_path), LOG_DIR=str(log_dir)))
+
+    assert state == {"dotenv": False, "agents": 0, "listener": False, "token": False}
+    assert not log_dir.exists()
+
+
+def test_bench_cold_start(tmp_path):
+    # Import time of the package, and of the work it used to do on import: reading .env and the
+    # user agents and opening the log files
+    code = """
+from time import perf_counter
+start = perf_counter()
+import src.cryptowallets.supervisor
+imported = perf_counter()
+from src.cryptowallets.useragents import user_agent_pool
+from src.cryptowallets.common import logger, variables
+variables.TOKEN, user_agent_pool.agents, logger.start_logging()
+print(imported - start, perf_counter() - imported)
+"""
+    import_secs, deferred_secs = map(float, run_python(code, str(tmp_path), LOG_DIR=str(tmp_path / "logs")).split())
+
+    print(f"\nCold import {import_secs * 1e3:.1f}ms, deferred to first use {deferred_secs * 1e3:.1f}ms")
+    assert (tmp_path / "logs").exists()
@@ -0,0 +1,34 @@
+from src.cryptowallets.latency import (
+    LatencyTracker,
+    TxnTrace,
+)
+from src.cryptowallets.common.metrics import alert_latency
+
+
+def test_stages_split_detection():
+    trace = TxnTrace("0xabc", time_at=100.0, detected=131.0, formatted=131.5, requested=120.0, received=122.0)
+    trace.enqueued, trace.acked = 132.0, 134.0
+
+    assert trace.stages() == {"poll": 20.0, "fetch": 2.0, "resolve": 9.0, "format": 0.5,
+                              "enqueue": 0.5, "send": 2.0, "total": 34.0}
+
+
+def test_unknown_fetch_times_count_as_polling():
+    trace = TxnTrace("0xabc", time_at=100.0, detected=131.0, formatted=131.0)
+    stages = trace.stages()
+
+    assert (stages["poll"], stages["fetch"], stages["resolve"]) == (31.0, 0.0, 0.0)
+
+
+def test_ack_exports_every_stage_once():
+    tracker = LatencyTracker()
+    tracker.started = 0.0
+    trace = tracker.trace("0xabc", 100.0, 131.0, 131.5, 120.0, 122.0)
+    before = alert_latency.snapshot()["values"].get(("fetch", ), [0])[-1]
+
+    tracker.ack(trace, 134.0)
+    tracker.ack(trace, 140.0)  # Acknowledged in a second chat
+
+    values = alert_latency.snapshot()["values"]
+    assert values[("fetch", )][-1] == before + 1
+    assert trace.acked == 134.0
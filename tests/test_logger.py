@@ -0,0 +1,126 @@
+import os
+import json
+import gzip
+import time
+import logging
+
+import pytest
+
+from src.cryptowallets.common import (
+    logger,
+    variables,
+)
+from src.cryptowallets.common.logger import (
+    attach_logging,
+    file_handler,
+    logger_setup,
+    start_logging,
+)
+from src.cryptowallets.supervisor import mp_context
+
+
+def record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("txns", logging.INFO, __file__, 1, message, None, None)
+
+
+@pytest.fixture
+def log_settings(monkeypatch):
+    monkeypatch.setattr(variables, "LOG_ROTATE_WHEN", "", raising=False)
+    monkeypatch.setattr(variables, "LOG_MAX_BYTES", 300, raising=False)
+    monkeypatch.setattr(variables, "LOG_BACKUPS", 2, raising=False)
+    monkeypatch.setattr(variables, "LOG_JSON", False, raising=False)
+
+
+def test_rotated_logs_are_gzipped(tmp_path, log_settings):
+    path = str(tmp_path / "txns.log")
+    handler = file_handler(path)
+    try:
+        for i in range(20):
+            handler.emit(record(f"txn {i:02d} " + "x" * 40))
+    finally:
+        handler.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["txns.log", "txns.log.1.gz", "txns.log.2.gz"]  # LOG_BACKUPS kept
+    with gzip.open(f"{path}.1.gz", "rt") as file:
+        rotated = file.read().splitlines()
+    with open(path) as file:
+        current = file.read().splitlines()
+
+    # The newest backup holds the lines logged just before the current file
+    assert rotated and all(" - INFO - txn " in line for line in rotated)
+    assert int(rotated[-1].split("txn ")[1][:2]) + 1 == int(current[0].split("txn ")[1][:2])
+    assert current[-1].endswith("txn 19 " + "x" * 40)
+
+
+def test_timed_rotation_is_gzipped(tmp_path, log_settings, monkeypatch):
+    monkeypatch.setattr(variables, "LOG_ROTATE_WHEN", "midnight", raising=False)
+    path = str(tmp_path / "txns.log")
+    handler = file_handler(path)
+    try:
+        handler.emit(record("before midnight"))
+        handler.doRollover()
+        handler.emit(record("after midnight"))
+    finally:
+        handler.close()
+
+    rotated = [name for name in os.listdir(tmp_path) if name.endswith(".gz")]
+    assert len(rotated) == 1
+    with gzip.open(tmp_path / rotated[0], "rt") as file:
+        assert file.read().rstrip().endswith("before midnight")
+
+
+def test_json_lines(tmp_path, log_settings, monkeypatch):
+    monkeypatch.setattr(variables, "LOG_JSON", True, raising=False)
+    path = str(tmp_path / "txns.log")
+    handler = file_handler(path)
+    try:
+        handler.emit(record("0xabc, Wallet 🐳 - \"quoted\""))
+    finally:
+        handler.close()
+
+    with open(path, encoding="utf-8") as file:
+        lines = file.read().splitlines()
+
+    assert len(lines) == 1
+    data = json.loads(lines[0])
+    assert data.keys() == {"time", "created", "level", "logger", "message"}
+    assert (data["level"], data["logger"], data["message"]) == ("INFO", "txns", "0xabc, Wallet 🐳 - \"quoted\"")
+    assert "🐳" in lines[0]  # Not escaped
+
+
+def log_from_worker(queue, log_name: str, messages: list) -> None:
+    attach_logging(queue)
+    worker_logger = logger_setup(log_name, f"{log_name}.log")  # As modules set up their loggers on import
+    for message in messages:
+        worker_logger.warning(message)
+
+
+def test_workers_log_through_one_listener():
+    # A logger set up after the listener started gets its file handler added to the listener
+    start_logging()
+    log_name = f"listener_{os.getpid()}"
+    logger_setup(log_name, f"{log_name}.log")
+
+    messages = [[f"worker {worker} record {i}" for i in range(50)] for worker in range(2)]
+    processes = [mp_context.Process(target=log_from_worker, args=(start_logging(), log_name, worker_messages))
+                 for worker_messages in messages]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    # Records of both workers end up in one file, each worker's in the order it logged them
+    path = os.path.join(variables.LOG_DIR, f"{log_name}.log")
+    deadline = time.monotonic() + 5
+    lines = []
+    while time.monotonic() < deadline and len(lines) < 100:
+        time.sleep(0.05)
+        if os.path.exists(path):
+            with open(path) as file:
+                lines = [line.split(" - WARNING - ")[1] for line in file.read().splitlines()]
+
+    assert sorted(lines) == sorted(message for worker_messages in messages for message in worker_messages)
+    for worker_messages in messages:
+        assert [line for line in lines if line in worker_messages] == worker_messages
+    assert logger.log_listener is not None
@@ -0,0 +1,69 @@
+import requests
+
+from src.cryptowallets.common.metrics import (
+    Registry,
+    render_snapshots,
+    start_metrics_server,
+)
+
+
+def sample_registry() -> Registry:
+    registry = Registry()
+    registry.counter("txns_found_total", "New txns found", ("wallet", )).inc(2, wallet='0xa"b\\c')
+    registry.gauge("alerts_queued", "Alerts waiting to be sent").set(3)
+    histogram = registry.histogram("fetch_seconds", "Fetch time", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        histogram.observe(value)
+    summary = registry.summary("latency_seconds", "Alert latency", ("stage", ), quantiles=(0.5, 0.99))
+    for value in (1.0, 2.0, 3.0, 4.0):
+        summary.observe(value, stage="send")
+
+    return registry
+
+
+def test_exposition_format():
+    assert sample_registry().render().splitlines() == [
+        "# HELP alerts_queued Alerts waiting to be sent",
+        "# TYPE alerts_queued gauge",
+        "alerts_queued 3",
+        "# HELP fetch_seconds Fetch time",
+        "# TYPE fetch_seconds histogram",
+        'fetch_seconds_bucket{le="0.1"} 1',
+        'fetch_seconds_bucket{le="1.0"} 2',
+        'fetch_seconds_bucket{le="+Inf"} 3',
+        "fetch_seconds_sum 2.55",
+        "fetch_seconds_count 3",
+        "# HELP latency_seconds Alert latency",
+        "# TYPE latency_seconds summary",
+        'latency_seconds{stage="send",quantile="0.5"} 2.0',
+        'latency_seconds{stage="send",quantile="0.99"} 4.0',
+        'latency_seconds_sum{stage="send"} 10.0',
+        'latency_seconds_count{stage="send"} 4',
+        "# HELP txns_found_total New txns found",
+        "# TYPE txns_found_total counter",
+        'txns_found_total{wallet="0xa\\"b\\\\c"} 2.0',
+    ]
+
+
+def test_shard_snapshots_share_one_header():
+    registry = sample_registry()
+    lines = render_snapshots([({}, registry.snapshot()), ({"shard": "0"}, registry.snapshot()),
+                              ({"shard": "1"}, registry.snapshot())]).splitlines()
+
+    assert lines.count("# TYPE alerts_queued gauge") == 1
+    assert [line for line in lines if line.startswith("alerts_queued")] == [
+        "alerts_queued 3", 'alerts_queued{shard="0"} 3', 'alerts_queued{shard="1"} 3']
+    assert 'fetch_seconds_bucket{shard="1",le="+Inf"} 3' in lines
+
+
+def test_metrics_are_served():
+    server = start_metrics_server(0, sample_registry().render)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        resp = requests.get(f"{url}/metrics?name=alerts_queued", timeout=5)
+        assert resp.status_code == 200 and resp.headers["Content-Type"] == "text/plain; version=0.0.4"
+        assert resp.text == sample_registry().render()
+        assert requests.get(f"{url}/other", timeout=5).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
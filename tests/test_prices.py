@@ -0,0 +1,65 @@
+from src.cryptowallets import prices
+from src.cryptowallets.prices import (
+    HttpPriceSource,
+    PriceCache,
+    PriceSource,
+)
+
+
+class FixedPriceSource(PriceSource):
+    """Knows the prices it is given, counts the lookups made."""
+
+    def __init__(self, prices: dict):
+        self.prices = prices
+        self.lookups = []
+
+    def lookup(self, chain, token_ids):
+        self.lookups.append((chain, token_ids))
+        return {token_id: self.prices[token_id] for token_id in token_ids if token_id in self.prices}
+
+
+def test_resolve_time_covers_every_batch():
+    source = HttpPriceSource("http://127.0.0.1:1/prices", batch_size=2, timeout=10)
+    cache = PriceCache(source=source)
+    for token_id in ("a", "b", "c"):
+        cache.want("eth", token_id)
+    cache.want("bsc", "d")
+
+    assert cache.resolve_time() == 30  # Two eth batches and one bsc batch
+    assert PriceCache(source=source).resolve_time() == 0
+
+
+def test_resolve_batches_per_chain():
+    source = FixedPriceSource({"a": 1.0, "b": 2.0})
+    cache = PriceCache(source=source)
+    for chain, token_id in (("eth", "a"), ("eth", "b"), ("bsc", "c")):
+        cache.want(chain, token_id)
+
+    assert cache.resolve() == 2
+    assert sorted(source.lookups) == [("bsc", ["c"]), ("eth", ["a", "b"])]
+    assert cache.get("eth", "b") == 2.0
+
+    # Neither fresh prices nor tokens the source just had no price for are asked again
+    cache.want("eth", "a")
+    cache.want("bsc", "c")
+    assert cache.resolve() == 0 and len(source.lookups) == 2
+
+
+def test_resolve_forgets_expired_unpriced_tokens(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(prices, "monotonic", lambda: now[0])
+    source = FixedPriceSource({})
+    cache = PriceCache(ttl=60, source=source)
+
+    for token_id in ("a", "b"):
+        cache.want("eth", token_id)
+    cache.resolve()
+    assert len(cache._unpriced) == 2
+
+    now[0] += 30
+    cache.want("eth", "c")
+    cache.resolve()
+    now[0] += 31  # a and b expired, c did not
+    cache.resolve()
+
+    assert list(cache._unpriced) == [("eth", "c")]
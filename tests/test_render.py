@@ -0,0 +1,137 @@
+from datetime import (
+    datetime,
+    timezone,
+)
+
+import pytest
+
+from src.cryptowallets.cache import cache_response
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.decode import decode_page
+from src.cryptowallets.render import (
+    chain_links,
+    render_txn,
+    render_txns,
+)
+from src.cryptowallets.common.variables import (
+    chains,
+    time_format,
+)
+
+
+wallet = Wallet("0x" + "1" * 40, "Whale")
+
+
+def dict_format_txn_message(txn: dict, wallet: Wallet, tokens_dict: dict, project_dict: dict,
+                            whale_txn_limit: float = 100000.0) -> tuple:
+    """Txn message formatting as it was on raw txn dicts, kept as the baseline of the render layer."""
+    def send_receive(keyword, sign):
+        items = []
+        for send in txn[keyword] or ():
+            amount, token_id = send['amount'], send['token_id']
+            try:
+                token_url = f"{chains[chain]}/address/{token_id}"
+            except KeyError:
+                token_url = f"https://www.google.com/search?&rls=en&q={chain}+{token_id}&ie=UTF-8&oe=UTF-8"
+            try:
+                token_name = tokens_dict[token_id]['symbol']
+            except KeyError:
+                token_name = "+1 Unknown NFT" if len(token_id) < 42 else "+1 Unknown Item"
+                items.append(f"<a href='{token_url}'>{token_name}</a>")
+                continue
+            try:
+                token_price = tokens_dict[token_id]['price'] * amount
+                whale_mark = '🐳' if token_price >= whale_txn_limit else ''
+                token_price = f"{token_price:,.2f}"
+            except (TypeError, KeyError):
+                token_price, whale_mark = 'n/a', ''
+            items.append(f"{whale_mark}<a href='{token_url}'>{sign}{amount:,.2f} {token_name}</a>(${token_price})")
+        return items or ['None']
+
+    chain, txn_hash = str(txn['chain']), txn['id']
+    txn_stamp = datetime.fromtimestamp(int(txn['time_at']), timezone.utc).strftime(time_format)
+    receive_items, send_items = send_receive('receives', '+'), send_receive('sends', '-')
+
+    if txn['tx'] and txn['tx']['name']:
+        txn_type = str(txn['tx']['name']).title()
+    elif not txn['tx'] and txn['cate_id']:
+        txn_type = str(txn['cate_id']).title()
+    else:
+        txn_type = 'Contract Interaction'
+    if txn['project_id']:
+        txn_type = f"{txn_type}, {project_dict[txn['project_id']]['name']}"
+
+    try:
+        txn_link = f"{chains[chain]}/tx/{txn_hash}"
+    except KeyError:
+        txn_link = f"https://www.google.com/search?&rls=en&q={chain}+{txn_hash}&ie=UTF-8&oe=UTF-8"
+    try:
+        interacted_with_link = f"{chains[chain]}/address/{txn['other_addr']}"
+    except KeyError:
+        interacted_with_link = f"https://www.google.com/search?&rls=en&q={chain}+{txn['other_addr']}&ie=UTF-8&oe=UTF-8"
+
+    timestamp = datetime.now().astimezone().strftime(time_format)
+    message = f"--> {timestamp}\n" \
+              f"<a href='{txn_link}'>{txn_hash[0:6]}...{txn_hash[-4:]} on {chain.title()}</a> " \
+              f"from <a href='https://debank.com/profile/{wallet.address}/history'>{wallet.name}</a>\n" \
+              f"Stamp:  {txn_stamp}\n" \
+              f"Type: <a href='{interacted_with_link}'>{txn_type}</a>\n" \
+              f"Send: {', '.join(send_items)}\n" \
+              f"Receive: {', '.join(receive_items)}\n"
+
+    return message, f"{wallet.address}, {wallet.name} - {txn_stamp}, {txn_link}"
+
+
+@pytest.fixture
+def page(history_data):
+    page = decode_page(history_data)
+    cache_response(page)
+
+    return page
+
+
+def test_render_matches_dict_formatting(history_data, page):
+    for raw, txn in zip(history_data['history_list'], page.history_list):
+        message, log_msg = render_txn(txn, wallet)
+        expected_message, expected_log_msg = dict_format_txn_message(
+            raw, wallet, history_data['token_dict'], history_data['project_dict'])
+
+        # The first line is the local time the message was rendered at
+        assert message.split("\n", 1)[1] == expected_message.split("\n", 1)[1]
+        assert log_msg == expected_log_msg
+
+
+def test_unknown_chain_links_to_a_search():
+    links = chain_links("newchain")
+
+    assert links.tx("0xabc") == "https://www.google.com/search?&rls=en&q=newchain+0xabc&ie=UTF-8&oe=UTF-8"
+    assert chain_links("eth").address("0xabc") == f"{chains['eth']}/address/0xabc"
+
+
+def test_render_txns_shares_a_timestamp(page):
+    rendered = render_txns(page.history_list, wallet)
+
+    assert len({message.split("\n", 1)[0] for message, _ in rendered}) == 1
+
+
+def test_bench_burst_against_dict_formatting(history_data, page, bench):
+    # An airdrop burst: the same page of txns for 100 wallets
+    wallets = [Wallet(f"0x{i:040x}", f"wallet {i}") for i in range(100)]
+    raw_txns = history_data['history_list']
+    tokens_dict, project_dict = history_data['token_dict'], history_data['project_dict']
+
+    def dict_burst():
+        for burst_wallet in wallets:
+            for raw in raw_txns:
+                dict_format_txn_message(raw, burst_wallet, tokens_dict, project_dict)
+
+    def render_burst():
+        for burst_wallet in wallets:
+            render_txns(page.history_list, burst_wallet)
+
+    dict_secs = bench(dict_burst, number=3)
+    render_secs = bench(render_burst, number=3)
+    txns = len(wallets) * len(raw_txns)
+
+    print(f"\n{txns} txn burst: dict formatting {dict_secs * 1e3:.1f}ms ({dict_secs / txns * 1e6:.1f}us/txn), "
+          f"render_txns {render_secs * 1e3:.1f}ms ({render_secs / txns * 1e6:.1f}us/txn)")
@@ -0,0 +1,16 @@
+from src.cryptowallets.replay import (
+    percentile,
+    run_replay,
+    synthetic_fixture,
+)
+
+
+def test_replay_50_wallets_is_delivered_promptly():
+    # A txn every 10 secs per wallet is ~5 alerts/sec to each chat, above Telegram's 20 msgs/min per group
+    result = run_replay([synthetic_fixture()], 50, duration=20, drain_time=30,
+                        debank_kwargs={"txn_interval": 10})
+
+    assert result.published >= 50
+    assert result.delivered == result.published
+    assert percentile(result.alert_latencies, 50) < 10
+    assert result.telegram_stats["too_long"] == 0
@@ -0,0 +1,60 @@
+import pytest
+
+from src.cryptowallets import routing
+from src.cryptowallets.routing import (
+    Route,
+    build_routes,
+    default_route,
+    parse_chat_ids,
+)
+
+
+@pytest.fixture(autouse=True)
+def chats(monkeypatch):
+    monkeypatch.setattr(routing.variables, "CHAT_ID_ALERTS", "-100")
+    monkeypatch.setattr(routing.variables, "CHAT_ID_ALERTS_ALL", "-200")
+
+
+@pytest.mark.parametrize("chat_id, expected", [
+    ("-1", {"-1"}),
+    (-1, {"-1"}),
+    (["-1", -2, "-1"], {"-1", "-2"}),
+    (("-1", ), {"-1"}),
+    # Missing, empty and all-blank lists fall back to the default chat
+    (None, {"-9"}),
+    ("", {"-9"}),
+    ([], {"-9"}),
+    (["", None, 0], {"-9"}),
+    (["-1", "", None], {"-1"}),
+])
+def test_parse_chat_ids(chat_id, expected):
+    assert parse_chat_ids(chat_id, "-9") == frozenset(expected)
+
+
+def test_build_routes():
+    routes = build_routes({"wallets": {
+        "0xa": {"name": "a"},
+        "0xb": {"name": "b", "chat_id": ["-1", "-2"], "chat_id_all": "-3"},
+        "0xc": {"name": "c", "chat_id": [], "chat_id_all": ["-3", None]},
+    }})
+
+    assert routes["0xa"] == Route(rejected=frozenset({"-200"}), passed=frozenset({"-100", "-200"}))
+    assert routes["0xb"] == Route(rejected=frozenset({"-3"}), passed=frozenset({"-1", "-2", "-3"}))
+    assert routes["0xc"] == Route(rejected=frozenset({"-3"}), passed=frozenset({"-100", "-3"}))
+
+
+def test_passed_txns_also_go_to_the_all_chats_once():
+    route = build_routes({"wallets": {"0xa": {"chat_id": ["-1", "-3"], "chat_id_all": "-3"}}})["0xa"]
+
+    assert route.destinations(False) == frozenset({"-3"})
+    assert route.destinations(True) == frozenset({"-1", "-3"})  # -3 is in both, and sent to once
+    assert route.destinations(False) <= route.destinations(True)
+
+
+def test_default_route_is_built_once():
+    default_route.cache_clear()
+    try:
+        assert default_route() is default_route()
+        assert default_route().destinations(True) == frozenset({"-100", "-200"})
+    finally:
+        default_route.cache_clear()
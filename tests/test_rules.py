@@ -0,0 +1,59 @@
+import logging
+
+import pytest
+
+from src.cryptowallets.rules import (
+    compile_rules,
+    is_failed,
+)
+from src.cryptowallets.datatypes import (
+    TokenTransfer,
+    Transaction,
+)
+from src.cryptowallets.common.metrics import (
+    rule_evaluations,
+    rule_hits,
+)
+
+
+def failed_spam_txn() -> Transaction:
+    """Failed txn that also sends an unknown token, so both the failed and the NFT rules reject it."""
+    return Transaction("0x" + "a" * 64, "eth", 1_700_000_000.0, tx_name="transfer", status=0,
+                       sends=[TokenTransfer("0xunknown", 1.0)])
+
+
+def test_rejection_reason_is_stable_when_reordered(caplog):
+    rules = compile_rules()
+    rules.reorder_every = 1
+
+    # Make the NFT rule the busiest, so it is moved in front of the failed rule
+    busiest = next(rule for rule in rules.rules if rule.name == "unverified_send")
+    busiest.hits = busiest.evaluated = 1000
+
+    with caplog.at_level(logging.INFO):
+        assert not rules.check(failed_spam_txn(), "txn message")
+
+    assert rules.rules[0] is busiest
+    assert [(record.name, record.getMessage()) for record in caplog.records] == \
+           [("fail", "check_txn - Txn failed - txn message")]
+
+
+def test_rule_stats_are_exported():
+    rules = compile_rules({"chains": ["arb"]})
+    evaluated = rule_evaluations.snapshot()["values"].get(("chains", ), 0)
+    hits = rule_hits.snapshot()["values"].get(("chains", ), 0)
+
+    rules.check(failed_spam_txn(), "txn message")
+
+    assert rule_evaluations.snapshot()["values"][("chains", )] == evaluated + 1
+    assert rule_hits.snapshot()["values"][("chains", )] == hits + 1
+
+
+@pytest.mark.parametrize("status, failed", [(0, True), ("0", True), (1, False), ("1", False), (None, False),
+                                            ("", False)])
+def test_failed_status_is_read_as_a_number(status, failed):
+    txn = Transaction("0x" + "b" * 64, "eth", 1_700_000_000.0, tx_name="transfer", status=status,
+                      receives=[TokenTransfer("eth", 1.0)])
+
+    assert is_failed(txn, "transfer", "eth") is failed
+    assert compile_rules().check(txn, "txn message") is not failed
@@ -0,0 +1,61 @@
+import pytest
+
+from src.cryptowallets import scheduler
+from src.cryptowallets.scheduler import WalletScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(scheduler, "monotonic", fake)
+
+    return fake
+
+
+def test_first_polls_are_spread(clock):
+    wallets = WalletScheduler(4, min_interval=8)
+
+    assert wallets.pop_due() == [0]
+    clock.now += 4
+    assert wallets.pop_due() == [1, 2]
+    assert wallets.wait_time() == 2
+
+
+def test_quiet_wallets_back_off_and_recover(clock):
+    wallets = WalletScheduler(1, min_interval=10, max_interval=30, backoff=2)
+
+    for interval in (20, 30, 30):
+        assert wallets.pop_due() == [0]
+        wallets.reschedule(0, 0)
+        assert wallets.intervals[0] == interval
+        clock.now += interval
+
+    wallets.pop_due()
+    wallets.reschedule(0, None)  # A failed poll keeps the interval
+    assert wallets.intervals[0] == 30
+
+    clock.now += 30
+    wallets.pop_due()
+    wallets.reschedule(0, 2)  # Activity drops it back to the min interval
+    assert wallets.intervals[0] == 10
+    assert wallets.wait_time() == 10
+
+
+def test_request_budget_caps_polls(clock):
+    wallets = WalletScheduler(10, min_interval=1, requests_per_min=6)
+    clock.now += 1
+
+    assert len(wallets.pop_due()) == 6
+    assert wallets.pop_due() == []
+    assert wallets.wait_time() == pytest.approx(10)  # One request every 10 secs
+
+    clock.now += 10
+    assert len(wallets.pop_due()) == 1
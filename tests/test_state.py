@@ -0,0 +1,103 @@
+import sqlite3
+
+from time import sleep
+from threading import (
+    Event,
+    Thread,
+)
+
+import pytest
+
+from src.cryptowallets.state import StateStore
+from src.cryptowallets.decode import decode_history
+from src.cryptowallets.datatypes import SeenTxns
+from src.cryptowallets.cache import (
+    get_project,
+    get_token,
+    token_cache,
+)
+
+
+def test_wallet_round_trip(tmp_path, history_body):
+    page = decode_history(history_body)
+    seen = SeenTxns(page.history_list, capacity=10)
+
+    store = StateStore(str(tmp_path / "state" / "wallets.db"))
+    store.save_wallet("0xabc", page.history_list, seen)
+    store.close()
+
+    store = StateStore(str(tmp_path / "state" / "wallets.db"))
+    loaded = store.load_wallet("0xabc", capacity=10)
+
+    assert store.load_wallet("0xdef") is None
+    assert list(loaded._ids) == list(seen._ids)  # Same ids, in eviction order
+    assert loaded.high_water == seen.high_water
+    assert loaded.diff(page.history_list) == []
+
+
+def test_metadata_round_trip(tmp_path, history_body):
+    page = decode_history(history_body)
+
+    store = StateStore(str(tmp_path / "wallets.db"))
+    store.save_metadata(page)
+    store.load_metadata()
+
+    assert get_token("eth", "eth").symbol == "ETH"
+    assert get_project("uniswap3").name == "Uniswap V3"
+    assert not token_cache.is_fresh(("eth", "eth"))  # Saved prices are stale after a restart
+
+
+def test_legacy_state_file_is_migrated(tmp_path):
+    path = str(tmp_path / "wallets.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE wallets (address TEXT PRIMARY KEY, high_water REAL)")
+    conn.execute("INSERT INTO wallets VALUES ('0xabc', 1700000000.0)")
+    conn.commit()
+    conn.close()
+
+    seen = StateStore(path).load_wallet("0xabc")
+
+    assert seen.high_water == 1700000000.0 and seen.evicted_at == 0.0
+
+
+def test_unacknowledged_alerts_outlive_the_store(tmp_path, history_body):
+    page = decode_history(history_body)
+    seen = SeenTxns(page.history_list, capacity=10)
+    path = str(tmp_path / "wallets.db")
+
+    store = StateStore(path)
+    alert_ids = store.save_wallet("0xabc", page.history_list[:2], seen, [("-1001", "first"), ("-1002", "second")])
+    store.delete_alerts(alert_ids[:1])
+    store.close()
+
+    store = StateStore(path)
+    assert store.load_alerts(["0xabc"]) == [(alert_ids[1], "-1002", "second")]
+    assert store.load_alerts(["0xdef"]) == []  # Alerts of another shard's wallets
+    assert store.load_alerts(["0xabc"], max_age=-1) == []  # Alerts older than max_age are dropped
+    assert store.load_alerts(["0xabc"]) == []
+
+
+def test_shards_wait_for_each_others_writes(tmp_path, history_body):
+    page = decode_history(history_body)
+    seen = SeenTxns(page.history_list, capacity=10)
+    path = str(tmp_path / "wallets.db")
+    shards = [StateStore(path, timeout=5), StateStore(path, timeout=0.1)]
+
+    # Another shard holds the write lock for a while
+    def hold_lock():
+        conn = sqlite3.connect(path)
+        conn.execute("BEGIN IMMEDIATE")
+        locked.set()
+        sleep(0.3)
+        conn.commit()
+        conn.close()
+
+    locked = Event()
+    Thread(target=hold_lock).start()
+    locked.wait()
+
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        shards[1].save_wallet("0xdef", page.history_list, seen)
+    shards[0].save_wallet("0xabc", page.history_list, seen)  # Waits for the lock
+
+    assert StateStore(path).load_wallets(["0xabc", "0xdef"]).keys() == {"0xabc"}
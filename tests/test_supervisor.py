@@ -0,0 +1,73 @@
+import os
+import time
+
+from src.cryptowallets.datatypes import Wallet
+from src.cryptowallets.common import variables
+from src.cryptowallets.common.logger import (
+    attach_logging,
+    log_error,
+    start_logging,
+)
+from src.cryptowallets.supervisor import (
+    HashRing,
+    mp_context,
+    shard_wallets,
+)
+
+
+def make_wallets(count: int) -> list:
+    return [Wallet(f"0x{i:040x}", f"wallet {i}") for i in range(count)]
+
+
+def test_hash_ring_is_stable_and_case_insensitive():
+    address = "0xAbCdEf" + "0" * 34
+
+    assert HashRing(4).shard(address) == HashRing(4).shard(address.lower())
+
+
+def test_shard_wallets_spreads_evenly():
+    wallets = make_wallets(2000)
+    shards = shard_wallets(wallets, 4)
+
+    assert sorted(wallet.address for shard in shards for wallet in shard) == sorted(w.address for w in wallets)
+    assert all(300 < len(shard) < 700 for shard in shards)
+
+
+def test_adding_a_shard_moves_few_wallets():
+    wallets = make_wallets(2000)
+    before, after = HashRing(4), HashRing(5)
+    moved = sum(before.shard(wallet.address) != after.shard(wallet.address) for wallet in wallets)
+
+    # Consistent hashing moves about 1/5 of the wallets to the new shard, modulo hashing about 4/5
+    assert moved < len(wallets) * 0.3
+
+
+def test_bench_hash_ring_shard(bench):
+    ring = HashRing(8)
+    secs = bench(lambda: ring.shard("0x" + "ab" * 20), number=10000)
+
+    print(f"\nHashRing.shard {secs * 1e6:.2f}us per wallet")
+
+
+def log_from_worker(queue, message: str) -> None:
+    attach_logging(queue)
+    log_error.warning(message)
+
+
+def test_spawned_workers_log_through_listener():
+    assert mp_context.get_start_method() == "spawn"
+
+    message = f"spawned worker {os.getpid()}"
+    process = mp_context.Process(target=log_from_worker, args=(start_logging(), message))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+    path = os.path.join(variables.LOG_DIR, "error.log")
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if os.path.exists(path) and message in open(path).read():
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError("Worker record was not written by the listener")
@@ -0,0 +1,148 @@
+import pytest
+import requests
+
+from time import sleep
+from stem import SocketError
+
+from src.cryptowallets import tor
+from src.cryptowallets.tor import (
+    Circuit,
+    CircuitPool,
+    TimedAdapter,
+    build_circuits,
+    launch_tor,
+    wait_for_tor,
+)
+from src.cryptowallets.common.metrics import request_seconds
+
+
+def timed_session() -> requests.Session:
+    session = requests.Session()
+    session.mount("http://", TimedAdapter())
+
+    return session
+
+
+def test_timed_adapter_times_new_connections(http_server):
+    with timed_session() as session:
+        first = session.get(f"{http_server}/history/list")
+        second = session.get(f"{http_server}/history/list")
+
+    # The connect hook is used on every requests version, incl. 2.32+ where get_connection is bypassed
+    assert first.timing.connect > 0
+    assert second.timing.connect == 0  # Reused keep-alive connection
+    assert first.timing.total >= first.timing.connect + first.timing.tls
+
+
+def test_timed_adapter_exports_timings(http_server):
+    before = request_seconds.snapshot()["values"].get(("connect", ), [0])[-1]
+
+    with timed_session() as session:
+        session.get(http_server)
+
+    assert request_seconds.snapshot()["values"][("connect", )][-1] == before + 1
+
+
+def test_bench_survives_newnym_errors(monkeypatch):
+    def change_ip(**kwargs):
+        raise OSError("Connection refused")
+
+    monkeypatch.setattr(tor, "change_ip", change_ip)
+    circuit = Circuit(9050, 9051)
+    pool = CircuitPool([circuit], bench_time=60)
+
+    pool.bench(circuit)
+
+    assert pool.acquire() is None  # Still benched
+    assert circuit.next_newnym == 0.0  # NEWNYM is retried on the next bench
+
+
+def test_build_circuits_control_ports():
+    assert [circuit.control_port for circuit in build_circuits([9050])] == [9051]
+    assert [circuit.control_port for circuit in build_circuits([9050, 9060], 1, [9051, 9061])] == [9051, 9061]
+    assert len(build_circuits([9050, 9060], 4)) == 8  # Isolated circuits are not rotated with NEWNYM
+
+    with pytest.raises(Exception):
+        build_circuits([9050, 9060])
+    with pytest.raises(Exception):
+        build_circuits([9050, 9060], 1, [9051])
+
+
+class FakeController:
+    """Stand-in for stem's Controller answering bootstrap phases in turn, the last one forever."""
+    phases = []
+    refused = set()
+
+    def __init__(self, port):
+        self.port = port
+
+    @classmethod
+    def from_port(cls, port):
+        if port in cls.refused:
+            raise SocketError("Connection refused")
+        return cls(port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def authenticate(self, password=None):
+        pass
+
+    def get_info(self, key):
+        if key == "status/circuit-established":
+            return "1"
+        return self.phases.pop(0) if len(self.phases) > 1 else self.phases[0]
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(tor, "Controller", FakeController)
+    monkeypatch.setattr(FakeController, "refused", set())
+
+    return FakeController
+
+
+def test_phases_without_progress_are_skipped(controller):
+    controller.phases = ["NOTICE BOOTSTRAP PROGRESS=50 TAG=loading_descriptors",
+                         "WARN BOOTSTRAP WARNING=\"Network is unreachable\"",
+                         "NOTICE BOOTSTRAP PROGRESS=100 TAG=done SUMMARY=\"Done\""]
+
+    startup = wait_for_tor(password="pass", check_every=0.01, timeout=5)
+
+    assert startup.bootstrap >= startup.control_port
+    assert controller.phases == ["NOTICE BOOTSTRAP PROGRESS=100 TAG=done SUMMARY=\"Done\""]
+
+
+def test_wait_reports_the_last_progress(controller):
+    controller.phases = ["NOTICE BOOTSTRAP PROGRESS=45 TAG=requesting_descriptors", "WARN BOOTSTRAP WARNING=\"x\""]
+
+    with pytest.raises(TimeoutError, match="bootstrapped 45%"):
+        wait_for_tor(password="pass", check_every=0.01, timeout=0.1)
+
+
+def test_control_ports_share_one_deadline(controller, monkeypatch, tmp_path):
+    class Process:
+        def poll(self):
+            return None
+
+    monkeypatch.setattr(tor.subprocess, "Popen", lambda *args, **kwargs: Process())
+    controller.phases = ["NOTICE BOOTSTRAP PROGRESS=100 TAG=done"]
+    controller.refused = {9061}
+
+    # The first control port takes most of the timeout to be ready
+    timeouts = []
+
+    def slow_wait_for_tor(port, timeout, process):
+        timeouts.append(timeout)
+        if port == 9051:
+            sleep(0.4)
+        return wait_for_tor(port=port, timeout=timeout, process=process, check_every=0.01)
+
+    monkeypatch.setattr(tor, "wait_for_tor", slow_wait_for_tor)
+    with pytest.raises(TimeoutError):
+        launch_tor(str(tmp_path / "tor.txt"), [9051, 9061, 9071], timeout=0.5)
+
+    assert len(timeouts) == 2 and timeouts[1] <= 0.1  # The second port only has what is left
@@ -0,0 +1,48 @@
+import requests
+
+from requests.sessions import merge_setting
+from requests.structures import CaseInsensitiveDict
+
+from src.cryptowallets.useragents import UserAgentPool
+
+
+def test_agents_are_read_on_first_use():
+    pool = UserAgentPool()
+    assert pool._agents == []
+
+    agents = pool.agents
+    assert agents and all(agent and not agent.startswith("#") for agent in agents)
+
+
+def test_next_rotates_through_every_agent():
+    pool = UserAgentPool(pin=False)
+    rotation = [pool.get(9050) for _ in range(len(pool.agents))]
+
+    assert sorted(rotation) == sorted(pool.agents)
+
+
+def test_pinned_agent_follows_the_circuit():
+    pool = UserAgentPool()
+
+    assert pool.get(9050, "abc") == pool.get(9050, "abc")
+    # Rotating a circuit's isolation gives it another fingerprint
+    assert len({pool.get(9050, f"isolation-{i}") for i in range(20)}) > 1
+
+
+def test_bench_request_headers(bench):
+    pool = UserAgentPool()
+    session = requests.Session()
+    session.headers["User-Agent"] = pool.get(9050)
+
+    def merge_headers(headers):
+        return merge_setting(headers, session.headers, dict_class=CaseInsensitiveDict)
+
+    # Pinned sessions carry their user agent, rotating ones merge it into every request's headers
+    pinned_secs = bench(lambda: merge_headers(None), number=10000)
+    rotated_secs = bench(lambda: merge_headers({"User-Agent": pool.next()}), number=10000)
+    get_secs = bench(lambda: pool.get(9050, "abc"), number=10000)
+
+    print(f"\nRequest headers: pinned {pinned_secs * 1e6:.2f}us, rotated {rotated_secs * 1e6:.2f}us; "
+          f"pinned user agent lookup {get_secs * 1e6:.2f}us")
+    assert merge_headers(None)["User-Agent"] == pool.get(9050)
+    assert merge_headers({"User-Agent": "rotated"})["User-Agent"] == "rotated"